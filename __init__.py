@@ -1,3 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from . import models
\ No newline at end of file
+from . import models
+from . import wizard
+
+from odoo import SUPERUSER_ID, api
+
+
+def post_init_hook(cr, registry) :
+    """Instalación sobre datos existentes: rellena el índice de compras de los contratos."""
+    env = api.Environment ( cr, SUPERUSER_ID, {} )
+    env["sale.quotations"]._backfill_purchase_links ( batch_size=500 )
@@ -2,22 +2,43 @@
 {
     "name": "sid_bankbonds_sales_module",
     "summary": "Gestión de avales con contratos vinculados, estados y chatter",
-    "version": "15.0.1.0.0",
+    "version": "15.0.1.1.0",
     "author": "oscarsidsa81",
     "website": "https://sid-sa.com",
     "category": "Accounting/Finance",
     "license": "AGPL-3",
-    "depends": ["base", "mail", "purchase", "account", "sale","documents","oct_sale_extra_fields"],  # sale por sale.order; account por account.journal
+    "depends": ["base", "mail", "purchase", "account", "sale","documents","oct_sale_extra_fields",
+                "sale_stock", "purchase_stock"],  # sale por sale.order; account por account.journal; sale_stock/purchase_stock por los grupos de aprovisionamiento
     "data": [
         "security/security.xml",
         "security/ir_rule.xml",
         "security/ir.model.access.csv",
         "data/folders.xml",
-        "data/automation.xml",
+        "data/cron.xml",
         'views/sale_quotations_views.xml',
         'views/sale_quotations_action_menu.xml',
         "views/bonds_views.xml",
+        "views/bonds_exposure_views.xml",
+        "views/account_journal_views.xml",
+        "views/sale_order_views.xml",
+        "views/res_config_settings_views.xml",
+        "views/bonds_profiling_views.xml",
+        "wizard/bonds_import_wizard_views.xml",
+        "wizard/bonds_pdf_import_wizard_views.xml",
     ],
+    "assets": {
+        "web.assets_backend": [
+            "sid_bankbonds_sales_module/static/src/js/family_tree.js",
+            "sid_bankbonds_sales_module/static/src/scss/family_tree.scss",
+            "sid_bankbonds_sales_module/static/src/js/bonds_dashboard.js",
+            "sid_bankbonds_sales_module/static/src/scss/bonds_dashboard.scss",
+        ],
+        "web.assets_qweb": [
+            "sid_bankbonds_sales_module/static/src/xml/family_tree.xml",
+            "sid_bankbonds_sales_module/static/src/xml/bonds_dashboard.xml",
+        ],
+    },
+    "post_init_hook": "post_init_hook",
     'installable' : True,
     'auto_install' : False,
     'application' : False,
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import SUPERUSER_ID, api
+
+_logger = logging.getLogger ( __name__ )
+
+
+def migrate(cr, version) :
+    """
+    Rellena el índice de compras (procurement_group_ids / stored_purchase_count)
+    al actualizar; en instalación lo hace post_init_hook.
+    """
+    if not version :
+        return
+    env = api.Environment ( cr, SUPERUSER_ID, {} )
+    families = env["sale.quotations"]._backfill_purchase_links ( batch_size=500 )
+    _logger.info ( "Índice de compras de contratos rellenado: %s familias", families )
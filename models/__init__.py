@@ -1,3 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from . import bonds_order
\ No newline at end of file
+from . import bonds_profiling
+from . import bonds_order
+from . import bonds_variation_queue
+from . import res_users
+from . import bonds_exposure
+from . import bonds_credit_line
+from . import res_config_settings
+from . import sale_order
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools import float_compare
+
+
+class BondsCreditLine ( models.Model ) :
+    """
+    Línea de avales de un banco (account.journal) en una moneda: límite
+    configurable y total vigente acumulado (used_amount).
+
+    used_amount es un acumulado que se mantiene en la misma transacción que
+    mueve los avales (ver BondsOrder.write): la fila se bloquea con
+    SELECT ... FOR UPDATE antes de comprobar el límite, de modo que dos
+    activaciones concurrentes no pueden superar la línea.
+    """
+    _name = "sid_bonds_credit_line"
+    _description = "Línea de avales por banco"
+    _order = "journal_id, currency_id"
+
+    journal_id = fields.Many2one ( "account.journal", string="Banco",
+                                   required=True, ondelete="cascade",
+                                   index=True )
+    currency_id = fields.Many2one ( "res.currency", string="Moneda",
+                                    required=True )
+    limit_amount = fields.Monetary ( string="Límite",
+                                     currency_field="currency_id",
+                                     help="0 = sin límite." )
+    used_amount = fields.Monetary ( string="Avales vigentes",
+                                    currency_field="currency_id",
+                                    readonly=True )
+    available_amount = fields.Monetary ( string="Disponible",
+                                         currency_field="currency_id",
+                                         compute="_compute_available_amount" )
+
+    _sql_constraints = [
+        ("journal_currency_uniq", "unique(journal_id, currency_id)",
+         "Solo puede haber una línea de avales por banco y moneda."),
+    ]
+
+    @api.depends ( "limit_amount", "used_amount" )
+    def _compute_available_amount(self) :
+        for line in self :
+            line.available_amount = (line.limit_amount - line.used_amount
+                                     if line.limit_amount else 0.0)
+
+    def init(self) :
+        self._recompute_used_amounts ()
+
+    @api.model
+    def _recompute_used_amounts(self) :
+        """Recalcula todos los acumulados desde sid_bonds_orders (alta/upgrade)."""
+        self.env.cr.execute ( """
+            INSERT INTO sid_bonds_credit_line (journal_id, currency_id,
+                                               limit_amount, used_amount)
+            SELECT DISTINCT journal_id, currency_id, 0, 0
+              FROM sid_bonds_orders
+             WHERE state = 'active'
+               AND journal_id IS NOT NULL AND currency_id IS NOT NULL
+            ON CONFLICT (journal_id, currency_id) DO NOTHING;
+
+            UPDATE sid_bonds_credit_line line
+               SET used_amount = COALESCE((
+                       SELECT SUM(COALESCE(b.amount, 0))
+                         FROM sid_bonds_orders b
+                        WHERE b.state = 'active'
+                          AND b.journal_id = line.journal_id
+                          AND b.currency_id = line.currency_id), 0);
+        """ )
+        self.invalidate_cache ()
+
+    @api.model
+    def _apply_usage(self, deltas) :
+        """
+        Aplica {(journal_id, currency_id): delta} a los acumulados.
+
+        Las filas se crean si faltan y se bloquean (FOR UPDATE, en orden fijo
+        para no provocar interbloqueos) antes de comprobar el límite; si algún
+        incremento lo supera se lanza UserError y la transacción se deshace.
+        """
+        deltas = {key : delta for key, delta in deltas.items ()
+                  if key[0] and key[1] and delta}
+        if not deltas :
+            return
+        keys = sorted ( deltas )
+        cr = self.env.cr
+        cr.execute ( """
+            INSERT INTO sid_bonds_credit_line (journal_id, currency_id,
+                                               limit_amount, used_amount,
+                                               create_uid, create_date,
+                                               write_uid, write_date)
+            SELECT k.journal_id, k.currency_id, 0, 0,
+                   %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+              FROM unnest(%s::int[], %s::int[]) AS k(journal_id, currency_id)
+            ON CONFLICT (journal_id, currency_id) DO NOTHING
+        """, (self.env.uid, self.env.uid, [k[0] for k in keys], [k[1] for k in keys]) )
+        cr.execute ( """
+            SELECT id, journal_id, currency_id, limit_amount, used_amount
+              FROM sid_bonds_credit_line
+             WHERE (journal_id, currency_id) IN %s
+             ORDER BY journal_id, currency_id
+               FOR UPDATE
+        """, (tuple ( keys ),) )
+        rows = cr.fetchall ()
+
+        currencies = self.env["res.currency"].browse ( {row[2] for row in rows} )
+        rounding = {c.id : c.rounding for c in currencies}
+        updates, errors = [], []
+        for line_id, journal_id, currency_id, limit, used in rows :
+            delta = deltas[(journal_id, currency_id)]
+            new_used = float ( used or 0.0 ) + delta
+            if delta > 0 and limit and float_compare (
+                    new_used, float ( limit ), precision_rounding=rounding[currency_id] ) > 0 :
+                errors.append ( (journal_id, currency_id, float ( limit ), new_used) )
+                continue
+            updates.append ( (line_id, delta) )
+
+        if errors :
+            journals = self.env["account.journal"].browse ( [e[0] for e in errors] )
+            names = {j.id : j.display_name for j in journals}
+            raise UserError ( _ ( "Se supera la línea de avales del banco:\n%s" ) % "\n".join (
+                _ ( "%(journal)s: límite %(limit).2f %(currency)s, quedaría en %(used).2f" ) % {
+                    "journal" : names[journal_id],
+                    "limit" : limit,
+                    "currency" : currencies.browse ( currency_id ).name,
+                    "used" : used,
+                }
+                for journal_id, currency_id, limit, used in errors
+            ) )
+
+        cr.execute ( """
+            UPDATE sid_bonds_credit_line line
+               SET used_amount = COALESCE(line.used_amount, 0) + d.delta,
+                   write_uid = %s, write_date = now() at time zone 'UTC'
+              FROM unnest(%s::int[], %s::numeric[]) AS d(id, delta)
+             WHERE line.id = d.id
+        """, (self.env.uid, [u[0] for u in updates], [u[1] for u in updates]) )
+        self.invalidate_cache ( ["used_amount", "available_amount"] )
+
+
+class AccountJournal ( models.Model ) :
+    _inherit = "account.journal"
+
+    bond_credit_line_ids = fields.One2many ( "sid_bonds_credit_line",
+                                             "journal_id",
+                                             string="Líneas de avales" )
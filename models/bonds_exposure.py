@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+_PRECOMMIT_KEY = "sid_bonds_exposure.partners"
+
+# Clave de agrupación; los NULL cuentan como un valor más (avales sin cliente)
+_GROUP_KEY = """
+    (COALESCE(journal_id, 0)), (COALESCE(partner_id, 0)),
+    (COALESCE(aval_type, '')), (COALESCE(state, '')),
+    (COALESCE(currency_id, 0)), (COALESCE(company_id, 0))
+"""
+
+
+class BondsExposure ( models.Model ) :
+    """
+    Riesgo vivo con bancos y clientes: tabla agregada (materializada) de
+    sid_bonds_orders por banco/cliente/tipo/estado/moneda/compañía.
+    Además de los totales en la moneda del aval se guardan los normalizados
+    a moneda de compañía, que son los que dan el ratio importe / base.
+
+    No es una vista: se mantiene de forma incremental. Cada create/write/
+    unlink de avales (y cada cambio de base_pedidos) apunta los clientes
+    afectados y, justo antes del commit, se recalculan solo sus filas.
+    """
+    _name = "sid_bonds_exposure"
+    _description = "Riesgo de avales por banco y cliente"
+    _auto = False
+    _order = "company_id, journal_id, partner_id, aval_type, state"
+
+    journal_id = fields.Many2one ( "account.journal", string="Banco", readonly=True )
+    partner_id = fields.Many2one ( "res.partner", string="Cliente", readonly=True )
+    aval_type = fields.Selection (
+        selection=lambda self : self.env["sid_bonds_orders"]._fields["aval_type"].selection,
+        string="Tipo de aval", readonly=True )
+    state = fields.Selection (
+        selection=lambda self : self.env["sid_bonds_orders"]._fields["state"].selection,
+        string="Estado", readonly=True )
+    currency_id = fields.Many2one ( "res.currency", string="Moneda", readonly=True )
+    company_id = fields.Many2one ( "res.company", string="Compañía", readonly=True )
+    company_currency_id = fields.Many2one ( related="company_id.currency_id",
+                                            string="Moneda compañía" )
+    amount_total = fields.Monetary ( string="Importe avales",
+                                     currency_field="currency_id", readonly=True )
+    base_total = fields.Monetary ( string="Base Imponible Pedidos",
+                                   currency_field="currency_id", readonly=True )
+    amount_company_total = fields.Monetary ( string="Importe avales (moneda compañía)",
+                                             currency_field="company_currency_id",
+                                             readonly=True )
+    base_company_total = fields.Monetary ( string="Base Imponible Pedidos (moneda compañía)",
+                                           currency_field="company_currency_id",
+                                           readonly=True )
+    bond_count = fields.Integer ( string="Nº avales", readonly=True )
+    coverage_ratio = fields.Float ( string="Importe / Base", readonly=True,
+                                    digits=(16, 4), group_operator="avg" )
+
+    def init(self) :
+        # Solo contiene datos derivados: se rehace entera en cada alta/upgrade
+        self.env.cr.execute ( """
+            DROP TABLE IF EXISTS sid_bonds_exposure;
+            CREATE TABLE sid_bonds_exposure (
+                id serial PRIMARY KEY,
+                journal_id integer,
+                partner_id integer,
+                aval_type varchar,
+                state varchar,
+                currency_id integer,
+                company_id integer,
+                amount_total numeric,
+                base_total numeric,
+                amount_company_total numeric,
+                base_company_total numeric,
+                bond_count integer,
+                coverage_ratio double precision
+            );
+            CREATE INDEX sid_bonds_exposure_partner_id_index
+                ON sid_bonds_exposure (partner_id);
+            CREATE INDEX sid_bonds_exposure_journal_id_index
+                ON sid_bonds_exposure (journal_id);
+            CREATE UNIQUE INDEX sid_bonds_exposure_group_uniq
+                ON sid_bonds_exposure (""" + _GROUP_KEY + """);
+        """ )
+        # Se rellena al final de la carga: los campos calculados nuevos de
+        # los avales (p. ej. importes en moneda de compañía) ya estarán en BD
+        self.pool.post_init ( self._refresh_all )
+
+    def _refresh_all(self) :
+        self.env["sid_bonds_orders"].flush ()
+        self._refresh ()
+
+    @api.model
+    def _refresh(self, partner_ids=None) :
+        """
+        Recalcula las filas de los clientes indicados (None = tabla entera).
+        partner_ids puede incluir False/None para los avales sin cliente.
+
+        Las filas se actualizan con upsert sobre el índice único de la clave
+        de agrupación y luego se borran las que ya no salen. Si dos
+        transacciones refrescan el mismo cliente a la vez, la segunda espera
+        en el índice y falla por serialización (Odoo reintenta la petición)
+        en lugar de duplicar filas.
+        """
+        condition, params = "", []
+        if partner_ids is not None :
+            ids = [p for p in partner_ids if p]
+            with_null = len ( ids ) != len ( partner_ids )
+            condition = "partner_id = ANY(%s) OR (%s AND partner_id IS NULL)"
+            params = [ids, with_null]
+
+        self.env.cr.execute ( """
+            INSERT INTO sid_bonds_exposure (
+                journal_id, partner_id, aval_type, state, currency_id,
+                company_id, amount_total, base_total, amount_company_total,
+                base_company_total, bond_count, coverage_ratio)
+            SELECT journal_id, partner_id, aval_type, state, currency_id,
+                   company_id,
+                   SUM(COALESCE(amount, 0)),
+                   SUM(COALESCE(base_pedidos, 0)),
+                   SUM(COALESCE(amount_company, 0)),
+                   SUM(COALESCE(base_pedidos_company, 0)),
+                   COUNT(*),
+                   SUM(COALESCE(amount_company, 0))
+                       / NULLIF(SUM(COALESCE(base_pedidos_company, 0)), 0)
+              FROM sid_bonds_orders
+        """ + ("WHERE " + condition if condition else "") + """
+             GROUP BY journal_id, partner_id, aval_type, state, currency_id,
+                      company_id
+                ON CONFLICT (""" + _GROUP_KEY + """) DO UPDATE
+               SET amount_total = EXCLUDED.amount_total,
+                   base_total = EXCLUDED.base_total,
+                   amount_company_total = EXCLUDED.amount_company_total,
+                   base_company_total = EXCLUDED.base_company_total,
+                   bond_count = EXCLUDED.bond_count,
+                   coverage_ratio = EXCLUDED.coverage_ratio
+            RETURNING id
+        """, params )
+        kept = [row[0] for row in self.env.cr.fetchall ()]
+        self.env.cr.execute (
+            "DELETE FROM sid_bonds_exposure WHERE id <> ALL(%s) AND ("
+            + (condition or "TRUE") + ")", [kept] + params )
+        self.invalidate_cache ()
+
+    @api.model
+    def _mark_partners(self, partner_ids) :
+        """Apunta clientes a refrescar antes del commit (una vez por transacción)."""
+        pending = self.env.cr.precommit.data.get ( _PRECOMMIT_KEY )
+        if pending is None :
+            pending = self.env.cr.precommit.data[_PRECOMMIT_KEY] = set ()
+            self.env.cr.precommit.add ( self._refresh_pending )
+        pending.update ( p or None for p in partner_ids )
+
+    def _refresh_pending(self) :
+        # lo pendiente del ORM (p. ej. base_pedidos recalculada) debe estar en
+        # BD; se vuelca antes de sacar la lista porque el volcado de la base
+        # también apunta clientes (ver BondsOrder._write)
+        self.env["sid_bonds_orders"].flush ()
+        pending = self.env.cr.precommit.data.pop ( _PRECOMMIT_KEY, None )
+        if not pending :
+            return
+        self._refresh ( list ( pending ) )
+
+    @api.model
+    def get_partner_exposure(self, partner_id) :
+        """
+        Riesgo de un cliente desde la tabla agregada (búsqueda por índice):
+        [{journal_id, aval_type, state, currency_id, company_id,
+          amount_total, base_total, amount_company_total,
+          base_company_total, bond_count, coverage_ratio}].
+        """
+        self.check_access_rights ( "read" )
+        self.env.cr.execute ( """
+            SELECT journal_id, aval_type, state, currency_id, company_id,
+                   amount_total, base_total, amount_company_total,
+                   base_company_total, bond_count, coverage_ratio
+              FROM sid_bonds_exposure
+             WHERE partner_id = %s
+        """, (partner_id,) )
+        return self.env.cr.dictfetchall ()
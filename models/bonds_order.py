@@ -1,12 +1,52 @@
 # -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import json
 import logging
+import time
 
-from odoo import _, api, fields, models
+import psycopg2
+
+from odoo import _, _lt, api, fields, models, tools
 from odoo.exceptions import UserError
 from odoo.exceptions import ValidationError
+from odoo.tools import float_compare
+
+from .bonds_profiling import profiled
+from .currency_rate_cache import CurrencyRateCache
 
 _logger = logging.getLogger ( __name__ )
 
+_PARTNER_WARNING_KEY = "sale.quotations.partner_warnings"
+_PURCHASE_LINKS_KEY = "sale.quotations.purchase_links"
+_DASHBOARD_VERSION_KEY = "sid_bonds_orders.dashboard_version"
+
+# Panel de avales: {(bd, compañías, grupos, idioma): (caduca, versión, payload)}
+_DASHBOARD_CACHE = {}
+
+
+def _create_trigram_index(cr, indexname, tablename, column) :
+    """
+    Índice GIN pg_trgm sobre `column` (acelera ilike '%...%'). Si la
+    extensión no está y el usuario de BD no puede crearla, se avisa en el
+    log y la búsqueda sigue funcionando sin índice.
+    """
+    if tools.index_exists ( cr, indexname ) :
+        return True
+    cr.execute ( "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'" )
+    if not cr.fetchone () :
+        try :
+            with cr.savepoint ( flush=False ) :
+                cr.execute ( "CREATE EXTENSION IF NOT EXISTS pg_trgm" )
+        except psycopg2.Error :
+            _logger.warning ( "No se puede crear la extensión pg_trgm: índice %s omitido. "
+                              "Un superusuario puede ejecutar CREATE EXTENSION pg_trgm "
+                              "y actualizar el módulo.", indexname )
+            return False
+    cr.execute ( 'CREATE INDEX IF NOT EXISTS "%s" ON "%s" USING gin ("%s" gin_trgm_ops)'
+                 % (indexname, tablename, column) )
+    return True
+
 
 class BondsOrder ( models.Model ) :
     _name = "sid_bonds_orders"
@@ -17,6 +57,22 @@ class BondsOrder ( models.Model ) :
     _BOND_STATES_SKIP_NOTIFY = {"expired", "solicit_dev", "recovered",
                                 "solicit_can", "cancelled"}
 
+    # Campos que mueven el acumulado de sid_bonds_credit_line
+    _CREDIT_LINE_FIELDS = {"state", "amount", "journal_id", "currency_id"}
+
+    # Campos agregados en sid_bonds_exposure
+    _EXPOSURE_FIELDS = {"partner_id", "journal_id", "aval_type", "state",
+                        "currency_id", "amount", "issue_date", "company_id"}
+
+    # % de cobertura objetivo por tipo de aval (ir.config_parameter)
+    _COVERAGE_TARGET_PARAM = "sid_bankbonds_sales_module.coverage_target_%s"
+    _COVERAGE_TARGET_DEFAULTS = {"fiel" : 10.0}
+
+    # Panel: TTL de la caché (segundos) y plazos de vencimiento mostrados
+    _DASHBOARD_TTL_PARAM = "sid_bankbonds_sales_module.dashboard_ttl"
+    _DASHBOARD_TTL_DEFAULT = 60
+    _DASHBOARD_EXPIRY_DAYS = (30, 60, 90)
+
     name = fields.Char (
         string="Referencia",
         default=lambda self : _ ( "New" ),
@@ -24,7 +80,7 @@ class BondsOrder ( models.Model ) :
         store=True,
         tracking=True,
     )
-    reference = fields.Char ( string="Referencia (externa)" )
+    reference = fields.Char ( string="Referencia (externa)", index=True )
 
     partner_id = fields.Many2one ( "res.partner", string="Cliente",
                                    tracking=True, store=True )
@@ -40,6 +96,19 @@ class BondsOrder ( models.Model ) :
     amount = fields.Monetary ( string="Importe", currency_field="currency_id",
                                store=True, tracking=True )
 
+    # Importes normalizados a moneda de compañía (informes multi-moneda)
+    company_id = fields.Many2one ( "res.company", string="Compañía",
+                                   default=lambda self : self.env.company,
+                                   index=True )
+    company_currency_id = fields.Many2one ( related="company_id.currency_id",
+                                            string="Moneda compañía" )
+    amount_company = fields.Monetary (
+        string="Importe (moneda compañía)",
+        currency_field="company_currency_id",
+        compute="_compute_amount_company",
+        store=True,
+    )
+
     issue_date = fields.Date ( string="Fecha Emisión", store=True,
                                tracking=True )
     due_date = fields.Date ( string="Fecha vencimiento", store=True,
@@ -47,12 +116,37 @@ class BondsOrder ( models.Model ) :
     is_digital = fields.Boolean ( string="Digital", store=True, tracking=True )
     reviewed = fields.Boolean ( string="Revisado", store=True, tracking=True )
 
+    # Pedidos confirmados efectivos del aval: de sus contratos, mismo
+    # cliente y state='sale'. Relación indexada en ambos sentidos
+    # (ver sale.order.bond_ids)
+    sale_order_ids = fields.Many2many (
+        "sale.order",
+        relation="sid_bonds_sale_order_rel",
+        column1="bond_id",
+        column2="order_id",
+        string="Pedidos confirmados",
+        compute="_compute_sale_order_ids",
+        store=True,
+        readonly=True,
+        copy=False,
+    )
+
     origin_document = fields.Char (
         string="Documento de Origen",
         compute="_compute_documento_origen",
         store=True,
     )
 
+    # Texto de búsqueda (referencias, documento de origen y nombres de los
+    # contratos) con índice trigram: una sola condición ilike indexada
+    search_text = fields.Char (
+        string="Buscar",
+        compute="_compute_search_text",
+        store=True,
+        readonly=True,
+        copy=False,
+    )
+
     contract_ids = fields.Many2many (
         "sale.quotations",
         relation="sid_bonds_quotation_rel",
@@ -67,13 +161,69 @@ class BondsOrder ( models.Model ) :
         string="Base Imponible Pedidos",
         currency_field="currency_id",
         compute="_compute_base_pedidos",
-        store=False,
+        store=True,
         readonly=True,
         copy=True,
         tracking=True,
     )
+    base_pedidos_company = fields.Monetary (
+        string="Base Imponible Pedidos (moneda compañía)",
+        currency_field="company_currency_id",
+        compute="_compute_base_pedidos",
+        store=True,
+        readonly=True,
+        copy=False,
+    )
+    # Valor anterior de base_pedidos (último distinto persistido en BD);
+    # lo mantiene _write al volcar una base nueva
+    base_pedidos_prev = fields.Monetary (
+        string="Base Imponible Pedidos (anterior)",
+        currency_field="currency_id",
+        readonly=True,
+        copy=False,
+    )
+
+    # Cobertura: importe del aval sobre la base de pedidos (moneda compañía),
+    # comparada con el % objetivo de su tipo (ver _get_coverage_targets)
+    coverage_ratio = fields.Float (
+        string="Cobertura (importe / base)",
+        compute="_compute_coverage",
+        store=True,
+        digits=(16, 4),
+        group_operator="avg",
+    )
+    coverage_status = fields.Selection (
+        [
+            ("none", "Sin objetivo"),
+            ("covered", "Cubierto"),
+            ("under", "Infracubierto"),
+        ],
+        string="Estado cobertura",
+        compute="_compute_coverage",
+        store=True,
+        index=True,
+    )
+    # Último cambio de coverage_status
+    coverage_status_date = fields.Datetime (
+        string="Cambio estado cobertura",
+        compute="_compute_coverage",
+        store=True,
+        index=True,
+        copy=False,
+    )
+    # Pasó a infracubierto y aún no se ha avisado: se fija en la misma
+    # transacción que el cambio y lo limpia el cron de avisos
+    coverage_alert_pending = fields.Boolean (
+        string="Aviso de cobertura pendiente",
+        compute="_compute_coverage",
+        store=True,
+        index=True,
+        copy=False,
+    )
 
     pdf_aval = fields.Binary ( string="PDF Aval", attachment=True, store=True )
+    # Pendiente de sincronizar con Documents (lo procesa el cron)
+    document_sync_pending = fields.Boolean ( copy=False, index=True )
 
     state = fields.Selection (
         [
@@ -103,9 +253,10 @@ class BondsOrder ( models.Model ) :
             ("adel", "Adelanto"),
             ("fiel", "Fiel Cumplimiento"),
             ("gar", "Garantía"),
+            # legacy: solo para leer registros antiguos (create/write lo bloquean)
+            ("fiel_gar", "Fiel garantía"),
         ],
         string="Tipo de aval",
-        compute="_compute_aval_type_display",
         required=True,
         tracking=True,
     )
@@ -132,94 +283,427 @@ class BondsOrder ( models.Model ) :
             if vals.get ( "aval_type" ) == "fiel_gar" :
                 raise ValidationError (
                     _ ( "No se permite crear registros con 'Fiel garantía'." ) )
-        return super ().create ( vals_list )
 
+        # Referencia de secuencia ya en los vals (bloque reservado de una vez),
+        # sin un write posterior por registro
+        vals_list = [dict ( vals ) for vals in vals_list]
+        pending = [vals for vals in vals_list
+                   if vals.get ( "name", _ ( "New" ) ) == _ ( "New" )]
+        for vals, name in zip ( pending, self._reserve_bond_names ( len ( pending ) ) ) :
+            vals["name"] = name
+
+        # Documents: se sincroniza en diferido (ver _cron_sync_pdf_documents)
+        for vals in vals_list :
+            if vals.get ( "pdf_aval" ) :
+                vals["document_sync_pending"] = True
+        records = super ().create ( vals_list )
+        if records.filtered ( "document_sync_pending" ) :
+            self._trigger_pdf_documents_sync ()
+        self.env["sid_bonds_exposure"]._mark_partners (
+            set ( records.mapped ( lambda b : b.partner_id.id ) ) )
+        records._apply_credit_line_usage ( {} )
+        self._invalidate_dashboard ()
+        return records
+
+    @api.model
+    def _reserve_bond_names(self, count) :
+        """
+        Reserva `count` referencias de la secuencia 'sid_bonds_orders'.
+        Con implementación estándar se piden todas en una sola consulta
+        (nextval sobre generate_series); si no hay secuencia devuelve 'New'.
+        """
+        if not count :
+            return []
+        seq = self.env["ir.sequence"].sudo ().search ( [
+            ("code", "=", "sid_bonds_orders"),
+            ("company_id", "in", [self.env.company.id, False]),
+        ], order="company_id", limit=1 )
+        if not seq :
+            return [_ ( "New" )] * count
+
+        if seq.implementation == "standard" and not seq.use_date_range :
+            self.env.cr.execute (
+                "SELECT nextval(%s) FROM generate_series(1, %s)",
+                ("ir_sequence_%03d" % seq.id, count) )
+            numbers = sorted ( row[0] for row in self.env.cr.fetchall () )
+            return [seq.get_next_char ( number ) for number in numbers]
+
+        # no_gap / rangos por fecha: la lógica estándar de ir.sequence
+        return [seq._next () for _i in range ( count )]
+
+    @api.model
+    def _import_bonds_rows(self, rows) :
+        """
+        Crea avales a partir de un bloque de filas [(nº de fila, dict
+        columna -> valor)]. Columnas: reference, partner (NIF o nombre),
+        journal (código o nombre), aval_type (código o etiqueta), amount,
+        currency, issue_date, due_date, contracts (nombres separados por ','
+        o ';'), is_digital, description.
+
+        Clientes, bancos, monedas y contratos se resuelven con mapas en memoria
+        construidos una vez por bloque. Devuelve (avales creados, errores),
+        con errores como [(nº de fila, mensaje)].
+        """
+        rows = list ( rows )
+        lookups = self._import_build_lookups ( [row for _line, row in rows] )
+
+        vals_list, lines, errors = [], [], []
+        for line, row in rows :
+            try :
+                vals_list.append ( self._import_prepare_vals ( row, lookups ) )
+                lines.append ( line )
+            except UserError as e :
+                errors.append ( (line, e.args[0]) )
+
+        bonds = self.browse ()
+        if not vals_list :
+            return bonds, errors
+        try :
+            with self.env.cr.savepoint () :
+                bonds = self.create ( vals_list )
+        except (UserError, ValidationError) :
+            # bloque fallido: se reintenta fila a fila para aislar los errores
+            for line, vals in zip ( lines, vals_list ) :
+                try :
+                    with self.env.cr.savepoint () :
+                        bonds |= self.create ( vals )
+                except (UserError, ValidationError) as e :
+                    errors.append ( (line, e.args[0]) )
+        return bonds, errors
+
+    @api.model
+    def _import_build_lookups(self, rows) :
+        """Mapas clave -> id para las referencias de un bloque de filas."""
+
+        def _values(column) :
+            return {str ( row.get ( column ) ).strip ()
+                    for row in rows if row.get ( column )}
+
+        partner_keys = _values ( "partner" )
+        journal_keys = _values ( "journal" )
+        currency_keys = {c.upper () for c in _values ( "currency" )}
+        contract_keys = {
+            name.strip ()
+            for value in _values ( "contracts" )
+            for name in value.replace ( ";", "," ).split ( "," ) if name.strip ()
+        }
+
+        partners = {}
+        if partner_keys :
+            for p in self.env["res.partner"].search_read ( [
+                "|", ("vat", "in", list ( partner_keys )),
+                ("name", "in", list ( partner_keys )),
+            ], ["vat", "name"] ) :
+                partners.setdefault ( p["name"], p["id"] )
+                if p["vat"] :
+                    partners[p["vat"]] = p["id"]
+
+        journals = {}
+        if journal_keys :
+            for j in self.env["account.journal"].search_read ( [
+                "|", ("code", "in", list ( journal_keys )),
+                ("name", "in", list ( journal_keys )),
+            ], ["code", "name"] ) :
+                journals.setdefault ( j["name"], j["id"] )
+                journals[j["code"]] = j["id"]
+
+        currencies = {}
+        if currency_keys :
+            currencies = {
+                c["name"] : c["id"]
+                for c in self.env["res.currency"].search_read (
+                    [("name", "in", list ( currency_keys ))], ["name"] )
+            }
+
+        contracts = {}
+        if contract_keys :
+            contracts = {
+                q["name"] : q["id"]
+                for q in self.env["sale.quotations"].search_read (
+                    [("name", "in", list ( contract_keys ))], ["name"] )
+            }
+
+        return {
+            "partner" : partners,
+            "journal" : journals,
+            "currency" : currencies,
+            "contracts" : contracts,
+        }
+
+    @api.model
+    def _import_prepare_vals(self, row, lookups) :
+        """vals de create para una fila; UserError si algo no se resuelve."""
+
+        def _get(column) :
+            value = row.get ( column )
+            return str ( value ).strip () if value not in (None, False) else ""
+
+        def _resolve(column, key) :
+            if not key :
+                return False
+            if key not in lookups[column] :
+                raise UserError ( _ ( "No se encuentra %(col)s '%(key)s'." ) % {
+                    "col" : column, "key" : key} )
+            return lookups[column][key]
+
+        types = dict ( self._fields["aval_type"].selection )
+        aval_type = _get ( "aval_type" )
+        if aval_type not in types :
+            by_label = {label.lower () : code for code, label in types.items ()}
+            aval_type = by_label.get ( aval_type.lower () )
+        if not aval_type :
+            raise UserError ( _ ( "Tipo de aval desconocido: '%s'." ) % _get ( "aval_type" ) )
+
+        amount = self._import_parse_amount ( row.get ( "amount" ) )
+
+        contract_ids = [
+            _resolve ( "contracts", name.strip () )
+            for name in _get ( "contracts" ).replace ( ";", "," ).split ( "," )
+            if name.strip ()
+        ]
+
+        vals = {
+            "reference" : _get ( "reference" ) or False,
+            "partner_id" : _resolve ( "partner", _get ( "partner" ) ),
+            "journal_id" : _resolve ( "journal", _get ( "journal" ) ),
+            "aval_type" : aval_type,
+            "amount" : amount,
+            "issue_date" : self._import_parse_date ( row.get ( "issue_date" ) ),
+            "due_date" : self._import_parse_date ( row.get ( "due_date" ) ),
+            "is_digital" : _get ( "is_digital" ).lower () in ("1", "true", "si", "sí", "x"),
+            "description" : _get ( "description" ) or False,
+            "contract_ids" : [(6, 0, contract_ids)],
+        }
+        currency = _get ( "currency" ).upper ()
+        if currency :
+            vals["currency_id"] = _resolve ( "currency", currency )
+        return vals
+
+    @api.model
+    def _import_parse_amount(self, value) :
+        """
+        Importe de una celda: número (XLSX) o texto en formato español
+        ("1.500,00", "1500,5", "1.500") o inglés ("1,500.00", "1500.5").
+        Con los dos separadores, el último es el decimal; con uno solo, la
+        coma es decimal y el punto es de miles si va seguido de tres cifras
+        (o se repite). UserError si no es un importe, para que la fila se
+        rechace sola.
+        """
+        if value in (None, False, "") :
+            return 0.0
+        if isinstance ( value, (int, float) ) :
+            return float ( value )
+        text = str ( value ).strip ()
+        for char in (" ", "\xa0", "€", "$") :
+            text = text.replace ( char, "" )
+        if "," in text and "." in text :
+            thousands = "." if text.rfind ( "," ) > text.rfind ( "." ) else ","
+            text = text.replace ( thousands, "" )
+        elif text.count ( "," ) > 1 :
+            text = text.replace ( ",", "" )
+        elif text.count ( "." ) > 1 or (
+                "." in text and len ( text.rsplit ( ".", 1 )[1] ) == 3 ) :
+            text = text.replace ( ".", "" )
+        try :
+            return float ( text.replace ( ",", "." ) or 0.0 )
+        except ValueError :
+            raise UserError ( _ ( "Importe no válido: '%s'." ) % value )
+
+    @api.model
+    def _import_parse_date(self, value) :
+        if not value :
+            return False
+        if isinstance ( value, datetime.datetime ) :
+            return value.date ()
+        if isinstance ( value, datetime.date ) :
+            return value
+        value = str ( value ).strip ()
+        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y") :
+            try :
+                return datetime.datetime.strptime ( value, fmt ).date ()
+            except ValueError :
+                continue
+        raise UserError ( _ ( "Fecha no válida: '%s'." ) % value )
+
+    @api.model
+    def _match_pdf_references(self, tokens_by_key) :
+        """
+        Avales cuya referencia aparece entre los tokens de cada fichero.
+        tokens_by_key: {clave: set de tokens}; devuelve {clave: avales}, con
+        una sola búsqueda (índice de reference) para todo el bloque.
+        """
+        all_tokens = set ().union ( *tokens_by_key.values () ) if tokens_by_key else set ()
+        if not all_tokens :
+            return {}
+        by_reference = {}
+        for bond in self.search_read ( [("reference", "in", list ( all_tokens ))], ["reference"] ) :
+            by_reference.setdefault ( bond["reference"], [] ).append ( bond["id"] )
+        return {
+            key : self.browse ( sorted ( {bond_id
+                                          for token in tokens if token in by_reference
+                                          for bond_id in by_reference[token]} ) )
+            for key, tokens in tokens_by_key.items ()
+        }
+
+    @profiled
     def write(self, vals):
         # 0) Bloqueo: no permitir asignar "fiel_gar"
         # (OJO: esto impide cambiarlo A fiel_gar, pero NO impide que registros antiguos lo mantengan)
         if vals.get("aval_type") == "fiel_gar":
             raise ValidationError(_("No se permite asignar 'Fiel cumplimiento y Garantía'."))
 
-        # 1) Guardamos el valor anterior (calculado) antes del write
-        # OJO: base_pedidos es compute store=False => se calcula al acceder
-        old_map = {b.id: b.base_pedidos for b in self}
+        # 1) Guardamos el valor anterior antes del write, solo si el write
+        # puede mover la base (store=True: se lee de BD). Se compara la base
+        # normalizada a moneda de compañía.
+        triggers = {"contract_ids", "base_pedidos", "partner_id", "company_id"}  # añade aquí otros si aplica
+        check_variation = bool(triggers.intersection(vals.keys()))
+        old_map = {b.id: b.base_pedidos_company for b in self} if check_variation else {}
 
         # 2) Tu lógica de reference -> name (si viene reference en vals)
         if vals.get("reference"):
             vals = dict(vals)  # evitamos mutar el dict original
             vals["name"] = vals["reference"]
 
-        # 3) write normal
-        res = super().write(vals)
+        # PDF o referencia -> documento en Documents, en diferido
+        sync_documents = bool({"pdf_aval", "reference"}.intersection(vals.keys()))
+        if sync_documents:
+            vals = dict(vals, document_sync_pending=True)
+
+        # Riesgo por banco/cliente: filas de los clientes antes y después
+        touches_exposure = bool(self._EXPOSURE_FIELDS.intersection(vals.keys()))
+        if touches_exposure:
+            exposure_partners = set(self.mapped(lambda b: b.partner_id.id))
 
-        # 4) Post-proceso si el write tocó algo relevante
-        triggers = {"contract_ids", "base_pedidos", "partner_id"}  # añade aquí otros si aplica
-        if triggers.intersection(vals.keys()):
-            self._post_base_pedidos_variation_note(old_map)
+        # Línea de avales del banco: aportación vigente antes del write
+        touches_credit = bool(self._CREDIT_LINE_FIELDS.intersection(vals.keys()))
+        if touches_credit:
+            credit_before = self._get_credit_line_usage()
 
+        # 3) write normal
+        res = super().write(vals)
+        if sync_documents:
+            self._trigger_pdf_documents_sync()
+        if touches_credit:
+            self._apply_credit_line_usage(credit_before)
+        if touches_exposure:
+            exposure_partners.update(self.mapped(lambda b: b.partner_id.id))
+            self.env["sid_bonds_exposure"]._mark_partners(exposure_partners)
+
+        # 4) Post-proceso si el write tocó algo relevante: solo se encola,
+        # la nota/activity se publican desde el cron de la cola
+        if check_variation:
+            self._enqueue_base_pedidos_variation(old_map)
+
+        self._invalidate_dashboard()
         return res
 
-    def _schedule_creator_todo(self, old_value, new_value, pct) :
+    def _get_credit_line_usage(self) :
+        """{(journal_id, currency_id): importe vigente} de los avales de self."""
+        usage = {}
+        for bond in self :
+            if bond.state == "active" and bond.journal_id and bond.currency_id :
+                key = (bond.journal_id.id, bond.currency_id.id)
+                usage[key] = usage.get ( key, 0.0 ) + (bond.amount or 0.0)
+        return usage
+
+    def _apply_credit_line_usage(self, before) :
+        """Lleva a sid_bonds_credit_line la diferencia entre `before` y ahora."""
+        after = self._get_credit_line_usage ()
+        deltas = {key : after.get ( key, 0.0 ) - before.get ( key, 0.0 )
+                  for key in set ( before ) | set ( after )}
+        self.env["sid_bonds_credit_line"].sudo ()._apply_usage ( deltas )
+
+    def _schedule_creator_todos(self, variations) :
         """
-        Activity tipo 'Por hacer' para create_uid (si existe).
-        Evita duplicados abiertos con el mismo resumen.
+        Activity tipo 'Por hacer' para create_uid (si existe) de cada aval.
+        variations: {bond_id: (old_value, new_value, pct)}
+        Evita duplicados abiertos con el mismo resumen: la comprobación se
+        hace para todo el lote en una sola búsqueda.
         """
-        self.ensure_one ()
-        if not self.create_uid :
-            return
-
         # tipo de actividad 'Por hacer' estándar
         todo_type = self.env.ref ( "mail.mail_activity_data_todo",
                                    raise_if_not_found=False )
         if not todo_type :
             return
 
+        bonds = self.filtered ( lambda b : b.create_uid )
+        if not bonds :
+            return
+
         summary = _ ( "Revisar necesidad de ampliar aval" )
-        note = _ (
-            "Se detectó variación > 3%% en Base Imponible Pedidos.\n"
-            "Anterior: %(old)s\nNuevo: %(new)s\nCambio: %(pct).2f%%\n\n"
-            "Revisar si es necesario ampliar el aval o avales asociados."
-        ) % {"old" : old_value, "new" : new_value, "pct" : pct}
 
         # evita spam: si ya hay una activity abierta igual, no crear otra
-        existing = self.env["mail.activity"].search ( [
+        # (las actividades hechas se eliminan: toda activity existente está abierta)
+        existing = self.env["mail.activity"].search_read ( [
             ("res_model", "=", self._name),
-            ("res_id", "=", self.id),
-            ("user_id", "=", self.create_uid.id),
+            ("res_id", "in", bonds.ids),
+            ("user_id", "in", bonds.mapped ( "create_uid" ).ids),
             ("activity_type_id", "=", todo_type.id),
             ("summary", "=", summary),
-            ("state", "=", "planned"),
-        ], limit=1 )
-        if existing :
-            return
+        ], ["res_id", "user_id"] )
+        open_keys = {(a["res_id"], a["user_id"][0]) for a in existing}
 
         deadline = fields.Date.context_today ( self )  # hoy
-        self.activity_schedule (
-            activity_type_id=todo_type.id,
-            user_id=self.create_uid.id,
-            summary=summary,
-            note=note,
-            date_deadline=deadline,
-        )
+        for bond in bonds :
+            if (bond.id, bond.create_uid.id) in open_keys :
+                continue
+            old_value, new_value, pct = variations[bond.id]
+            note = _ (
+                "Se detectó variación > 3%% en Base Imponible Pedidos.\n"
+                "Anterior: %(old)s\nNuevo: %(new)s\nCambio: %(pct).2f%%\n\n"
+                "Revisar si es necesario ampliar el aval o avales asociados."
+            ) % {"old" : old_value, "new" : new_value, "pct" : pct}
+            bond.activity_schedule (
+                activity_type_id=todo_type.id,
+                user_id=bond.create_uid.id,
+                summary=summary,
+                note=note,
+                date_deadline=deadline,
+            )
 
     def _get_bonds_manager_partners(self) :
         """Devuelve res.partner (partners) de usuarios del grupo de Gestión de Avales."""
+        partner_ids, _mentions = self._get_bonds_manager_mentions ()
+        return self.env["res.partner"].browse ( partner_ids )
+
+    @api.model
+    def _get_bonds_manager_mentions(self) :
+        """
+        Devuelve (partner_ids, html de menciones) de los usuarios del grupo de
+        Gestión de Avales. Los ids se resuelven una vez por registro y grupo
+        (la caché se invalida cuando cambian los usuarios del grupo, ver
+        res_users.py); el html se genera en cada llamada con los nombres
+        actuales, en una sola lectura de los partners.
+        """
         group = self.env.ref (
             "sid_bankbonds_sales_module.group_bonds_manager",
             raise_if_not_found=False )
         if not group :
-            return self.env["res.partner"]
-        users = group.users
-        return users.mapped ( "partner_id" )
+            return (), ""
+        partner_ids = self._get_bonds_manager_partner_ids_cached ( group.id )
+        partners = self.env["res.partner"].sudo ().browse ( partner_ids )
+        mentions_html = " ".join (
+            '<a data-oe-model="res.partner" data-oe-id="%s">@%s</a>' % (
+                p.id, tools.html_escape ( p.display_name ))
+            for p in partners
+        )
+        return partner_ids, mentions_html
+
+    @tools.ormcache ( "group_id" )
+    def _get_bonds_manager_partner_ids_cached(self, group_id) :
+        users = self.env["res.groups"].sudo ().browse ( group_id ).users
+        return tuple ( users.mapped ( "partner_id" ).ids )
 
     def _post_base_pedidos_variation_note(self, old_map) :
         """
-        old_map: {bond_id: old_base_pedidos}
+        old_map: {bond_id: old_base_pedidos_company}, comparado con la base
+        actual en moneda de compañía.
         Si variación > 3% (contra valor anterior) y estado permitido:
           - publica nota interna mencionando a usuarios del grupo
           - crea activity tipo Por hacer para create_uid
         """
-        partners = self._get_bonds_manager_partners ()
+        partner_ids, mentions_html = self._get_bonds_manager_mentions ()
+        variations = {}
 
         for bond in self :
             # 1) estados excluidos
@@ -227,7 +711,7 @@ class BondsOrder ( models.Model ) :
                 continue
 
             old = float ( old_map.get ( bond.id, 0.0 ) or 0.0 )
-            new = float ( bond.base_pedidos or 0.0 )
+            new = float ( bond.base_pedidos_company or 0.0 )
 
             # si ambos 0, nada
             if old == 0.0 and new == 0.0 :
@@ -245,14 +729,7 @@ class BondsOrder ( models.Model ) :
             if not changed :
                 continue
 
-            # 3) menciones HTML (solo si hay partners)
-            mentions_html = ""
-            if partners :
-                mentions_html = " ".join (
-                    f'<a data-oe-model="res.partner" data-oe-id="{p.id}">@{p.display_name}</a>'
-                    for p in partners
-                )
-
+            # 3) menciones HTML (solo si hay partners), ya renderizadas
             body = _ (
                 "<p><b>Variación en Base Imponible Pedidos</b> (&gt; 3%%)</p>"
                 "<p>Anterior: %(old)s<br/>Nuevo: %(new)s<br/>Cambio: %(pct).2f%%</p>"
@@ -269,11 +746,32 @@ class BondsOrder ( models.Model ) :
                 body=body,
                 message_type="comment",
                 subtype_xmlid="mail.mt_note",
-                partner_ids=partners.ids if partners else None,
+                partner_ids=list ( partner_ids ) or None,
             )
 
-            # 5) Activity al creador
-            bond._schedule_creator_todo ( old, new, pct )
+            variations[bond.id] = (old, new, pct)
+
+        # 5) Activity al creador (en lote)
+        self.browse ( list ( variations ) )._schedule_creator_todos ( variations )
+
+    def _enqueue_base_pedidos_variation(self, old_map) :
+        """
+        Encola (aval, anterior, nuevo) para los avales cuya base ha cambiado.
+        La nota y la activity las genera el cron de la cola, fuera de la
+        transacción del usuario (ver sid_bonds_base_variation_queue).
+        """
+        vals_list = []
+        for bond in self :
+            old = float ( old_map.get ( bond.id, 0.0 ) or 0.0 )
+            new = float ( bond.base_pedidos_company or 0.0 )
+            if old != new :
+                vals_list.append ( {
+                    "bond_id" : bond.id,
+                    "old_value" : old,
+                    "new_value" : new,
+                } )
+        if vals_list :
+            self.env["sid_bonds_base_variation_queue"].sudo ().create ( vals_list )
 
     def action_view_sale_orders(self) :
         bonds = self.filtered ( lambda b : b.contract_ids )
@@ -281,11 +779,7 @@ class BondsOrder ( models.Model ) :
         if not bonds :
             return action
 
-        quotation_ids = bonds.mapped ( "contract_ids" ).ids
-        action["domain"] = [
-            ("quotations_id", "in", quotation_ids),
-            ("state", "=", "sale"),
-        ]
+        action["domain"] = [("id", "in", bonds.mapped ( "sale_order_ids" ).ids)]
         action["context"] = dict ( self.env.context )
         return action
 
@@ -293,14 +787,33 @@ class BondsOrder ( models.Model ) :
     @api.depends (
         "contract_ids",
         "partner_id",
+        "company_id",
         "contract_ids.sale_order_ids.amount_untaxed",
         "contract_ids.sale_order_ids.state",
         "contract_ids.sale_order_ids.partner_id",
+        "contract_ids.sale_order_ids.currency_id",
+        "contract_ids.sale_order_ids.date_order",
     )
+    @profiled
     def _compute_base_pedidos(self) :
+        # Registros guardados: una única agregación SQL para todo el recordset.
+        # Registros nuevos (NewId, onchange): lo que hay en memoria, en Python.
+        stored = self.filtered ( lambda b : isinstance ( b.id, int ) )
+        (self - stored)._compute_base_pedidos_python ()
+        if not stored :
+            return
+
+        totals = stored._get_base_pedidos_totals ()
+        for bond in stored :
+            bond.base_pedidos, bond.base_pedidos_company = totals.get ( bond.id, (0.0, 0.0) )
+
+    def _compute_base_pedidos_python(self) :
+        """Cálculo registro a registro (recorre pedidos en memoria)."""
+        caches = {}
         for bond in self :
             if not bond.contract_ids or not bond.partner_id :
                 bond.base_pedidos = 0.0
+                bond.base_pedidos_company = 0.0
                 continue
 
             orders = bond.contract_ids.mapped ( "sale_order_ids" ).filtered (
@@ -309,66 +822,823 @@ class BondsOrder ( models.Model ) :
             )
             bond.base_pedidos = sum ( orders.mapped ( "amount_untaxed" ) )
 
-    @api.depends ( "contract_ids", "partner_id" )
-    def _compute_documento_origen(self) :
-        for record in self :
-            if record.contract_ids and record.partner_id :
-                sale_orders = self.env["sale.order"].search ( [
-                    ("quotations_id", "in", record.contract_ids.ids),
-                    ("partner_id", "=", record.partner_id.id),
-                    ("state", "=", "sale"),
-                ] )
-                record.origin_document = ", ".join (
-                    sale_orders.mapped ( "name" ) )
+            company = bond.company_id or self.env.company
+            if company not in caches :
+                caches[company] = CurrencyRateCache (
+                    self.env, company, orders.mapped ( "currency_id" ).ids )
+            bond.base_pedidos_company = sum (
+                caches[company].convert ( so.amount_untaxed, so.currency_id.id, so.date_order )
+                for so in orders
+            )
+
+    def _get_base_pedidos_totals(self) :
+        """
+        Devuelve {bond_id: (suma amount_untaxed, suma en moneda de compañía)}
+        de los pedidos confirmados (state='sale') del mismo cliente que el
+        aval, para todos los avales de self en una sola consulta agrupada
+        sobre sid_bonds_quotation_rel. La conversión usa una caché de tipos
+        por (moneda, compañía, fecha del pedido) cargada una vez por lote.
+        Los avales sin contratos, sin cliente o sin pedidos no aparecen.
+        """
+        if not self.ids :
+            return {}
+        # La consulta lee de BD: volcamos antes lo pendiente en caché
+        self.flush ( ["partner_id", "contract_ids", "company_id"] )
+        self.env["sale.order"].flush (
+            ["quotations_id", "partner_id", "state", "amount_untaxed",
+             "currency_id", "date_order"] )
+        self.env.cr.execute ( """
+            SELECT rel.bond_id, so.currency_id, so.date_order::date,
+                   SUM(so.amount_untaxed)
+              FROM sid_bonds_quotation_rel rel
+              JOIN sid_bonds_orders bond ON bond.id = rel.bond_id
+              JOIN sale_order so ON so.quotations_id = rel.quotation_id
+                                 AND so.partner_id = bond.partner_id
+             WHERE rel.bond_id IN %s
+               AND so.state = 'sale'
+             GROUP BY rel.bond_id, so.currency_id, so.date_order::date
+        """, (tuple ( self.ids ),) )
+        rows = self.env.cr.fetchall ()
+
+        caches = self._get_rate_caches ( {row[1] for row in rows} )
+        totals = {}
+        for bond_id, currency_id, date, amount in rows :
+            bond = self.browse ( bond_id )
+            cache = caches[(bond.company_id or self.env.company).id]
+            raw, company = totals.get ( bond_id, (0.0, 0.0) )
+            totals[bond_id] = (raw + (amount or 0.0),
+                               company + cache.convert ( amount, currency_id, date ))
+        return totals
+
+    def _get_rate_caches(self, currency_ids) :
+        """{company_id: CurrencyRateCache} para las compañías de self."""
+        companies = self.mapped ( "company_id" ) or self.env.company
+        if not all ( self.mapped ( "company_id" ) ) :
+            companies |= self.env.company
+        return {company.id : CurrencyRateCache ( self.env, company, currency_ids )
+                for company in companies}
+
+    @api.depends ( "amount", "currency_id", "issue_date", "company_id" )
+    def _compute_amount_company(self) :
+        caches = self._get_rate_caches ( set ( self.mapped ( "currency_id" ).ids ) )
+        for bond in self :
+            cache = caches[(bond.company_id or self.env.company).id]
+            bond.amount_company = cache.convert (
+                bond.amount, bond.currency_id.id, bond.issue_date )
+
+    def _write(self, vals) :
+        """
+        Volcado a BD (también el de los campos calculados). Cuando se vuelca
+        una base_pedidos distinta de la persistida, se desplaza la anterior a
+        base_pedidos_prev y se avisa al riesgo por cliente y al panel, cambie
+        la base por el propio aval o por sus pedidos de venta. Así el cálculo
+        de la base queda sin efectos secundarios.
+        """
+        if "base_pedidos" not in vals or not self.ids :
+            return super ()._write ( vals )
+        # el flush agrupa los avales con los mismos valores: un solo UPDATE
+        self.env.cr.execute ( """
+            UPDATE sid_bonds_orders
+               SET base_pedidos_prev = base_pedidos
+             WHERE id IN %s
+               AND COALESCE(base_pedidos, 0) <> COALESCE(%s, 0)
+         RETURNING partner_id
+        """, (tuple ( self.ids ), vals["base_pedidos"]) )
+        changed_partners = {row[0] for row in self.env.cr.fetchall ()}
+        res = super ()._write ( vals )
+        if changed_partners :
+            self.invalidate_cache ( ["base_pedidos_prev"], self.ids )
+            self.env["sid_bonds_exposure"]._mark_partners ( changed_partners )
+            self._invalidate_dashboard ()
+        return res
+
+    # --- Cobertura ---
+    @api.model
+    def _get_coverage_targets(self) :
+        """{aval_type: % objetivo}; 0 = sin objetivo para ese tipo."""
+        params = self.env["ir.config_parameter"].sudo ()
+        targets = {}
+        for aval_type, _label in self._fields["aval_type"].selection :
+            value = params.get_param ( self._COVERAGE_TARGET_PARAM % aval_type,
+                                       self._COVERAGE_TARGET_DEFAULTS.get ( aval_type, 0.0 ) )
+            try :
+                targets[aval_type] = float ( value or 0.0 )
+            except ValueError :
+                targets[aval_type] = 0.0
+        return targets
+
+    @api.depends ( "amount_company", "base_pedidos_company", "aval_type" )
+    def _compute_coverage(self) :
+        targets = self._get_coverage_targets ()
+        stored = self.filtered ( lambda b : isinstance ( b.id, int ) )
+        persisted = stored._get_coverage_persisted () if stored else {}
+        now = fields.Datetime.now ()
+        for bond in self :
+            base = bond.base_pedidos_company
+            ratio = bond.amount_company / base if base else 0.0
+            target = targets.get ( bond.aval_type, 0.0 )
+            if not target or not base :
+                status = "none"
+            elif float_compare ( ratio * 100.0, target, precision_digits=4 ) < 0 :
+                status = "under"
+            else :
+                status = "covered"
+            old_status, old_date, old_pending = persisted.get (
+                bond.id, (bond._origin.coverage_status, bond._origin.coverage_status_date,
+                          bond._origin.coverage_alert_pending) )
+            bond.coverage_ratio = ratio
+            bond.coverage_status = status
+            if status == old_status :
+                bond.coverage_status_date = old_date
+                bond.coverage_alert_pending = old_pending
             else :
-                record.origin_document = False
+                bond.coverage_status_date = now
+                bond.coverage_alert_pending = status == "under"
+
+    def _get_coverage_persisted(self) :
+        """
+        {bond_id: (coverage_status, coverage_status_date, coverage_alert_pending)}
+        tal y como están en BD.
+        """
+        self.env.cr.execute ( """
+            SELECT id, coverage_status, coverage_status_date,
+                   COALESCE(coverage_alert_pending, FALSE)
+              FROM sid_bonds_orders
+             WHERE id IN %s
+        """, (tuple ( self.ids ),) )
+        return {bond_id : (status, date, pending)
+                for bond_id, status, date, pending in self.env.cr.fetchall ()}
+
+    @api.model
+    def _recompute_coverage(self, aval_types) :
+        """Recalcula la cobertura de los tipos cuyo objetivo ha cambiado."""
+        bonds = self.with_context ( active_test=False ).search (
+            [("aval_type", "in", list ( aval_types ))] )
+        for fname in ("coverage_ratio", "coverage_status", "coverage_status_date",
+                      "coverage_alert_pending") :
+            self.env.add_to_compute ( self._fields[fname], bonds )
+        bonds.recompute ()
+
+    @api.model
+    def _cron_check_coverage(self, batch_size=500) :
+        """
+        Avisa de los avales que han pasado a infracubiertos. Solo lee los
+        marcados con coverage_alert_pending (índice): la marca se confirma
+        junto con el cambio de cobertura, así que un aval calculado antes de
+        una ejecución pero confirmado después se avisa en la siguiente.
+        """
+        alerted = last_id = 0
+        while True :
+            bonds = self.search ( [("coverage_alert_pending", "=", True), ("id", ">", last_id)],
+                                  order="id", limit=batch_size )
+            if not bonds :
+                break
+            to_notify = bonds.filtered (
+                lambda b : b.coverage_status == "under"
+                and b.state not in self._BOND_STATES_SKIP_NOTIFY )
+            to_notify._notify_under_coverage ()
+            # solo si la cobertura no ha vuelto a cambiar desde la lectura
+            # (UPDATE reevalúa la condición sobre la fila confirmada)
+            self.env.cr.execute ( """
+                UPDATE sid_bonds_orders b
+                   SET coverage_alert_pending = FALSE
+                  FROM unnest(%s::int[], %s::timestamp[]) AS d(id, status_date)
+                 WHERE b.id = d.id
+                   AND b.coverage_status_date IS NOT DISTINCT FROM d.status_date
+            """, (bonds.ids, [b.coverage_status_date for b in bonds]) )
+            bonds.invalidate_cache ( ["coverage_alert_pending"] )
+            alerted += len ( to_notify )
+            last_id = bonds[-1].id
+            if not self.env.registry.in_test_mode () :
+                self.env.cr.commit ()
+
+        _logger.info ( "Cobertura de avales: %s avales infracubiertos avisados", alerted )
+        return alerted
+
+    def _notify_under_coverage(self) :
+        """Nota interna (en bloque) y activity Por hacer al creador de cada aval."""
+        targets = self._get_coverage_targets ()
+        _partner_ids, mentions_html = self._get_bonds_manager_mentions ()
+        mentions = f"<p>{mentions_html}</p>" if mentions_html else ""
+        self._message_log_batch (
+            bodies={
+                bond.id : _ (
+                    "<p><b>Aval infracubierto</b></p>"
+                    "<p>Cobertura: %(ratio).2f%% (objetivo %(target).2f%%)</p>%(mentions)s"
+                ) % {
+                    "ratio" : bond.coverage_ratio * 100.0,
+                    "target" : targets.get ( bond.aval_type, 0.0 ),
+                    "mentions" : mentions,
+                }
+                for bond in self
+            },
+            subtype_id=self.env["ir.model.data"]._xmlid_to_res_id ( "mail.mt_note" ),
+        )
+
+        todo_type = self.env.ref ( "mail.mail_activity_data_todo", raise_if_not_found=False )
+        if not todo_type :
+            return
+        summary = _ ( "Aval infracubierto: revisar importe" )
+        existing = self.env["mail.activity"].search_read ( [
+            ("res_model", "=", self._name),
+            ("res_id", "in", self.ids),
+            ("activity_type_id", "=", todo_type.id),
+            ("summary", "=", summary),
+        ], ["res_id"] )
+        open_ids = {a["res_id"] for a in existing}
+        deadline = fields.Date.context_today ( self )
+        for bond in self :
+            if bond.id in open_ids :
+                continue
+            bond.activity_schedule (
+                activity_type_id=todo_type.id,
+                user_id=bond.create_uid.id,
+                summary=summary,
+                date_deadline=deadline,
+            )
+
+    @api.depends ( "name", "reference", "origin_document", "contract_ids.name" )
+    def _compute_search_text(self) :
+        for bond in self :
+            parts = [bond.name, bond.reference, bond.origin_document]
+            parts += bond.contract_ids.mapped ( "name" )
+            bond.search_text = "\n".join ( p for p in parts if p ) or False
+
+    @api.depends (
+        "contract_ids",
+        "partner_id",
+        "contract_ids.sale_order_ids.state",
+        "contract_ids.sale_order_ids.partner_id",
+    )
+    @profiled
+    def _compute_sale_order_ids(self) :
+        # Registros guardados: una consulta para todo el recordset sobre
+        # sid_bonds_quotation_rel, en el orden de sale.order (date_order
+        # desc, id desc); NewId (onchange): en memoria
+        stored = self.filtered ( lambda b : isinstance ( b.id, int ) )
+        for bond in self - stored :
+            bond.sale_order_ids = bond.contract_ids.sale_order_ids.filtered (
+                lambda so : so.state == "sale" and so.partner_id == bond.partner_id )
+        if not stored :
+            return
+
+        stored.flush ( ["partner_id", "contract_ids"] )
+        self.env["sale.order"].flush ( ["quotations_id", "partner_id", "state"] )
+        self.env.cr.execute ( """
+            SELECT rel.bond_id, array_agg(so.id ORDER BY so.date_order DESC, so.id DESC)
+              FROM sid_bonds_quotation_rel rel
+              JOIN sid_bonds_orders bond ON bond.id = rel.bond_id
+              JOIN sale_order so ON so.quotations_id = rel.quotation_id
+                                 AND so.partner_id = bond.partner_id
+             WHERE rel.bond_id IN %s
+               AND so.state = 'sale'
+             GROUP BY rel.bond_id
+        """, (tuple ( stored.ids ),) )
+        orders = dict ( self.env.cr.fetchall () )
+        SaleOrder = self.env["sale.order"]
+        for bond in stored :
+            bond.sale_order_ids = SaleOrder.browse ( orders.get ( bond.id, [] ) )
+
+    @api.depends ( "sale_order_ids.name" )
+    def _compute_documento_origen(self) :
+        # Derivado de sale_order_ids (ya en el orden de sale.order)
+        for bond in self :
+            bond.origin_document = ", ".join ( bond.sale_order_ids.mapped ( "name" ) ) or False
+
+    # --- Transiciones de estado ---
+    # acción -> estado destino ("to"), estados de origen permitidos ("from",
+    # sin clave = cualquiera), estados que se ignoran sin error ("skip"),
+    # guardas por registro ("guards") y mensaje si el origen no es válido
+    _STATE_TRANSITIONS = {
+        "action_request" : {
+            "to" : "requested",
+            "from" : ("draft",),
+            "error" : _lt ( "Solo puedes solicitar desde Borrador." ),
+        },
+        "action_activate" : {
+            "to" : "active",
+            "from" : ("requested", "draft"),
+            "guards" : ("_guard_amount_positive",),
+            "error" : _lt ( "Solo puedes poner Vigente desde Solicitado o Borrador." ),
+        },
+        "action_expire" : {
+            "to" : "expired",
+            "from" : ("active",),
+            "error" : _lt ( "Solo puedes vencer un aval vigente." ),
+        },
+        "action_cancel" : {
+            "to" : "cancelled",
+            "skip" : ("expired", "cancelled"),
+        },
+        "action_set_draft" : {
+            "to" : "draft",
+        },
+    }
 
     def action_request(self) :
-        for rec in self :
-            if rec.state != "draft" :
-                raise UserError (
-                    _ ( "Solo puedes solicitar desde Borrador." ) )
-            rec.state = "requested"
+        return self._apply_state_transition ( "action_request" )
 
     def action_activate(self) :
-        for rec in self :
-            if rec.state not in ("requested", "draft") :
-                raise UserError (
-                    _ ( "Solo puedes poner Vigente desde Solicitado o Borrador." ) )
-            if not rec.amount or rec.amount <= 0 :
-                raise UserError ( _ ( "El importe debe ser positivo." ) )
-            rec.state = "active"
+        return self._apply_state_transition ( "action_activate" )
 
     def action_expire(self) :
-        for rec in self :
-            if rec.state != "active" :
-                raise UserError ( _ ( "Solo puedes vencer un aval vigente." ) )
-            rec.state = "expired"
+        return self._apply_state_transition ( "action_expire" )
 
     def action_cancel(self) :
+        return self._apply_state_transition ( "action_cancel" )
+
+    def action_set_draft(self) :
+        return self._apply_state_transition ( "action_set_draft" )
+
+    def _guard_amount_positive(self) :
+        if not self.amount or self.amount <= 0 :
+            return _ ( "El importe debe ser positivo." )
+        return None
+
+    def _check_state_transition(self, action) :
+        """Valida todo el recordset; devuelve [(aval, motivo)] sin lanzar."""
+        spec = self._STATE_TRANSITIONS[action]
+        allowed = spec.get ( "from" )
+        violations = []
         for rec in self :
-            if rec.state in ("expired", "cancelled") :
+            if allowed is not None and rec.state not in allowed :
+                violations.append ( (rec, str ( spec["error"] )) )
                 continue
-            rec.state = "cancelled"
+            for guard in spec.get ( "guards", () ) :
+                reason = getattr ( rec, guard ) ()
+                if reason :
+                    violations.append ( (rec, reason) )
+                    break
+        return violations
+
+    def _apply_state_transition(self, action) :
+        """
+        Aplica una transición de _STATE_TRANSITIONS a todo el recordset:
+        valida primero (informando de todas las infracciones a la vez) y
+        después escribe el estado con un único write.
+        """
+        spec = self._STATE_TRANSITIONS[action]
+        records = self.filtered ( lambda r : r.state not in spec.get ( "skip", () ) )
+        violations = records._check_state_transition ( action )
+        if violations :
+            records._raise_transition_violations ( violations )
+        records._write_state ( spec["to"] )
+        return True
+
+    def _raise_transition_violations(self, violations) :
+        if len ( violations ) == 1 and len ( self ) == 1 :
+            raise UserError ( violations[0][1] )
+        raise UserError ( "\n".join (
+            "%s: %s" % (rec.display_name, reason) for rec, reason in violations ) )
+
+    def _write_state(self, state) :
+        """
+        Un único write para todos los avales que cambian de estado. El
+        tracking por registro se sustituye por un create en bloque de los
+        mensajes con sus valores de seguimiento.
+        """
+        moving = self.filtered ( lambda r : r.state != state )
+        if not moving :
+            return
+        old_states = {rec.id : rec.state for rec in moving}
+        moving.with_context ( tracking_disable=True ).write ( {"state" : state} )
+        moving._log_state_tracking ( old_states )
 
-    def action_set_draft(self) :
+    def _log_state_tracking(self, old_states) :
+        """
+        Mensajes de seguimiento del campo state para todo self, en un create.
+        Mismos valores que mail.thread._message_log_batch (autor y email_from
+        resueltos sin error para usuarios sin email, reply_to, message_id),
+        más tracking_value_ids, que _message_log_batch no admite.
+        """
+        col_info = self.fields_get ( ["state"] )["state"]
+        sequence = getattr ( self._fields["state"], "tracking", 100 )
+        if sequence is True :
+            sequence = 100
+        subtype_id = self.env["ir.model.data"]._xmlid_to_res_id ( "mail.mt_note" )
+        author_id, email_from = self._message_compute_author ( raise_exception=False )
+        base_values = {
+            "model" : self._name,
+            "body" : "",
+            "message_type" : "notification",
+            "subtype_id" : subtype_id,
+            "author_id" : author_id,
+            "email_from" : email_from,
+            "reply_to" : self.env["mail.thread"]._notify_get_reply_to ( default=email_from )[False],
+            "record_name" : False,
+            "is_internal" : True,
+        }
+        Tracking = self.env["mail.tracking.value"]
+
+        vals_list = []
         for rec in self :
-            rec.state = "draft"
+            tracking = Tracking.create_tracking_values (
+                old_states[rec.id], rec.state, "state", col_info, sequence, self._name )
+            if not tracking :
+                continue
+            vals_list.append ( dict (
+                base_values,
+                res_id=rec.id,
+                message_id=tools.generate_tracking_message_id ( "message-notify" ),
+                tracking_value_ids=[(0, 0, tracking)],
+            ) )
+        if vals_list :
+            self.env["mail.message"].sudo ().create ( vals_list )
+
+    @api.model
+    def bulk_state_transition(self, ids, action, partial=False) :
+        """
+        Punto de entrada RPC para transiciones masivas, p. ej.
+        ``bulk_state_transition([1, 2, 3], "action_activate")``.
 
-    @api.model_create_multi
-    def create(self, vals_list) :
-        records = super ().create ( vals_list )
-        for rec in records :
-            if rec.name == _ ( "New" ) :
-                rec.name = self.env["ir.sequence"].next_by_code (
-                    "sid_bonds_orders" ) or _ ( "New" )
-        return records
+        Sin `partial`, cualquier infracción aborta todo (como las acciones).
+        Con `partial=True` se mueven los avales válidos y se devuelven los
+        demás en "errors". Devuelve {"done": [ids], "errors": [{id, name,
+        message}]}.
+        """
+        if action not in self._STATE_TRANSITIONS :
+            raise UserError ( _ ( "Transición desconocida: %s" ) % action )
+        spec = self._STATE_TRANSITIONS[action]
+        records = self.browse ( ids ).exists ()
+        records = records.filtered ( lambda r : r.state not in spec.get ( "skip", () ) )
+
+        violations = records._check_state_transition ( action )
+        if violations and not partial :
+            records._raise_transition_violations ( violations )
+        failed = self.browse ( [rec.id for rec, _reason in violations] )
+        valid = records - failed
+        valid._write_state ( spec["to"] )
+        return {
+            "done" : valid.ids,
+            "errors" : [
+                {"id" : rec.id, "name" : rec.display_name, "message" : reason}
+                for rec, reason in violations
+            ],
+        }
+
+    # --- Vencimiento automático ---
+    def init(self) :
+        super ().init ()
+        # búsqueda del cron de vencimientos: state = 'active' AND due_date <= hoy
+        tools.create_index ( self.env.cr, "sid_bonds_orders_state_due_date_index",
+                             self._table, ["state", "due_date"] )
+        # búsquedas ilike '%...%' por referencia y texto de búsqueda
+        for column in ("name", "reference", "search_text") :
+            _create_trigram_index ( self.env.cr, "sid_bonds_orders_%s_trgm_index" % column,
+                                    self._table, column )
+        # versión del panel: nextval no es transaccional, la ven todos los workers
+        self.env.cr.execute (
+            "CREATE SEQUENCE IF NOT EXISTS sid_bonds_dashboard_version_seq" )
+
+    @api.model
+    def _cron_expire_due_bonds(self, batch_size=1000, dry_run=False) :
+        """
+        Pasa a 'expired' los avales vigentes con fecha de vencimiento
+        alcanzada, por lotes: un único write por lote (sin tracking por
+        registro) y el mensaje de seguimiento del estado de cada aval creado
+        en bloque (ver _log_state_tracking), sin notas adicionales.
+        Con dry_run=True solo devuelve los ids afectados, sin escribir.
+        """
+        today = fields.Date.context_today ( self )
+        domain = [("state", "=", "active"), ("due_date", "<=", today)]
+        if dry_run :
+            return self.search ( domain, order="id" ).ids
+
+        started = time.monotonic ()
+        expired = batches = 0
+        while True :
+            bonds = self.search ( domain, order="id", limit=batch_size )
+            if not bonds :
+                break
+            bonds.with_context ( tracking_disable=True ).write ( {"state" : "expired"} )
+            bonds._log_state_tracking ( dict.fromkeys ( bonds.ids, "active" ) )
+            expired += len ( bonds )
+            batches += 1
+            if not self.env.registry.in_test_mode () :
+                self.env.cr.commit ()
+
+        metrics = {
+            "date" : fields.Date.to_string ( today ),
+            "expired" : expired,
+            "batches" : batches,
+            "seconds" : round ( time.monotonic () - started, 3 ),
+        }
+        self.env["ir.config_parameter"].sudo ().set_param (
+            "sid_bankbonds_sales_module.expire_last_run", json.dumps ( metrics ) )
+        _logger.info ( "Vencimiento de avales: %(expired)s avales en %(batches)s lotes "
+                       "(%(seconds)ss)", metrics )
+        return metrics
+
+    # --- Panel de avales ---
+    def _invalidate_dashboard(self) :
+        """
+        Marca el panel como obsoleto al confirmarse la transacción: una sola
+        vez por transacción se avanza la secuencia de versión, que todos los
+        workers comparan con la de su caché (ver get_dashboard_data).
+        """
+        postcommit = self.env.cr.postcommit
+        if postcommit.data.get ( _DASHBOARD_VERSION_KEY ) :
+            return
+        postcommit.data[_DASHBOARD_VERSION_KEY] = True
+        registry = self.pool
+
+        @postcommit.add
+        def bump_version() :
+            with registry.cursor () as cr :
+                cr.execute ( "SELECT nextval('sid_bonds_dashboard_version_seq')" )
+
+    @api.model
+    def _get_dashboard_version(self) :
+        self.env.cr.execute ( "SELECT last_value FROM sid_bonds_dashboard_version_seq" )
+        return self.env.cr.fetchone ()[0]
+
+    @api.model
+    def get_dashboard_data(self) :
+        """
+        Datos completos del panel de avales en una llamada: totales por
+        estado, vencimientos próximos, avales sin revisar, infracubiertos y
+        con cambio de base.
+
+        Se cachean por compañía actual (moneda de los importes), compañías
+        permitidas, grupos del usuario e idioma durante unos segundos (parámetro dashboard_ttl); cualquier create/write/unlink
+        de avales avanza la versión y el siguiente acceso recalcula.
+        """
+        self.check_access_rights ( "read" )
+        key = (
+            self.env.cr.dbname,
+            self.env.company.id,
+            tuple ( sorted ( self.env.companies.ids ) ),
+            tuple ( sorted ( self.env.user.groups_id.ids ) ),
+            self.env.lang,
+        )
+        version = self._get_dashboard_version ()
+        cached = _DASHBOARD_CACHE.get ( key )
+        if cached and cached[0] > time.monotonic () and cached[1] == version :
+            return cached[2]
+
+        payload = dict ( self._compute_dashboard_data (), version=version )
+        ttl = int ( self.env["ir.config_parameter"].sudo ().get_param (
+            self._DASHBOARD_TTL_PARAM, self._DASHBOARD_TTL_DEFAULT ) )
+        if ttl > 0 :
+            _DASHBOARD_CACHE[key] = (time.monotonic () + ttl, version, payload)
+        return payload
+
+    def _compute_dashboard_data(self) :
+        """
+        Payload del panel con tres consultas agregadas sobre sid_bonds_orders.
+        amount_company está en la moneda de la compañía de cada aval: las
+        sumas se agrupan por compañía y se pasan a la moneda de la compañía
+        actual antes de sumarlas.
+        """
+        self.flush ()
+        cr = self.env.cr
+        company = self.env.company
+        currency = company.currency_id
+        company_ids = self.env.companies.ids
+        today = fields.Date.context_today ( self )
+        closed = sorted ( self._BOND_STATES_SKIP_NOTIFY )
+        factors = {}
+
+        def to_currency(company_id, amount) :
+            """Importe en moneda de company_id (None = compañía actual) a la actual."""
+            if not amount :
+                return 0.0
+            from_currency = self.env["res.company"].browse ( company_id or company.id ).currency_id
+            if from_currency.id not in factors :
+                factors[from_currency.id] = from_currency._convert (
+                    1.0, currency, company, today, round=False )
+            return amount * factors[from_currency.id]
+
+        def amount_info(count, amount, domain) :
+            return {
+                "count" : count,
+                "amount" : amount or 0.0,
+                "amount_display" : tools.format_amount ( self.env, amount or 0.0, currency ),
+                "domain" : json.dumps ( domain ),
+            }
+
+        # 1) Totales por estado
+        cr.execute ( """
+            SELECT state, company_id, COUNT(*), SUM(amount_company)
+              FROM sid_bonds_orders
+             WHERE company_id IS NULL OR company_id = ANY(%s)
+             GROUP BY state, company_id
+        """, (company_ids,) )
+        by_state = {}
+        for state, company_id, count, amount in cr.fetchall () :
+            total_count, total_amount = by_state.get ( state, (0, 0.0) )
+            by_state[state] = (total_count + count,
+                               total_amount + to_currency ( company_id, amount ))
+        labels = dict ( self._fields["state"]._description_selection ( self.env ) )
+        states = []
+        for state, label in labels.items () :
+            count, amount = by_state.get ( state, (0, 0.0) )
+            states.append ( dict ( amount_info ( count, amount, [("state", "=", state)] ),
+                                   state=state, label=label ) )
+
+        # 2) Vencimientos, sin revisar e infracubiertos: una pasada con FILTER
+        limits = [today + datetime.timedelta ( days=days )
+                  for days in self._DASHBOARD_EXPIRY_DAYS]
+        expiry_columns = []
+        for i in range ( len ( limits ) ) :
+            cond = "state = 'active' AND due_date BETWEEN %%(today)s AND %%(limit_%s)s" % i
+            expiry_columns.append ( "COUNT(*) FILTER (WHERE {0}), "
+                                    "SUM(amount_company) FILTER (WHERE {0})".format ( cond ) )
+        params = {"today" : today, "closed" : closed, "company_ids" : company_ids}
+        params.update ( ("limit_%s" % i, limit) for i, limit in enumerate ( limits ) )
+        cr.execute ( "SELECT company_id, " + ", ".join ( expiry_columns ) + """,
+                   COUNT(*) FILTER (WHERE NOT COALESCE(reviewed, FALSE)),
+                   SUM(amount_company) FILTER (WHERE NOT COALESCE(reviewed, FALSE)),
+                   COUNT(*) FILTER (WHERE coverage_status = 'under'),
+                   SUM(amount_company) FILTER (WHERE coverage_status = 'under')
+              FROM sid_bonds_orders
+             WHERE state != ALL(%(closed)s)
+               AND (company_id IS NULL OR company_id = ANY(%(company_ids)s))
+             GROUP BY company_id
+        """, params )
+        # columnas alternas (nº, importe): se suman por compañía
+        row = [0, 0.0] * (len ( limits ) + 2)
+        for company_id, *values in cr.fetchall () :
+            for i in range ( 0, len ( row ), 2 ) :
+                row[i] += values[i] or 0
+                row[i + 1] += to_currency ( company_id, values[i + 1] )
+        expiring = []
+        for i, (days, limit) in enumerate ( zip ( self._DASHBOARD_EXPIRY_DAYS, limits ) ) :
+            domain = [("state", "=", "active"),
+                      ("due_date", ">=", fields.Date.to_string ( today )),
+                      ("due_date", "<=", fields.Date.to_string ( limit ))]
+            expiring.append ( dict ( amount_info ( row[2 * i], row[2 * i + 1], domain ),
+                                     days=days ) )
+        offset = 2 * len ( limits )
+        not_reviewed = amount_info ( row[offset], row[offset + 1], [
+            ("reviewed", "=", False), ("state", "not in", closed)] )
+        under_covered = amount_info ( row[offset + 2], row[offset + 3], [
+            ("coverage_status", "=", "under"), ("state", "not in", closed)] )
+
+        # 3) Cambio de base: mismo criterio que la nota de variación (> 3 %)
+        cr.execute ( """
+            SELECT b.id, b.name, p.name, b.base_pedidos_prev, b.base_pedidos,
+                   CASE WHEN COALESCE(b.base_pedidos_prev, 0) = 0 THEN 100.0
+                        ELSE ABS(b.base_pedidos - b.base_pedidos_prev)
+                             / ABS(b.base_pedidos_prev) * 100.0
+                   END AS pct
+              FROM sid_bonds_orders b
+              LEFT JOIN res_partner p ON p.id = b.partner_id
+             WHERE b.state != ALL(%s)
+               AND (b.company_id IS NULL OR b.company_id = ANY(%s))
+               AND CASE WHEN COALESCE(b.base_pedidos_prev, 0) = 0
+                        THEN COALESCE(b.base_pedidos, 0) != 0
+                        ELSE ABS(b.base_pedidos - b.base_pedidos_prev)
+                             / ABS(b.base_pedidos_prev) > 0.03
+                   END
+             ORDER BY pct DESC, b.id
+        """, (closed, company_ids) )
+        rows = cr.fetchall ()
+        base_changed = {
+            "count" : len ( rows ),
+            "domain" : json.dumps ( [("id", "in", [r[0] for r in rows])] ),
+            "bonds" : [
+                {"id" : bond_id, "name" : name, "partner" : partner or "",
+                 "old" : old or 0.0, "new" : new or 0.0, "pct" : round ( pct, 2 )}
+                for bond_id, name, partner, old, new, pct in rows[:10]
+            ],
+        }
+
+        return {
+            "generated_at" : fields.Datetime.to_string ( fields.Datetime.now () ),
+            "currency" : currency.name,
+            "states" : states,
+            "expiring" : expiring,
+            "not_reviewed" : not_reviewed,
+            "under_covered" : under_covered,
+            "base_changed" : base_changed,
+        }
+
+    # --- Documents (PDF del aval) ---
+    def _trigger_pdf_documents_sync(self) :
+        """Lanza el cron de sincronización en cuanto se confirme la transacción."""
+        cron = self.env.ref (
+            "sid_bankbonds_sales_module.ir_cron_sid_bonds_pdf_documents",
+            raise_if_not_found=False )
+        if cron :
+            cron.sudo ()._trigger ()
+
+    @api.model
+    def _cron_sync_pdf_documents(self, batch_size=200) :
+        """Sincroniza con Documents los avales pendientes, por lotes."""
+        bonds = self.search ( [("document_sync_pending", "=", True)],
+                              limit=batch_size )
+        if not bonds :
+            return
+        bonds._sync_pdf_documents ()
+        bonds.write ( {"document_sync_pending" : False} )
+        if self.search_count ( [("document_sync_pending", "=", True)] ) :
+            self._trigger_pdf_documents_sync ()
+
+    @profiled
+    def _sync_pdf_documents(self) :
+        """
+        Crea/actualiza el documents.document de cada aval con PDF.
+
+        Attachments del campo pdf_aval y documentos existentes se leen para
+        todo el lote en una consulta cada uno. Si el checksum del documento
+        coincide con el del PDF solo se actualizan nombre/cliente; si no, el
+        documento pasa a apuntar a un attachment que reutiliza el fichero del
+        filestore del PDF (mismo store_fname), sin copiar el contenido.
+        """
+        folder = self.env.ref ( "sid_bankbonds_sales_module.folder_avales",
+                                raise_if_not_found=False )
+        if not folder or not self :
+            return
+
+        Attachment = self.env["ir.attachment"].sudo ().with_context ( no_document=True )
+        Document = self.env["documents.document"].sudo ()
+
+        pdfs = Attachment.search ( [
+            ("res_model", "=", self._name),
+            ("res_field", "=", "pdf_aval"),
+            ("res_id", "in", self.ids),
+        ] )
+        pdf_by_bond = {att.res_id : att for att in pdfs}
+
+        doc_by_bond = {}
+        for doc in Document.search ( [
+            ("res_model", "=", self._name),
+            ("res_id", "in", list ( pdf_by_bond )),
+            ("folder_id", "=", folder.id),
+        ] ) :
+            doc_by_bond.setdefault ( doc.res_id, doc )
+
+        to_create = []
+        for bond in self :
+            pdf = pdf_by_bond.get ( bond.id )
+            if not pdf :
+                continue
+
+            raw_name = bond.reference or bond.name or "Aval"
+            meta = {
+                "name" : str ( raw_name ).strip () or "Aval",
+                "partner_id" : bond.partner_id.id,
+            }
+
+            doc = doc_by_bond.get ( bond.id )
+            if doc and doc.attachment_id.checksum == pdf.checksum :
+                # mismo contenido: solo metadatos, y solo si cambian
+                changes = {}
+                if doc.name != meta["name"] :
+                    changes["name"] = meta["name"]
+                if doc.partner_id.id != meta["partner_id"] :
+                    changes["partner_id"] = meta["partner_id"]
+                if changes :
+                    doc.write ( changes )
+                continue
+
+            shared = bond._share_pdf_attachment ( pdf, meta["name"] )
+            if doc :
+                doc.write ( dict ( meta, attachment_id=shared.id ) )
+            else :
+                to_create.append ( dict ( meta, attachment_id=shared.id,
+                                          folder_id=folder.id ) )
+
+        if to_create :
+            Document.create ( to_create )
+
+    def _share_pdf_attachment(self, pdf, name) :
+        """
+        Nuevo ir.attachment (sin res_field) del aval que apunta al mismo
+        fichero del filestore que `pdf`. create/write de ir.attachment ignoran
+        store_fname/checksum/file_size, por eso se fijan por SQL.
+        """
+        self.ensure_one ()
+        Attachment = self.env["ir.attachment"].sudo ().with_context ( no_document=True )
+        vals = {
+            "name" : name,
+            "res_model" : self._name,
+            "res_id" : self.id,
+            "mimetype" : pdf.mimetype or "application/pdf",
+        }
+        if not pdf.store_fname :
+            # almacenamiento en BD: no hay fichero que compartir
+            return Attachment.create ( dict ( vals, raw=pdf.raw ) )
+
+        shared = Attachment.create ( vals )
+        self.env.cr.execute ( """
+            UPDATE ir_attachment
+               SET store_fname = %s, checksum = %s, file_size = %s, mimetype = %s
+             WHERE id = %s
+        """, (pdf.store_fname, pdf.checksum, pdf.file_size, vals["mimetype"], shared.id) )
+        shared.invalidate_cache ( ["store_fname", "checksum", "file_size", "mimetype",
+                                   "raw", "datas", "db_datas"] )
+        return shared
 
     def unlink(self) :
         for rec in self :
             if rec.state in ("active", "expired") :
                 raise UserError (
                     _ ( "No puedes eliminar avales vigentes o vencidos." ) )
+        self.env["sid_bonds_exposure"]._mark_partners (
+            set ( self.mapped ( lambda b : b.partner_id.id ) ) )
+        self._invalidate_dashboard ()
         return super ().unlink ()
 
 
@@ -417,6 +1687,30 @@ class SaleQuotationsBonds ( models.Model ) :
         readonly=True,
     )
 
+    # Índice de compras: grupos de aprovisionamiento de los pedidos
+    # confirmados de la familia (igual en todos sus contratos) y nº de
+    # compras. Se mantienen desde sale.order / purchase.order / parent_id
+    # (ver _mark_purchase_links).
+    procurement_group_ids = fields.Many2many (
+        comodel_name="procurement.group",
+        relation="sid_quotation_procurement_group_rel",
+        column1="quotation_id",
+        column2="group_id",
+        string="Grupos de aprovisionamiento",
+        readonly=True,
+        copy=False,
+    )
+    stored_purchase_count = fields.Integer ( string="Compras", readonly=True,
+                                             copy=False )
+
+    # Aviso de varios clientes: hash del último publicado y repeticiones omitidas
+    partner_warning_hash = fields.Char ( copy=False, readonly=True )
+    partner_warning_suppressed = fields.Integer (
+        string="Avisos de cliente repetidos omitidos",
+        copy=False,
+        readonly=True,
+    )
+
     # Campo para mostrar SOLO los confirmados (state='sale')
     sale_order_sale_ids = fields.Many2many (
         comodel_name="sale.order",
@@ -426,6 +1720,32 @@ class SaleQuotationsBonds ( models.Model ) :
         readonly=True,
     )
 
+    def init(self) :
+        super ().init ()
+        # búsqueda de avales por nombre de contrato (contract_ids.name ilike)
+        _create_trigram_index ( self.env.cr, "sale_quotations_name_trgm_index",
+                                self._table, "name" )
+        # subárboles por prefijo (parent_path LIKE '1/5/%'): el índice btree
+        # normal no sirve para LIKE salvo con collation C
+        tools.create_index ( self.env.cr, "sale_quotations_parent_path_pattern_index",
+                             self._table, ["parent_path text_pattern_ops"] )
+
+    @api.model_create_multi
+    def create(self, vals_list) :
+        records = super ().create ( vals_list )
+        self._mark_purchase_links ( records.ids + records.mapped ( "parent_id" ).ids )
+        return records
+
+    def write(self, vals) :
+        # cambiar de principal mueve el contrato de familia: se refrescan
+        # la familia anterior y la nueva
+        if "parent_id" in vals :
+            self._mark_purchase_links ( self.ids + self.mapped ( "parent_id" ).ids )
+        res = super ().write ( vals )
+        if "parent_id" in vals :
+            self._mark_purchase_links ( self.mapped ( "parent_id" ).ids )
+        return res
+
     @api.constrains ( "parent_id", "child_ids" )
     def _check_parent_child_exclusive(self) :
         for rec in self :
@@ -442,12 +1762,33 @@ class SaleQuotationsBonds ( models.Model ) :
         "child_ids.sale_order_ids.state",
         "parent_id.sale_order_ids.state",
     )
+    @profiled
     def _compute_sale_order_sale_ids(self) :
+        families = self._get_family_quotation_ids_map ()
+
+        # Pedidos confirmados de todas las familias en una sola búsqueda
+        orders_by_quotation = {}
+        family_ids = set ().union ( *families.values () )
+        if family_ids :
+            orders = self.env["sale.order"].search ( [
+                ("quotations_id", "in", list ( family_ids )),
+                ("state", "=", "sale"),
+            ] )
+            for so in orders :
+                orders_by_quotation.setdefault ( so.quotations_id.id, [] ).append ( so.id )
+
         for rec in self :
-            family = rec._get_family_quotations ()
-            orders = family.mapped ( "sale_order_ids" ).filtered (
-                lambda so : so.state == "sale" )
-            rec.sale_order_sale_ids = orders
+            if rec not in families :
+                # NewId (onchange): familia en memoria
+                family = rec._get_family_quotations ()
+                rec.sale_order_sale_ids = family.mapped ( "sale_order_ids" ).filtered (
+                    lambda so : so.state == "sale" )
+                continue
+            rec.sale_order_sale_ids = [
+                so_id
+                for quotation_id in families[rec]
+                for so_id in orders_by_quotation.get ( quotation_id, [] )
+            ]
 
     @api.depends (
         "sale_order_sale_ids",
@@ -455,6 +1796,13 @@ class SaleQuotationsBonds ( models.Model ) :
         "sale_order_sale_ids.date_order",
     )
     def _compute_sale_partner_id(self) :
+        # Familias guardadas: el pedido más reciente de cada contrato sale de
+        # una sola consulta y aquí solo se elige el más reciente por familia
+        families = self._get_family_quotation_ids_map ()
+        family_ids = set ().union ( *families.values () )
+        latest = self.browse ( family_ids )._get_latest_sale_orders ()
+        warnings = {}
+
         for rec in self :
             partners = rec.sale_order_sale_ids.mapped (
                 "partner_id" ).filtered ( lambda p : p )
@@ -464,33 +1812,105 @@ class SaleQuotationsBonds ( models.Model ) :
                 continue
 
             # Elegimos el partner del pedido confirmado más reciente
-            # (si date_order es False, lo empujamos “hacia atrás” con un fallback mínimo)
-            def _key(so) :
-                return so.date_order or fields.Datetime.from_string (
-                    "1970-01-01 00:00:00" )
+            if rec in families :
+                candidates = [latest[q] for q in families[rec] if q in latest]
+                best = max ( candidates, key=self._latest_sale_order_key, default=None )
+                rec.partner_id = best[0] if best else False
+            else :
+                # NewId (onchange): pedidos en memoria
+                so_latest = rec.sale_order_sale_ids.sorted (
+                    key=lambda so : self._latest_sale_order_key (
+                        (so.partner_id.id, so.date_order, so.id or 0) ),
+                    reverse=True )[:1]
+                rec.partner_id = so_latest.partner_id.id if so_latest else False
+
+            # Aviso NO bloqueante si hay más de un cliente: solo se apunta,
+            # se publica tras el flush (ver _post_partner_warnings)
+            if len ( partners ) > 1 and rec.partner_id :
+                warnings[rec.id] = (rec.partner_id.id, tuple ( sorted ( partners.ids ) ))
 
-            so_latest = rec.sale_order_sale_ids.sorted ( key=_key,
-                                                         reverse=True )[:1]
-            # so_latest es un recordset de 0/1
-            rec.partner_id = so_latest.partner_id.id if so_latest else False
+        saved_ids = [i for i in self.ids if isinstance ( i, int )]
+        if saved_ids :
+            self._queue_partner_warnings (
+                {i : warnings.get ( i ) for i in saved_ids} )
 
-            # Aviso NO bloqueante si hay más de un cliente
-            if len ( partners ) > 1 and rec.partner_id :
-                msg = _ (
-                    "Atención: hay múltiples clientes en pedidos confirmados (%s). "
-                    "Se ha fijado el cliente del pedido más reciente (%s)."
-                ) % (", ".join ( partners.mapped ( "display_name" ) ),
-                     rec.partner_id.display_name)
-
-                # Si el modelo tiene chatter:
-                if hasattr ( rec, "message_post" ) :
-                    rec.message_post (
-                        body=msg,
-                        message_type="comment",
-                        subtype_xmlid="mail.mt_note",
-                    )
-                else :
-                    _logger.warning ( "%s", msg )
+    @api.model
+    def _queue_partner_warnings(self, warnings) :
+        """
+        Apunta {quotation_id: (partner elegido, partners) o None si ya no hay
+        conflicto} para publicarlos antes del commit, una vez por transacción.
+        """
+        pending = self.env.cr.precommit.data.get ( _PARTNER_WARNING_KEY )
+        if pending is None :
+            pending = self.env.cr.precommit.data[_PARTNER_WARNING_KEY] = {}
+            self.env.cr.precommit.add ( self._post_partner_warnings )
+        pending.update ( warnings )
+
+    def _post_partner_warnings(self) :
+        """
+        Publica en bloque los avisos de varios clientes pendientes. Cada aviso
+        se identifica por un hash de su contenido guardado en el contrato: si
+        no ha cambiado desde el último publicado no se repite y solo se suma
+        a partner_warning_suppressed. Los contratos sin conflicto limpian el
+        hash, de modo que un conflicto que reaparece se vuelve a avisar.
+        """
+        pending = self.env.cr.precommit.data.pop ( _PARTNER_WARNING_KEY, None )
+        if not pending :
+            return
+        cr = self.env.cr
+        cr.execute ( """
+            SELECT id, partner_warning_hash FROM sale_quotations WHERE id IN %s
+        """, (tuple ( pending ),) )
+        stored = dict ( cr.fetchall () )
+
+        to_post, suppressed, cleared = {}, [], []
+        for quotation_id, warning in pending.items () :
+            if quotation_id not in stored :
+                continue  # eliminado en la misma transacción
+            if warning is None :
+                if stored[quotation_id] :
+                    cleared.append ( quotation_id )
+                continue
+            digest = hashlib.sha1 ( repr ( warning ).encode () ).hexdigest ()
+            if stored[quotation_id] == digest :
+                suppressed.append ( quotation_id )
+            else :
+                to_post[quotation_id] = (digest, warning)
+
+        if to_post :
+            partner_ids = {p for _digest, (_chosen, ids) in to_post.values () for p in ids}
+            names = {p.id : p.display_name
+                     for p in self.env["res.partner"].browse ( partner_ids )}
+            self.browse ( list ( to_post ) )._message_log_batch (
+                bodies={
+                    quotation_id : _ (
+                        "Atención: hay múltiples clientes en pedidos confirmados (%s). "
+                        "Se ha fijado el cliente del pedido más reciente (%s)."
+                    ) % (", ".join ( names[p] for p in ids ), names[chosen])
+                    for quotation_id, (_digest, (chosen, ids)) in to_post.items ()
+                },
+                subtype_id=self.env["ir.model.data"]._xmlid_to_res_id ( "mail.mt_note" ),
+            )
+            # cr.flush() ya ha volcado la transacción antes de los precommit:
+            # lo que deje pendiente este callback hay que volcarlo aquí
+            self.flush ()
+            cr.execute ( """
+                UPDATE sale_quotations q
+                   SET partner_warning_hash = d.digest
+                  FROM unnest(%s::int[], %s::varchar[]) AS d(id, digest)
+                 WHERE q.id = d.id
+            """, (list ( to_post ), [v[0] for v in to_post.values ()]) )
+        if cleared :
+            cr.execute ( """
+                UPDATE sale_quotations SET partner_warning_hash = NULL WHERE id IN %s
+            """, (tuple ( cleared ),) )
+        if suppressed :
+            cr.execute ( """
+                UPDATE sale_quotations
+                   SET partner_warning_suppressed = COALESCE(partner_warning_suppressed, 0) + 1
+                 WHERE id IN %s
+            """, (tuple ( suppressed ),) )
+        self.invalidate_cache ( ["partner_warning_hash", "partner_warning_suppressed"] )
 
     # --- Smart button counters ---
     child_count = fields.Integer ( string="Adendas",
@@ -502,25 +1922,145 @@ class SaleQuotationsBonds ( models.Model ) :
     purchase_count = fields.Integer ( string="Compras",
                                       compute="_compute_smart_counts" )
 
-    @api.depends ( "child_ids", "sale_order_sale_ids", "bond_ids" )
+    @api.depends ( "child_ids", "sale_order_sale_ids", "bond_ids",
+                   "stored_purchase_count" )
+    @profiled
     def _compute_smart_counts(self) :
-        for rec in self :
+        # Registros guardados: una consulta agrupada por tipo de contador,
+        # independientemente del número de registros.
+        saved = self.filtered ( lambda r : isinstance ( r.id, int ) )
+        for rec in self - saved :
             rec.child_count = len ( rec.child_ids )
             rec.sale_order_count = len ( rec.sale_order_sale_ids )
             rec.bond_count = len ( rec.bond_ids )
             rec.purchase_count = rec._get_purchase_orders ().sudo ().search_count (
                 rec._get_purchase_domain ()
             )
+        if not saved :
+            return
+
+        child_data = self.read_group (
+            [("parent_id", "in", saved.ids)], ["parent_id"], ["parent_id"] )
+        child_counts = {d["parent_id"][0] : d["parent_id_count"]
+                        for d in child_data}
+
+        self.flush ( ["bond_ids"] )
+        self.env.cr.execute ( """
+            SELECT quotation_id, COUNT(*)
+              FROM sid_bonds_quotation_rel
+             WHERE quotation_id IN %s
+             GROUP BY quotation_id
+        """, (tuple ( saved.ids ),) )
+        bond_counts = dict ( self.env.cr.fetchall () )
+
+        for rec in saved :
+            rec.child_count = child_counts.get ( rec.id, 0 )
+            rec.sale_order_count = len ( rec.sale_order_sale_ids )
+            rec.bond_count = bond_counts.get ( rec.id, 0 )
+            rec.purchase_count = rec.stored_purchase_count
 
     # --- Helpers for purchases ---
     def _get_procurement_groups(self) :
-        """Return procurement groups from linked sale orders."""
+        """Return procurement groups from linked sale orders (stored index)."""
         self.ensure_one ()
-        sale_orders = self.sale_order_sale_ids
+        return self.procurement_group_ids
+
+    @api.model
+    def _mark_purchase_links(self, quotation_ids) :
+        """Apunta contratos cuyo índice de compras hay que refrescar antes del commit."""
+        pending = self.env.cr.precommit.data.get ( _PURCHASE_LINKS_KEY )
+        if pending is None :
+            pending = self.env.cr.precommit.data[_PURCHASE_LINKS_KEY] = set ()
+            self.env.cr.precommit.add ( self._refresh_purchase_links_pending )
+        pending.update ( q for q in quotation_ids if q )
+
+    def _refresh_purchase_links_pending(self) :
+        pending = self.env.cr.precommit.data.pop ( _PURCHASE_LINKS_KEY, None )
+        if not pending :
+            return
+        # las consultas leen de BD: lo pendiente del ORM debe estar volcado
+        self.env["sale.order"].flush ( ["quotations_id", "state", "procurement_group_id"] )
+        self.env["purchase.order"].flush ( ["group_id"] )
+        self.flush ( ["parent_id", "parent_path"] )
+        self.browse ( pending ).exists ()._refresh_purchase_links ()
 
-        # Depending on Odoo version/custom, sale order can use group_id or procurement_group_id
-        groups = sale_orders.mapped ( "procurement_group_id" )
-        return groups.filtered ( lambda g : g )
+    def _refresh_purchase_links(self) :
+        """
+        Recalcula procurement_group_ids y stored_purchase_count de las
+        familias completas de self: una consulta para los grupos, otra para
+        las compras y escrituras en bloque sobre la relación y el contador.
+        """
+        if not self :
+            return
+        families = self._get_family_quotation_ids_map ()
+        family_by_member = {}
+        for rec in self :
+            family = tuple ( sorted ( families.get ( rec ) or [rec.id] ) )
+            for member_id in family :
+                family_by_member[member_id] = family
+        member_ids = list ( family_by_member )
+
+        cr = self.env.cr
+        cr.execute ( """
+            SELECT DISTINCT quotations_id, procurement_group_id
+              FROM sale_order
+             WHERE quotations_id = ANY(%s)
+               AND state = 'sale'
+               AND procurement_group_id IS NOT NULL
+        """, (member_ids,) )
+        groups_by_quotation = {}
+        for quotation_id, group_id in cr.fetchall () :
+            groups_by_quotation.setdefault ( quotation_id, set () ).add ( group_id )
+        groups_by_family = {
+            family : set ().union ( *(groups_by_quotation.get ( q, () ) for q in family) )
+            for family in set ( family_by_member.values () )
+        }
+
+        purchases_by_group = {}
+        all_groups = set ().union ( *groups_by_family.values () )
+        if all_groups :
+            # cada compra tiene un solo group_id: sumar por grupo no duplica
+            cr.execute ( """
+                SELECT group_id, COUNT(*)
+                  FROM purchase_order
+                 WHERE group_id = ANY(%s)
+                 GROUP BY group_id
+            """, (list ( all_groups ),) )
+            purchases_by_group = dict ( cr.fetchall () )
+
+        pairs = [(member_id, group_id)
+                 for member_id, family in family_by_member.items ()
+                 for group_id in groups_by_family[family]]
+        counts = [sum ( purchases_by_group.get ( g, 0 ) for g in groups_by_family[family] )
+                  for family in family_by_member.values ()]
+
+        cr.execute ( "DELETE FROM sid_quotation_procurement_group_rel WHERE quotation_id = ANY(%s)",
+                     (member_ids,) )
+        if pairs :
+            cr.execute ( """
+                INSERT INTO sid_quotation_procurement_group_rel (quotation_id, group_id)
+                SELECT * FROM unnest(%s::int[], %s::int[])
+                ON CONFLICT DO NOTHING
+            """, ([p[0] for p in pairs], [p[1] for p in pairs]) )
+        cr.execute ( """
+            UPDATE sale_quotations q
+               SET stored_purchase_count = d.purchase_count
+              FROM unnest(%s::int[], %s::int[]) AS d(id, purchase_count)
+             WHERE q.id = d.id
+        """, (member_ids, counts) )
+        self.invalidate_cache ( ["procurement_group_ids", "stored_purchase_count",
+                                 "purchase_count"] )
+
+    @api.model
+    def _backfill_purchase_links(self, batch_size=500) :
+        """Rellena el índice de compras de todas las familias, por lotes de raíces."""
+        self.env.cr.execute ( "SELECT id FROM sale_quotations WHERE parent_id IS NULL ORDER BY id" )
+        root_ids = [row[0] for row in self.env.cr.fetchall ()]
+        for batch in tools.split_every ( batch_size, root_ids ) :
+            self.browse ( batch )._refresh_purchase_links ()
+            self.invalidate_cache ()
+            _logger.info ( "Índice de compras de contratos: %s familias", len ( batch ) )
+        return len ( root_ids )
 
     def _get_purchase_domain(self) :
         """Domain for purchase orders linked to the procurement groups of linked sale orders."""
@@ -542,7 +2082,7 @@ class SaleQuotationsBonds ( models.Model ) :
             "name" : "Adendas",
             "res_model" : "sale.quotations",
             "view_mode" : "tree,form",
-            "domain" : [("id", "in", self.child_ids.ids)],
+            "domain" : [("parent_id", "=", self.id)],
             "context" : {"default_parent_id" : self.id},
         }
 
@@ -585,13 +2125,36 @@ class SaleQuotationsBonds ( models.Model ) :
     def _get_effective_partner_from_sale_orders(self) :
         """Devuelve el partner del pedido confirmado más reciente (state='sale')."""
         self.ensure_one ()
-        so = self.sale_order_ids.filtered ( lambda s : s.state == "sale" )
-        if not so :
-            return self.env["res.partner"]  # vacío
-        so_latest = so.sorted (
-            lambda s : s.date_order or fields.Datetime.now (), reverse=True )[
-            :1]
-        return so_latest.partner_id
+        partner_id = self._get_latest_sale_orders ().get ( self.id, (False,) )[0]
+        return self.env["res.partner"].browse ( partner_id )
+
+    def _get_latest_sale_orders(self) :
+        """
+        Pedido confirmado más reciente de cada contrato de self (solo sus
+        propios pedidos, no los de la familia), en una única consulta:
+        {quotation_id: (partner_id, date_order, sale_order_id)}.
+        Los contratos sin pedidos confirmados y los NewId no aparecen.
+        """
+        ids = [i for i in self.ids if isinstance ( i, int )]
+        if not ids :
+            return {}
+        self.env["sale.order"].flush (
+            ["quotations_id", "state", "partner_id", "date_order"] )
+        self.env.cr.execute ( """
+            SELECT DISTINCT ON (quotations_id)
+                   quotations_id, partner_id, date_order, id
+              FROM sale_order
+             WHERE quotations_id IN %s
+               AND state = 'sale'
+             ORDER BY quotations_id, date_order DESC NULLS LAST, id DESC
+        """, (tuple ( ids ),) )
+        return {row[0] : row[1 :] for row in self.env.cr.fetchall ()}
+
+    @api.model
+    def _latest_sale_order_key(self, values) :
+        """Clave de orden de (partner_id, date_order, id): sin fecha va al final."""
+        _partner_id, date_order, so_id = values
+        return (date_order or datetime.datetime.min, so_id)
 
     def _get_family_quotations(self) :
         """Devuelve root + descendientes. Soporta registros nuevos (NewId) en onchange."""
@@ -617,14 +2180,192 @@ class SaleQuotationsBonds ( models.Model ) :
         # 3) Caso normal (guardado): SQL con child_of (rápido y completo)
         return self.search ( [("id", "child_of", root.id)] )
 
+    def _get_family_quotation_ids_map(self) :
+        """
+        Versión por lotes de _get_family_quotations para registros guardados.
+        Devuelve {registro: [ids de root + descendientes]} resolviendo todas
+        las familias con una sola consulta sobre parent_path. Los registros
+        nuevos (NewId) no aparecen: el llamante usa _get_family_quotations.
+        """
+        saved = self.filtered ( lambda r : isinstance ( r.id, int ) )
+        if not saved :
+            return {}
+        self.flush ( ["parent_id", "parent_path"] )
+
+        # root = mi parent (si soy adenda) o yo; su parent_path es el prefijo
+        root_paths = {}
+        for rec in saved :
+            root = rec.parent_id or rec
+            if root.parent_path :
+                root_paths[rec] = root.parent_path
+        if not root_paths :
+            return {}
+
+        prefixes = set ( root_paths.values () )
+        self.env.cr.execute ( """
+            SELECT id, parent_path
+              FROM sale_quotations
+             WHERE parent_path LIKE ANY(%s)
+        """, ([p + "%" for p in prefixes],) )
+
+        members = {prefix : [] for prefix in prefixes}
+        for quotation_id, path in self.env.cr.fetchall () :
+            # una fila puede pertenecer a varias familias pedidas (raíces anidadas)
+            parts = path.split ( "/" )[:-1]
+            for i in range ( 1, len ( parts ) + 1 ) :
+                prefix = "/".join ( parts[:i] ) + "/"
+                if prefix in members :
+                    members[prefix].append ( quotation_id )
+
+        return {rec : members[path] for rec, path in root_paths.items ()}
+
+    # --- Árbol de familia (widget del formulario) ---
+    @api.model
+    def get_family_tree(self, parent_id, offset=0, limit=40) :
+        """
+        Un nivel del árbol de contratos, paginado, para carga bajo demanda.
+
+        Devuelve {"node": nodo parent_id, "children": página de sus adendas,
+        "total": nº de adendas, "offset", "limit"}. Cada nodo lleva los
+        agregados de su subárbol (él y sus descendientes): child_count,
+        order_count y amount_untaxed (pedidos confirmados) y, solo para el
+        grupo de Gestión de Avales ("show_bonds"), bond_count y bond_amount
+        (avales distintos, en moneda de compañía). Los agregados de toda la
+        página salen de una única consulta agrupada sobre parent_path.
+        """
+        parent = self.browse ( parent_id ).exists ()
+        show_bonds = self.env.user.has_group ( "sid_bankbonds_sales_module.group_bonds_manager" )
+        if not parent :
+            return {"node" : False, "children" : [], "total" : 0,
+                    "offset" : offset, "limit" : limit, "show_bonds" : show_bonds}
+        parent.check_access_rights ( "read" )
+        parent.check_access_rule ( "read" )
+
+        domain = [("parent_id", "=", parent.id)]
+        children = self.search ( domain, offset=offset, limit=limit, order="name, id" )
+        # página incompleta: el total se deduce sin contar
+        if limit and len ( children ) < limit and (children or not offset) :
+            total = offset + len ( children )
+        else :
+            total = self.search_count ( domain )
+
+        nodes = parent | children
+        aggregates = nodes._get_family_tree_aggregates ( with_bonds=show_bonds )
+        data = {rec["id"] : rec for rec in nodes.read ( ["name", "partner_id"] )}
+        int_keys = ("child_count", "order_count") + (("bond_count",) if show_bonds else ())
+        float_keys = ("amount_untaxed",) + (("bond_amount",) if show_bonds else ())
+
+        def _node(rec) :
+            values = dict ( data[rec.id], **aggregates.get ( rec.id, {} ) )
+            for key in int_keys :
+                values.setdefault ( key, 0 )
+            for key in float_keys :
+                values.setdefault ( key, 0.0 )
+            return values
+
+        return {
+            "node" : _node ( parent ),
+            "children" : [_node ( rec ) for rec in children],
+            "total" : total,
+            "offset" : offset,
+            "limit" : limit,
+            "show_bonds" : show_bonds,
+        }
+
+    def _get_family_tree_aggregates(self, with_bonds=True) :
+        """
+        {quotation_id: agregados de su subárbol} en una sola consulta. Con
+        with_bonds=False no se calculan (ni se devuelven) las cifras de avales.
+
+        Los miembros de los subárboles se filtran con prefijos constantes de
+        parent_path (uno por subárbol no contenido en otro), que sí usan el
+        índice; el reparto por nodo se hace después sobre esas filas.
+        """
+        if not self.ids :
+            return {}
+        self.flush ( ["parent_id", "parent_path", "bond_ids"] )
+        self.env["sale.order"].flush ( ["quotations_id", "state", "amount_untaxed"] )
+        paths = {rec.id : rec.parent_path for rec in self}
+        # ordenados, un prefijo va antes que los caminos que cubre
+        prefixes = []
+        for path in sorted ( {p for p in paths.values () if p} ) :
+            if not any ( path.startswith ( prefix ) for prefix in prefixes ) :
+                prefixes.append ( path )
+        params = {
+            "node_ids" : list ( paths ),
+            "node_paths" : list ( paths.values () ),
+        }
+        params.update ( ("prefix_%s" % i, prefix + "%") for i, prefix in enumerate ( prefixes ) )
+        candidates = " OR ".join (
+            "parent_path LIKE %%(prefix_%s)s" % i for i in range ( len ( prefixes ) ) ) or "FALSE"
+        bonds_cte = bonds_columns = bonds_join = ""
+        if with_bonds :
+            self.env["sid_bonds_orders"].flush ( ["amount_company"] )
+            bonds_cte = """, bonds AS (
+                SELECT nb.node_id, COUNT(*) AS bond_count,
+                       SUM(COALESCE(b.amount_company, 0)) AS bond_amount
+                  FROM (SELECT DISTINCT m.node_id, rel.bond_id
+                          FROM members m
+                          JOIN sid_bonds_quotation_rel rel
+                            ON rel.quotation_id = m.quotation_id) nb
+                  JOIN sid_bonds_orders b ON b.id = nb.bond_id
+                 GROUP BY nb.node_id
+            )"""
+            bonds_columns = """,
+                   COALESCE(b.bond_count, 0) AS bond_count,
+                   COALESCE(b.bond_amount, 0) AS bond_amount"""
+            bonds_join = """
+              LEFT JOIN bonds b ON b.node_id = n.id"""
+        self.env.cr.execute ( """
+            WITH nodes AS (
+                SELECT unnest(%(node_ids)s::int[]) AS id,
+                       unnest(%(node_paths)s::varchar[]) AS parent_path
+            ), candidates AS (
+                SELECT id, parent_path FROM sale_quotations WHERE """ + candidates + """
+            ), members AS (
+                SELECT n.id AS node_id, q.id AS quotation_id
+                  FROM nodes n
+                  JOIN candidates q ON q.parent_path LIKE n.parent_path || '%%'
+            ), children AS (
+                SELECT parent_id AS node_id, COUNT(*) AS child_count
+                  FROM sale_quotations
+                 WHERE parent_id IN (SELECT id FROM nodes)
+                 GROUP BY parent_id
+            ), orders AS (
+                SELECT m.node_id, COUNT(so.id) AS order_count,
+                       SUM(so.amount_untaxed) AS amount_untaxed
+                  FROM members m
+                  JOIN sale_order so ON so.quotations_id = m.quotation_id
+                 WHERE so.state = 'sale'
+                 GROUP BY m.node_id
+            )""" + bonds_cte + """
+            SELECT n.id,
+                   COALESCE(c.child_count, 0) AS child_count,
+                   COALESCE(o.order_count, 0) AS order_count,
+                   COALESCE(o.amount_untaxed, 0) AS amount_untaxed""" + bonds_columns + """
+              FROM nodes n
+              LEFT JOIN children c ON c.node_id = n.id
+              LEFT JOIN orders o ON o.node_id = n.id""" + bonds_join + """
+        """, params )
+        return {row.pop ( "id" ) : row for row in self.env.cr.dictfetchall ()}
+
     @api.constrains ( "parent_id", "child_ids" )
     def _check_parent_child_same_partner(self) :
+        # Partner efectivo de self, sus principales y todas sus adendas con
+        # una sola consulta (en lugar de una por contrato y adenda)
+        related = self | self.mapped ( "parent_id" ) | self.mapped ( "child_ids" )
+        latest = related._get_latest_sale_orders ()
+        Partner = self.env["res.partner"]
+
+        def _partner(quotation) :
+            return Partner.browse ( latest.get ( quotation.id, (False,) )[0] )
+
         for rec in self :
-            rec_partner = rec._get_effective_partner_from_sale_orders ()
+            rec_partner = _partner ( rec )
 
             # --- Regla 1: si es adenda (tiene parent), el parent debe tener mismo cliente ---
             if rec.parent_id :
-                parent_partner = rec.parent_id._get_effective_partner_from_sale_orders ()
+                parent_partner = _partner ( rec.parent_id )
 
                 # Si ambos tienen partner “resuelto” y no coincide -> bloquear
                 if rec_partner and parent_partner and rec_partner.id != parent_partner.id :
@@ -639,7 +2380,7 @@ class SaleQuotationsBonds ( models.Model ) :
             # --- Regla 2: si es principal (tiene children), todos deben tener mismo cliente ---
             if rec.child_ids :
                 for child in rec.child_ids :
-                    child_partner = child._get_effective_partner_from_sale_orders ()
+                    child_partner = _partner ( child )
                     if rec_partner and child_partner and rec_partner.id != child_partner.id :
                         raise ValidationError ( _ (
                             "No puedes añadir una adenda con cliente distinto al del contrato principal.\n\n"
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import functools
+import time
+
+from odoo import api, fields, models, tools
+
+_PARAM_ENABLED = "sid_bankbonds_sales_module.profiling"
+_PARAM_MAX_SAMPLES = "sid_bankbonds_sales_module.profiling_max_samples"
+_PRECOMMIT_KEY = "sid_bonds_profile_sample.pending"
+
+
+def _profiling_enabled(env) :
+    # get_param está en ormcache: desactivado cuesta una búsqueda en caché
+    return tools.str2bool (
+        env["ir.config_parameter"].sudo ().get_param ( _PARAM_ENABLED ) or "0", False )
+
+
+def profiled(method) :
+    """
+    Mide nº de consultas SQL, tiempo y tamaño del recordset de un método
+    de modelo cuando el parámetro sid_bankbonds_sales_module.profiling está
+    activo. Las muestras se guardan en bloque antes del commit (ver
+    sid_bonds_profile_sample). Debe ir justo encima del def, por debajo de
+    api.depends / api.model.
+    """
+
+    @functools.wraps ( method )
+    def wrapper(self, *args, **kwargs) :
+        if not _profiling_enabled ( self.env ) :
+            return method ( self, *args, **kwargs )
+        cr = self.env.cr
+        queries = cr.sql_log_count
+        started = time.perf_counter ()
+        try :
+            return method ( self, *args, **kwargs )
+        finally :
+            self.env["sid_bonds_profile_sample"]._add_sample (
+                f"{self._name}.{method.__name__}",
+                cr.sql_log_count - queries,
+                (time.perf_counter () - started) * 1000.0,
+                len ( self ),
+            )
+
+    return wrapper
+
+
+class BondsProfileSample ( models.Model ) :
+    """
+    Muestras de @profiled: una fila por llamada. Es un almacén rotativo:
+    solo se conservan las últimas `profiling_max_samples` filas.
+    """
+    _name = "sid_bonds_profile_sample"
+    _description = "Muestra de rendimiento de avales"
+    _order = "id desc"
+    _log_access = False
+
+    name = fields.Char ( string="Método", required=True, index=True )
+    query_count = fields.Integer ( string="Consultas SQL" )
+    duration_ms = fields.Float ( string="Tiempo (ms)", digits=(16, 2) )
+    record_count = fields.Integer ( string="Registros" )
+    sampled_at = fields.Datetime ( string="Fecha", default=fields.Datetime.now )
+
+    @api.model
+    def _add_sample(self, name, query_count, duration_ms, record_count) :
+        """Acumula la muestra; se insertan todas juntas antes del commit."""
+        pending = self.env.cr.precommit.data.get ( _PRECOMMIT_KEY )
+        if pending is None :
+            pending = self.env.cr.precommit.data[_PRECOMMIT_KEY] = []
+            self.env.cr.precommit.add ( self._flush_samples )
+        pending.append ( (name, query_count, duration_ms, record_count) )
+
+    def _flush_samples(self) :
+        pending = self.env.cr.precommit.data.pop ( _PRECOMMIT_KEY, None )
+        if not pending :
+            return
+        cr = self.env.cr
+        names, queries, durations, counts = zip ( *pending )
+        cr.execute ( """
+            INSERT INTO sid_bonds_profile_sample (name, query_count, duration_ms,
+                                                  record_count, sampled_at)
+            SELECT s.name, s.query_count, s.duration_ms, s.record_count,
+                   now() at time zone 'UTC'
+              FROM unnest(%s::varchar[], %s::int[], %s::float8[], %s::int[])
+                   AS s(name, query_count, duration_ms, record_count)
+            RETURNING id
+        """, (list ( names ), list ( queries ), list ( durations ), list ( counts )) )
+        last_id = max ( row[0] for row in cr.fetchall () )
+
+        # rotación: se descarta lo más antiguo por encima del máximo
+        max_samples = int ( self.env["ir.config_parameter"].sudo ().get_param (
+            _PARAM_MAX_SAMPLES, 100000 ) or 100000 )
+        cr.execute ( "DELETE FROM sid_bonds_profile_sample WHERE id <= %s",
+                     (last_id - max_samples,) )
+
+
+class BondsProfileSummary ( models.Model ) :
+    """Resumen por método de las muestras: llamadas, p50/p95 de tiempo y consultas."""
+    _name = "sid_bonds_profile_summary"
+    _description = "Resumen de rendimiento de avales"
+    _auto = False
+    _order = "duration_p95 desc"
+
+    name = fields.Char ( string="Método", readonly=True )
+    call_count = fields.Integer ( string="Llamadas", readonly=True )
+    duration_p50 = fields.Float ( string="Tiempo p50 (ms)", digits=(16, 2), readonly=True )
+    duration_p95 = fields.Float ( string="Tiempo p95 (ms)", digits=(16, 2), readonly=True )
+    query_p50 = fields.Float ( string="Consultas p50", digits=(16, 1), readonly=True )
+    query_p95 = fields.Float ( string="Consultas p95", digits=(16, 1), readonly=True )
+    record_avg = fields.Float ( string="Registros (media)", digits=(16, 1), readonly=True )
+    last_sample = fields.Datetime ( string="Última muestra", readonly=True )
+
+    def init(self) :
+        tools.drop_view_if_exists ( self.env.cr, self._table )
+        self.env.cr.execute ( """
+            CREATE VIEW sid_bonds_profile_summary AS
+            SELECT row_number() OVER (ORDER BY name) AS id,
+                   name,
+                   COUNT(*) AS call_count,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms) AS duration_p50,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) AS duration_p95,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY query_count) AS query_p50,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY query_count) AS query_p95,
+                   AVG(record_count) AS record_avg,
+                   MAX(sampled_at) AS last_sample
+              FROM sid_bonds_profile_sample
+             GROUP BY name
+        """ )
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger ( __name__ )
+
+
+class BondsBaseVariationQueue ( models.Model ) :
+    """
+    Cola ligera de variaciones de Base Imponible Pedidos.
+
+    BondsOrder.write solo inserta aquí (aval, anterior, nuevo); el cron
+    agrupa por aval todo lo encolado desde su última ejecución y publica una
+    única nota por aval comparando el primer valor anterior con la base
+    actual (ver BondsOrder._post_base_pedidos_variation_note).
+    """
+    _name = "sid_bonds_base_variation_queue"
+    _description = "Cola de variaciones de Base Imponible Pedidos"
+    _order = "id"
+    _log_access = False
+
+    bond_id = fields.Many2one ( "sid_bonds_orders", string="Aval",
+                                required=True, ondelete="cascade",
+                                index=True )
+    old_value = fields.Float ( string="Anterior" )
+    new_value = fields.Float ( string="Nuevo" )
+    enqueued_at = fields.Datetime ( string="Encolado",
+                                    default=fields.Datetime.now )
+
+    def _fetch_batch(self, batch_size) :
+        """
+        Siguiente lote de avales pendientes, en orden de llegada.
+        Devuelve [(bond_id, primer old_value, último id de la cola)].
+        """
+        self.flush ()
+        self.env.cr.execute ( """
+            SELECT bond_id,
+                   (array_agg(old_value ORDER BY id))[1],
+                   MAX(id)
+              FROM sid_bonds_base_variation_queue
+             GROUP BY bond_id
+             ORDER BY MIN(id)
+             LIMIT %s
+        """, (batch_size,) )
+        return self.env.cr.fetchall ()
+
+    @api.model
+    def _cron_process_queue(self, batch_size=500) :
+        """Vacía la cola por lotes: una nota por aval y lote de activities."""
+        Bonds = self.env["sid_bonds_orders"]
+        processed = 0
+        while True :
+            rows = self._fetch_batch ( batch_size )
+            if not rows :
+                break
+
+            old_map = {bond_id : old for bond_id, old, _max_id in rows}
+            bonds = Bonds.browse ( list ( old_map ) ).exists ()
+            bonds._post_base_pedidos_variation_note ( old_map )
+
+            # Solo se borra lo leído: lo encolado mientras tanto queda
+            # para el siguiente lote/ejecución
+            self.env.cr.execute ( """
+                DELETE FROM sid_bonds_base_variation_queue q
+                 USING (SELECT unnest(%s::int[]) AS bond_id,
+                               unnest(%s::int[]) AS max_id) b
+                 WHERE q.bond_id = b.bond_id AND q.id <= b.max_id
+            """, ([r[0] for r in rows], [r[2] for r in rows]) )
+            self.invalidate_cache ()
+            processed += len ( rows )
+
+            if not self.env.registry.in_test_mode () :
+                self.env.cr.commit ()
+
+        if processed :
+            _logger.info ( "Cola de variaciones de base: %s avales procesados",
+                           processed )
+        return processed
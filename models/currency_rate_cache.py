@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import bisect
+
+from odoo import fields
+
+
+class CurrencyRateCache ( object ) :
+    """
+    Conversión a moneda de compañía con los tipos de res.currency.rate
+    cargados de una vez para un lote.
+
+    Misma regla que res.currency._get_rates: para cada moneda y fecha se
+    toma el último tipo con fecha <= la pedida, primero entre los de la
+    compañía y si no entre los globales (company_id vacío); sin tipo, 1.0.
+    Las búsquedas (moneda, fecha) se memorizan.
+    """
+
+    def __init__(self, env, company, currency_ids) :
+        self.company = company
+        self.currency = company.currency_id
+        self._memo = {}
+        self._rates = {}
+
+        ids = set ( currency_ids ) | {self.currency.id}
+        env.cr.execute ( """
+            SELECT currency_id, company_id IS NOT NULL, name, rate
+              FROM res_currency_rate
+             WHERE currency_id IN %s
+               AND (company_id IS NULL OR company_id = %s)
+             ORDER BY currency_id, name
+        """, (tuple ( ids ), company.id) )
+        for currency_id, own, date, rate in env.cr.fetchall () :
+            dates, rates = self._rates.setdefault ( (currency_id, own), ([], []) )
+            dates.append ( date )
+            rates.append ( rate )
+
+    def rate(self, currency_id, date) :
+        key = (currency_id, date)
+        if key not in self._memo :
+            self._memo[key] = self._lookup ( currency_id, date )
+        return self._memo[key]
+
+    def _lookup(self, currency_id, date) :
+        for own in (True, False) :
+            dates, rates = self._rates.get ( (currency_id, own), ((), ()) )
+            pos = bisect.bisect_right ( dates, date )
+            if pos :
+                return rates[pos - 1]
+        return 1.0
+
+    def convert(self, amount, currency_id, date=None) :
+        """`amount` en `currency_id` a moneda de compañía, redondeado."""
+        if not amount :
+            return 0.0
+        date = fields.Date.to_date ( date ) or fields.Date.context_today ( self.company )
+        if currency_id and currency_id != self.currency.id :
+            amount = amount * self.rate ( self.currency.id, date ) / self.rate ( currency_id, date )
+        return self.currency.round ( amount )
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from odoo import fields, models
+
+_PARAM = "sid_bankbonds_sales_module.coverage_target_%s"
+
+
+class ResConfigSettings ( models.TransientModel ) :
+    _inherit = "res.config.settings"
+
+    # % de la base de pedidos que debe cubrir el importe de cada tipo de aval
+    bonds_coverage_target_prov = fields.Float (
+        string="Cobertura objetivo Provisional (%)",
+        config_parameter=_PARAM % "prov" )
+    bonds_coverage_target_adel = fields.Float (
+        string="Cobertura objetivo Adelanto (%)",
+        config_parameter=_PARAM % "adel" )
+    bonds_coverage_target_fiel = fields.Float (
+        string="Cobertura objetivo Fiel Cumplimiento (%)",
+        config_parameter=_PARAM % "fiel", default=10.0 )
+    bonds_coverage_target_gar = fields.Float (
+        string="Cobertura objetivo Garantía (%)",
+        config_parameter=_PARAM % "gar" )
+
+    # Mediciones de @profiled (ver bonds_profiling.py)
+    bonds_profiling = fields.Boolean (
+        string="Medir rendimiento de avales",
+        config_parameter="sid_bankbonds_sales_module.profiling" )
+
+    def set_values(self) :
+        Bonds = self.env["sid_bonds_orders"]
+        before = Bonds._get_coverage_targets ()
+        super ().set_values ()
+        after = Bonds._get_coverage_targets ()
+        changed = [t for t in after if after[t] != before.get ( t )]
+        if changed :
+            Bonds._recompute_coverage ( changed )
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+
+class ResGroups ( models.Model ) :
+    _inherit = "res.groups"
+
+    def write(self, vals) :
+        if "users" not in vals :
+            return super ().write ( vals )
+        Users = self.env["res.users"]
+        before = Users._get_bonds_manager_keys ()
+        res = super ().write ( vals )
+        # menciones/partners de gestores de avales cacheados: solo si cambia
+        # quién está en Gestión de Avales
+        if Users._get_bonds_manager_keys () != before :
+            self.env["sid_bonds_orders"].clear_caches ()
+        return res
+
+
+class ResUsers ( models.Model ) :
+    _inherit = "res.users"
+
+    @api.model
+    def _get_bonds_manager_keys(self) :
+        """{(user_id, partner_id)} de los usuarios activos de Gestión de Avales."""
+        group = self.env.ref ( "sid_bankbonds_sales_module.group_bonds_manager",
+                               raise_if_not_found=False )
+        if not group :
+            return set ()
+        users = group.sudo ().with_context ( active_test=False ).users
+        return {(user.id, user.partner_id.id) for user in users if user.active}
+
+    @api.model_create_multi
+    def create(self, vals_list) :
+        users = super ().create ( vals_list )
+        if {user_id for user_id, _partner in self._get_bonds_manager_keys ()} & set ( users.ids ) :
+            self.env["sid_bonds_orders"].clear_caches ()
+        return users
+
+    def write(self, vals) :
+        if not {"groups_id", "active", "partner_id"}.intersection ( vals ) :
+            return super ().write ( vals )
+        before = self._get_bonds_manager_keys ()
+        res = super ().write ( vals )
+        if self._get_bonds_manager_keys () != before :
+            self.env["sid_bonds_orders"].clear_caches ()
+        return res
+
+    def unlink(self) :
+        managers = {user_id for user_id, _partner in self._get_bonds_manager_keys ()}
+        res = super ().unlink ()
+        if managers & set ( self.ids ) :
+            self.env["sid_bonds_orders"].clear_caches ()
+        return res
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+
+class SaleOrder ( models.Model ) :
+    """
+    Mantiene el índice de compras de sale.quotations (procurement_group_ids)
+    y expone los avales que cubren el pedido (sid_bonds_orders.sale_order_ids).
+    """
+    _inherit = "sale.order"
+
+    # Campos que cambian los grupos de aprovisionamiento de un contrato
+    _PURCHASE_LINK_FIELDS = {"state", "quotations_id", "procurement_group_id"}
+
+    # Lado inverso de sid_bonds_orders.sale_order_ids (misma tabla,
+    # indexada por order_id): la mantiene el cálculo del aval
+    bond_ids = fields.Many2many (
+        "sid_bonds_orders",
+        relation="sid_bonds_sale_order_rel",
+        column1="order_id",
+        column2="bond_id",
+        string="Avales",
+        readonly=True,
+        copy=False,
+        groups="sid_bankbonds_sales_module.group_bonds_manager",
+    )
+    bond_count = fields.Integer (
+        string="Nº avales",
+        compute="_compute_bond_count",
+        groups="sid_bankbonds_sales_module.group_bonds_manager",
+    )
+
+    def _compute_bond_count(self) :
+        counts = {}
+        if self.ids :
+            self.env["sid_bonds_orders"].flush ( ["sale_order_ids"] )
+            self.env.cr.execute ( """
+                SELECT order_id, COUNT(*)
+                  FROM sid_bonds_sale_order_rel
+                 WHERE order_id IN %s
+                 GROUP BY order_id
+            """, (tuple ( self.ids ),) )
+            counts = dict ( self.env.cr.fetchall () )
+        for order in self :
+            order.bond_count = counts.get ( order.id, 0 )
+
+    def action_view_bonds(self) :
+        self.ensure_one ()
+        return {
+            "type" : "ir.actions.act_window",
+            "name" : "Avales",
+            "res_model" : "sid_bonds_orders",
+            "view_mode" : "tree,form",
+            "domain" : [("sale_order_ids", "in", self.ids)],
+            "context" : {},
+        }
+
+    @api.model_create_multi
+    def create(self, vals_list) :
+        orders = super ().create ( vals_list )
+        self.env["sale.quotations"]._mark_purchase_links ( orders.mapped ( "quotations_id" ).ids )
+        return orders
+
+    def write(self, vals) :
+        touches = bool ( self._PURCHASE_LINK_FIELDS.intersection ( vals ) )
+        if touches :
+            # contrato anterior (si el pedido cambia de contrato)
+            quotation_ids = set ( self.mapped ( "quotations_id" ).ids )
+        res = super ().write ( vals )
+        if touches :
+            quotation_ids.update ( self.mapped ( "quotations_id" ).ids )
+            self.env["sale.quotations"]._mark_purchase_links ( quotation_ids )
+        return res
+
+    def unlink(self) :
+        self.env["sale.quotations"]._mark_purchase_links ( self.mapped ( "quotations_id" ).ids )
+        return super ().unlink ()
+
+
+class PurchaseOrder ( models.Model ) :
+    """Actualiza el nº de compras de los contratos que comparten su grupo."""
+    _inherit = "purchase.order"
+
+    @api.model_create_multi
+    def create(self, vals_list) :
+        orders = super ().create ( vals_list )
+        orders._mark_quotation_purchase_counts ( orders.mapped ( "group_id" ).ids )
+        return orders
+
+    def write(self, vals) :
+        if "group_id" not in vals :
+            return super ().write ( vals )
+        group_ids = set ( self.mapped ( "group_id" ).ids )
+        res = super ().write ( vals )
+        group_ids.update ( self.mapped ( "group_id" ).ids )
+        self._mark_quotation_purchase_counts ( group_ids )
+        return res
+
+    def unlink(self) :
+        self._mark_quotation_purchase_counts ( self.mapped ( "group_id" ).ids )
+        return super ().unlink ()
+
+    @api.model
+    def _mark_quotation_purchase_counts(self, group_ids) :
+        group_ids = [g for g in group_ids if g]
+        if not group_ids :
+            return
+        self.env["sale.quotations"].flush ( ["procurement_group_ids"] )
+        self.env.cr.execute ( """
+            SELECT DISTINCT quotation_id
+              FROM sid_quotation_procurement_group_rel
+             WHERE group_id = ANY(%s)
+        """, (group_ids,) )
+        self.env["sale.quotations"]._mark_purchase_links (
+            [row[0] for row in self.env.cr.fetchall ()] )
@@ -0,0 +1,91 @@
+odoo.define('sid_bankbonds_sales_module.bonds_dashboard', function (require) {
+"use strict";
+
+/**
+ * Panel de avales: todo el contenido sale de una única llamada a
+ * sid_bonds_orders.get_dashboard_data (cacheada en servidor). Cada tarjeta
+ * abre la lista de avales con el dominio que viene en el payload.
+ */
+const AbstractAction = require('web.AbstractAction');
+const core = require('web.core');
+const fieldUtils = require('web.field_utils');
+
+const QWeb = core.qweb;
+const _t = core._t;
+
+const BondsDashboard = AbstractAction.extend({
+    contentTemplate: 'sid_bankbonds_sales_module.BondsDashboard',
+    events: {
+        'click .o_sid_dashboard_card': '_onOpenList',
+        'click .o_sid_dashboard_bond': '_onOpenBond',
+        'click .o_sid_dashboard_refresh': '_onRefresh',
+    },
+
+    willStart() {
+        return Promise.all([this._super(...arguments), this._load()]);
+    },
+
+    start() {
+        return this._super(...arguments).then(() => this._render());
+    },
+
+    //--------------------------------------------------------------------------
+    // Private
+    //--------------------------------------------------------------------------
+
+    async _load() {
+        this.data = await this._rpc({
+            model: 'sid_bonds_orders',
+            method: 'get_dashboard_data',
+            args: [],
+        });
+    },
+
+    _render() {
+        this.$('.o_sid_dashboard_body').html(QWeb.render('sid_bankbonds_sales_module.BondsDashboardBody', {
+            data: this.data,
+            format: (value) => fieldUtils.format.float(value, null, {digits: [16, 2]}),
+        }));
+    },
+
+    //--------------------------------------------------------------------------
+    // Handlers
+    //--------------------------------------------------------------------------
+
+    _onOpenList(ev) {
+        ev.preventDefault();
+        const card = ev.currentTarget;
+        this.do_action({
+            type: 'ir.actions.act_window',
+            name: card.dataset.title || _t('Avales'),
+            res_model: 'sid_bonds_orders',
+            views: [[false, 'list'], [false, 'form']],
+            domain: JSON.parse(card.dataset.domain),
+            target: 'current',
+        });
+    },
+
+    _onOpenBond(ev) {
+        ev.preventDefault();
+        ev.stopPropagation();
+        this.do_action({
+            type: 'ir.actions.act_window',
+            res_model: 'sid_bonds_orders',
+            res_id: $(ev.currentTarget).data('id'),
+            views: [[false, 'form']],
+            target: 'current',
+        });
+    },
+
+    async _onRefresh(ev) {
+        ev.preventDefault();
+        await this._load();
+        this._render();
+    },
+});
+
+core.action_registry.add('sid_bonds_dashboard', BondsDashboard);
+
+return BondsDashboard;
+
+});
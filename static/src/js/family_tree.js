@@ -0,0 +1,147 @@
+odoo.define('sid_bankbonds_sales_module.family_tree', function (require) {
+"use strict";
+
+/**
+ * Árbol de la familia de contratos (principal + adendas) en el formulario de
+ * sale.quotations. Carga un nivel y una página cada vez mediante
+ * sale.quotations.get_family_tree, en lugar de leer todas las adendas.
+ * Las columnas de avales solo se muestran si el servidor las envía
+ * (show_bonds: usuarios de Gestión de Avales).
+ */
+const core = require('web.core');
+const fieldUtils = require('web.field_utils');
+const Widget = require('web.Widget');
+const widgetRegistry = require('web.widget_registry');
+
+const QWeb = core.qweb;
+const PAGE_SIZE = 40;
+
+const FamilyTree = Widget.extend({
+    template: 'sid_bankbonds_sales_module.FamilyTree',
+    events: {
+        'click .o_sid_family_toggle': '_onToggle',
+        'click .o_sid_family_more': '_onMore',
+        'click .o_sid_family_open': '_onOpen',
+    },
+
+    init(parent, record) {
+        this._super(...arguments);
+        this.record = record;
+        this.showBonds = false;
+    },
+
+    start() {
+        return this._super(...arguments).then(() => this._reload());
+    },
+
+    updateState(record) {
+        const reload = record.res_id !== this.record.res_id;
+        this.record = record;
+        if (reload) {
+            this._reload();
+        }
+    },
+
+    //--------------------------------------------------------------------------
+    // Private
+    //--------------------------------------------------------------------------
+
+    _rootId() {
+        const parent = this.record.data.parent_id;
+        return parent ? parent.res_id : this.record.res_id;
+    },
+
+    _fetch(parentId, offset) {
+        return this._rpc({
+            model: 'sale.quotations',
+            method: 'get_family_tree',
+            args: [parentId],
+            kwargs: {offset: offset, limit: PAGE_SIZE},
+        }).then((data) => {
+            this.showBonds = data.show_bonds;
+            return data;
+        });
+    },
+
+    _renderNode(node) {
+        return $(QWeb.render('sid_bankbonds_sales_module.FamilyTreeNode', {
+            node: node,
+            current: node.id === this.record.res_id,
+            showBonds: this.showBonds,
+            format: (value) => fieldUtils.format.float(value, null, {digits: [16, 2]}),
+        }));
+    },
+
+    _appendPage($container, data) {
+        $container.children('.o_sid_family_more').remove();
+        for (const node of data.children) {
+            $container.append(this._renderNode(node));
+        }
+        const next = data.offset + data.children.length;
+        if (next < data.total) {
+            $container.append(QWeb.render('sid_bankbonds_sales_module.FamilyTreeMore', {
+                parentId: data.node.id,
+                offset: next,
+                remaining: data.total - next,
+            }));
+        }
+    },
+
+    async _reload() {
+        const $body = this.$('.o_sid_family_tree_body').empty();
+        const rootId = this._rootId();
+        if (!rootId) {
+            return;
+        }
+        const data = await this._fetch(rootId, 0);
+        this.$('.o_sid_family_header .o_sid_family_bonds').toggleClass('d-none', !this.showBonds);
+        if (!data.node) {
+            return;
+        }
+        const $root = this._renderNode(data.node).addClass('o_loaded o_open');
+        $body.append($root);
+        this._appendPage($root.children('.o_sid_family_children'), data);
+    },
+
+    //--------------------------------------------------------------------------
+    // Handlers
+    //--------------------------------------------------------------------------
+
+    async _onToggle(ev) {
+        const $node = $(ev.currentTarget).closest('.o_sid_family_node');
+        const $children = $node.children('.o_sid_family_children');
+        if (!$node.data('child-count')) {
+            return;
+        }
+        if (!$node.hasClass('o_loaded')) {
+            $node.addClass('o_loaded');
+            this._appendPage($children, await this._fetch($node.data('id'), 0));
+        }
+        $node.toggleClass('o_open');
+    },
+
+    async _onMore(ev) {
+        ev.preventDefault();
+        const $more = $(ev.currentTarget);
+        const data = await this._fetch($more.data('parent-id'), $more.data('offset'));
+        this._appendPage($more.parent(), data);
+    },
+
+    _onOpen(ev) {
+        ev.preventDefault();
+        const id = $(ev.currentTarget).closest('.o_sid_family_node').data('id');
+        this.do_action({
+            type: 'ir.actions.act_window',
+            res_model: 'sale.quotations',
+            res_id: id,
+            views: [[false, 'form']],
+            target: 'current',
+        });
+    },
+});
+
+widgetRegistry.add('sid_family_tree', FamilyTree);
+
+return FamilyTree;
+
+});
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from . import test_benchmark_bonds
+from . import test_benchmark_contracts
+from . import test_credit_line_concurrency
+from . import test_query_counts
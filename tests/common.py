@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Base de la batería de rendimiento: generador de datos sintéticos, medición
+de consultas/tiempo e informe JSON comparable entre ejecuciones.
+
+Variables de entorno:
+
+- SID_BONDS_BENCH_PROFILE: volumen (small | medium | large), small por defecto.
+- SID_BONDS_BENCH_PARTNERS / _FAMILIES / _ADDENDA / _ORDERS / _BONDS:
+  sustituyen el valor del perfil.
+- SID_BONDS_BENCH_REPORT: ruta del informe JSON
+  (por defecto <tmp>/sid_bonds_benchmark.json).
+- SID_BONDS_BENCH_BASELINE: informe de una ejecución anterior; un camino
+  más lento que el de referencia (más la tolerancia) hace fallar el test.
+- SID_BONDS_BENCH_TOLERANCE: tolerancia sobre el tiempo de referencia
+  (0.5 = +50 %, por defecto).
+
+Los umbrales absolutos están en benchmark_thresholds.json: nº máximo de
+consultas (total o por registro) y ms por registro de cada camino medido.
+"""
+import base64
+import contextlib
+import datetime
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+_logger = logging.getLogger ( __name__ )
+
+PROFILES = {
+    "small" : {"partners" : 20, "families" : 20, "addenda" : 4, "orders" : 300, "bonds" : 200},
+    "medium" : {"partners" : 200, "families" : 200, "addenda" : 4, "orders" : 3000, "bonds" : 2000},
+    "large" : {"partners" : 1000, "families" : 1000, "addenda" : 9, "orders" : 30000, "bonds" : 10000},
+}
+
+# Informe compartido por todas las clases de la batería (un fichero por ejecución)
+REPORT = {"results" : {}}
+
+THRESHOLDS_PATH = os.path.join ( os.path.dirname ( __file__ ), "benchmark_thresholds.json" )
+
+# PDF mínimo válido para la sincronización con Documents
+PDF_CONTENT = base64.b64encode (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n" )
+
+
+def get_volumes() :
+    profile = os.environ.get ( "SID_BONDS_BENCH_PROFILE", "small" )
+    volumes = dict ( PROFILES.get ( profile, PROFILES["small"] ) )
+    for key in volumes :
+        value = os.environ.get ( "SID_BONDS_BENCH_%s" % key.upper () )
+        if value :
+            volumes[key] = int ( value )
+    return profile, volumes
+
+
+class BondsDataGenerator ( object ) :
+    """
+    Genera clientes, familias de contratos (principal + adendas vía
+    parent_id), pedidos enlazados por quotations_id y avales enlazados por
+    sid_bonds_quotation_rel. Determinista: misma semilla, mismos datos.
+    """
+
+    def __init__(self, env, seed=42) :
+        self.env = env
+        self.rng = random.Random ( seed )
+
+    def generate(self, partners, families, addenda, orders, bonds) :
+        company = self.env.company
+        self.currency = company.currency_id
+        self.other_currency = self._other_currency ()
+        self.journal = self._bank_journal ()
+        self.product = self.env["product.product"].create ( {
+            "name" : "Producto benchmark avales",
+            "type" : "service",
+            "list_price" : 100.0,
+        } )
+
+        self.partners = self.env["res.partner"].create ( [
+            {"name" : "Cliente benchmark %05d" % i, "is_company" : True, "vat" : "BENCH%05d" % i}
+            for i in range ( partners )
+        ] )
+
+        Quotation = self.env["sale.quotations"]
+        self.principals = Quotation.create ( [
+            {"name" : "BENCH-%05d" % f} for f in range ( families )
+        ] )
+        self.addenda = Quotation.create ( [
+            {"name" : "BENCH-%05d-A%03d" % (f, a), "parent_id" : principal.id}
+            for f, principal in enumerate ( self.principals )
+            for a in range ( addenda )
+        ] )
+        self.quotations = self.principals | self.addenda
+
+        # cada familia pertenece a un cliente
+        self.family_partner = {
+            principal.id : self.partners[f % len ( self.partners )]
+            for f, principal in enumerate ( self.principals )
+        }
+        self.family_members = {principal.id : principal for principal in self.principals}
+        for addendum in self.addenda :
+            self.family_members[addendum.parent_id.id] |= addendum
+
+        self.orders = self._create_orders ( orders )
+        self.bonds = self._create_bonds ( bonds )
+        self.env["base"].flush ()
+        return self
+
+    def _other_currency(self) :
+        usd = self.env.ref ( "base.USD" )
+        other = usd if self.currency != usd else self.env.ref ( "base.EUR" )
+        other.active = True
+        Rate = self.env["res.currency.rate"]
+        if not Rate.search_count ( [("currency_id", "=", other.id),
+                                    ("name", "=", "2020-01-01"),
+                                    ("company_id", "=", self.env.company.id)] ) :
+            Rate.create ( {"currency_id" : other.id, "rate" : 1.1, "name" : "2020-01-01",
+                           "company_id" : self.env.company.id} )
+        return other
+
+    def _bank_journal(self) :
+        journal = self.env["account.journal"].search ( [
+            ("type", "=", "bank"), ("company_id", "=", self.env.company.id)], limit=1 )
+        return journal or self.env["account.journal"].create ( {
+            "name" : "Banco benchmark", "type" : "bank", "code" : "BNKBE"} )
+
+    def _create_orders(self, count) :
+        families = list ( self.family_members.items () )
+        vals_list = []
+        for i in range ( count ) :
+            principal_id, members = families[i % len ( families )]
+            quotation = self.rng.choice ( members )
+            vals_list.append ( {
+                "partner_id" : self.family_partner[principal_id].id,
+                "quotations_id" : quotation.id,
+                "date_order" : fields.Datetime.now () - datetime.timedelta (
+                    days=self.rng.randint ( 0, 720 ) ),
+                "order_line" : [(0, 0, {
+                    "product_id" : self.product.id,
+                    "product_uom_qty" : 1,
+                    "price_unit" : self.rng.randint ( 1000, 100000 ),
+                })],
+            } )
+        orders = self.env["sale.order"].browse ()
+        for start in range ( 0, len ( vals_list ), 1000 ) :
+            orders |= self.env["sale.order"].create ( vals_list[start :start + 1000] )
+
+        # 80 % confirmados; se fija el estado directamente (sin logística)
+        confirmed = orders.filtered ( lambda so : self.rng.random () < 0.8 )
+        confirmed.write ( {"state" : "sale"} )
+        self._link_purchases ( confirmed )
+        return orders
+
+    def _link_purchases(self, orders) :
+        """Grupos de aprovisionamiento y compras para la mitad de los pedidos."""
+        orders = orders.filtered ( lambda so : self.rng.random () < 0.5 )
+        groups = self.env["procurement.group"].create ( [
+            {"name" : so.name} for so in orders] )
+        for so, group in zip ( orders, groups ) :
+            so.procurement_group_id = group
+        vendor = self.partners[0]
+        self.env["purchase.order"].create ( [
+            {"partner_id" : vendor.id, "group_id" : group.id} for group in groups] )
+
+    def _create_bonds(self, count) :
+        families = list ( self.family_members.items () )
+        types = ["prov", "adel", "fiel", "gar"]
+        vals_list = []
+        for i in range ( count ) :
+            principal_id, members = families[i % len ( families )]
+            contracts = self.rng.sample ( list ( members ), min ( len ( members ), 2 ) )
+            issue_date = fields.Date.today () - datetime.timedelta ( days=self.rng.randint ( 0, 365 ) )
+            vals_list.append ( {
+                "reference" : "AV-BENCH-%06d" % i,
+                "partner_id" : self.family_partner[principal_id].id,
+                "journal_id" : self.journal.id,
+                "aval_type" : types[i % len ( types )],
+                "amount" : self.rng.randint ( 100, 20000 ),
+                "currency_id" : (self.other_currency if i % 5 == 0 else self.currency).id,
+                "issue_date" : issue_date,
+                "due_date" : issue_date + datetime.timedelta ( days=self.rng.randint ( 30, 720 ) ),
+                "contract_ids" : [(6, 0, [c.id for c in contracts])],
+            } )
+        Bonds = self.env["sid_bonds_orders"]
+        bonds = Bonds.browse ()
+        for start in range ( 0, len ( vals_list ), 1000 ) :
+            bonds |= Bonds.create ( vals_list[start :start + 1000] )
+        return bonds
+
+
+class BondsBenchmarkCase ( TransactionCase ) :
+    """
+    Caso base: genera los datos una vez por clase y mide caminos con
+    measure(). Cada medición se valida contra los umbrales y la referencia
+    y se añade al informe JSON.
+    """
+
+    @classmethod
+    def setUpClass(cls) :
+        super ().setUpClass ()
+        cls.profile, cls.volumes = get_volumes ()
+        REPORT.update ( profile=cls.profile, volumes=cls.volumes )
+        started = time.perf_counter ()
+        cls.data = BondsDataGenerator ( cls.env ).generate ( **cls.volumes )
+        _logger.info ( "Datos de benchmark (%s) generados en %.1fs", cls.profile,
+                       time.perf_counter () - started )
+        with open ( THRESHOLDS_PATH ) as f :
+            cls.thresholds = json.load ( f )
+        cls.baseline = {}
+        baseline_path = os.environ.get ( "SID_BONDS_BENCH_BASELINE" )
+        if baseline_path and os.path.exists ( baseline_path ) :
+            with open ( baseline_path ) as f :
+                cls.baseline = json.load ( f ).get ( "results", {} )
+        cls.tolerance = float ( os.environ.get ( "SID_BONDS_BENCH_TOLERANCE", "0.5" ) )
+
+    @classmethod
+    def tearDownClass(cls) :
+        REPORT["generated_at"] = fields.Datetime.to_string ( fields.Datetime.now () )
+        path = os.environ.get ( "SID_BONDS_BENCH_REPORT" ) or os.path.join (
+            tempfile.gettempdir (), "sid_bonds_benchmark.json" )
+        with open ( path, "w" ) as f :
+            json.dump ( REPORT, f, indent=2, sort_keys=True )
+        _logger.info ( "Informe de benchmark de avales: %s", path )
+        super ().tearDownClass ()
+
+    def invalidate(self) :
+        self.env["base"].flush ()
+        self.env["base"].invalidate_cache ()
+
+    @contextlib.contextmanager
+    def measure(self, name, records, check=True) :
+        """Mide consultas y tiempo del bloque; `records` = nº de registros tratados."""
+        result = {"records" : records}
+        cr = self.env.cr
+        queries = cr.sql_log_count
+        started = time.perf_counter ()
+        yield result
+        ms = (time.perf_counter () - started) * 1000.0
+        result.update (
+            queries=cr.sql_log_count - queries,
+            ms=round ( ms, 3 ),
+            ms_per_record=round ( ms / max ( records, 1 ), 4 ),
+        )
+        REPORT["results"][name] = result
+        _logger.info ( "benchmark %s: %s", name, result )
+        if check :
+            self.check_result ( name, result )
+
+    def check_result(self, name, result) :
+        limits = self.thresholds.get ( name, {} )
+        if "max_queries" in limits :
+            self.assertLessEqual ( result["queries"], limits["max_queries"],
+                                   "%s: demasiadas consultas" % name )
+        if "max_queries_per_record" in limits :
+            self.assertLessEqual ( result["queries"] / max ( result["records"], 1 ),
+                                   limits["max_queries_per_record"],
+                                   "%s: demasiadas consultas por registro" % name )
+        if "max_ms_per_record" in limits :
+            self.assertLessEqual ( result["ms_per_record"], limits["max_ms_per_record"],
+                                   "%s: demasiado lento por registro" % name )
+
+        previous = self.baseline.get ( name )
+        if previous and previous.get ( "records" ) == result["records"] :
+            self.assertLessEqual (
+                result["queries"], previous["queries"] + max ( 2, previous["queries"] // 10 ),
+                "%s: más consultas que la referencia (%s)" % (name, previous["queries"]) )
+            self.assertLessEqual (
+                result["ms"], previous["ms"] * (1.0 + self.tolerance),
+                "%s: más lento que la referencia (%.1f ms)" % (name, previous["ms"]) )
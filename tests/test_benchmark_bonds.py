@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+import base64
+import datetime
+import io
+import json
+import zipfile
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from odoo.addons.sid_bankbonds_sales_module.models import bonds_order
+from odoo.addons.sid_bankbonds_sales_module.models.currency_rate_cache import CurrencyRateCache
+
+from .common import PDF_CONTENT, BondsBenchmarkCase
+
+BOND_LIST_FIELDS = ["aval_type", "reference", "contract_ids", "partner_id", "journal_id",
+                    "issue_date", "due_date", "base_pedidos", "amount", "currency_id",
+                    "coverage_status", "state"]
+BASE_FIELDS = ["base_pedidos", "base_pedidos_company"]
+
+
+@tagged ( "post_install", "-at_install", "perf" )
+class TestBenchmarkBonds ( BondsBenchmarkCase ) :
+
+    def _recompute_base(self, bonds) :
+        Bonds = self.env["sid_bonds_orders"]
+        for fname in BASE_FIELDS :
+            self.env.add_to_compute ( Bonds._fields[fname], bonds )
+        bonds.recompute ( BASE_FIELDS )
+
+    def test_bond_list_read(self) :
+        bonds = self.data.bonds
+        self.invalidate ()
+        with self.measure ( "bond_list_read", len ( bonds ) ) :
+            self.env["sid_bonds_orders"].search_read (
+                [("id", "in", bonds.ids)], BOND_LIST_FIELDS )
+
+    def test_bond_write_contracts(self) :
+        bonds = self.data.bonds[:100]
+        quotations = self.data.quotations
+        self.invalidate ()
+        with self.measure ( "bond_write_contracts", len ( bonds ) ) :
+            for i, bond in enumerate ( bonds ) :
+                bond.write ( {"contract_ids" : [(4, quotations[i % len ( quotations )].id)]} )
+            self.env["base"].flush ()
+
+    def test_base_pedidos_batched_vs_loop(self) :
+        """
+        Cálculo en bloque (consultas constantes) frente a registro a registro.
+        Tamaños presentes en todos los perfiles: 10, 100 y todos los avales
+        del perfil (200 en small, 10.000 en large).
+        """
+        bonds_all = self.data.bonds
+        self.assertGreater ( len ( bonds_all ), 100, "El perfil necesita más de 100 avales" )
+        batched = {}
+        for label, bonds in (("10", bonds_all[:10]), ("100", bonds_all[:100]), ("all", bonds_all)) :
+            self.invalidate ()
+            with self.measure ( "base_pedidos_batched_%s" % label, len ( bonds ) ) as result :
+                self._recompute_base ( bonds )
+            batched[len ( bonds )] = result["queries"]
+
+            # el bucle por registro solo hasta 100: a partir de ahí no aporta
+            if label == "all" :
+                continue
+            self.invalidate ()
+            with self.measure ( "base_pedidos_loop_%s" % label, len ( bonds ), check=False ) as loop :
+                for bond in bonds :
+                    self._recompute_base ( bond )
+            self.assertLess ( result["queries"], loop["queries"] )
+
+        sizes = sorted ( batched )
+        self.assertEqual ( len ( sizes ), 3 )
+        self.assertLessEqual ( batched[sizes[-1]], batched[sizes[0]] + 2,
+                               "El cálculo en bloque de la base no es de consultas constantes" )
+
+    def test_documento_origen_constant_queries(self) :
+        Bonds = self.env["sid_bonds_orders"]
+        counts = []
+        for label, bonds in (("10", self.data.bonds[:10]), ("all", self.data.bonds)) :
+            self.invalidate ()
+            self.env.add_to_compute ( Bonds._fields["origin_document"], bonds )
+            with self.measure ( "documento_origen_%s" % label, len ( bonds ) ) as result :
+                bonds.recompute ( ["origin_document"] )
+            counts.append ( result["queries"] )
+        self.assertLessEqual ( counts[1], counts[0] + 2 )
+
+    def test_variation_mentions(self) :
+        """Notas de variación de 1k avales: las menciones se resuelven una vez."""
+        bonds = self.data.bonds[:1000]
+        Bonds = self.env["sid_bonds_orders"]
+        Bonds._get_bonds_manager_mentions ()
+        with self.assertQueryCount ( 0 ) :
+            Bonds._get_bonds_manager_mentions ()
+
+        # micro-benchmark: ids del grupo desde la caché frente a resolverlos
+        # en cada llamada; en los dos casos los nombres se leen de nuevo
+        calls = 100
+        with self.measure ( "manager_mentions_uncached", calls ) as uncached :
+            for _i in range ( calls ) :
+                Bonds.clear_caches ()
+                Bonds.invalidate_cache ()
+                Bonds._get_bonds_manager_mentions ()
+        with self.measure ( "manager_mentions_cached", calls ) as cached :
+            for _i in range ( calls ) :
+                Bonds.invalidate_cache ()
+                Bonds._get_bonds_manager_mentions ()
+        self.assertLess ( cached["queries"], uncached["queries"] )
+        self.assertLess ( cached["ms_per_record"], uncached["ms_per_record"] )
+
+        # un cambio de nombre se refleja sin invalidar la caché
+        partner_ids, _html = Bonds._get_bonds_manager_mentions ()
+        if partner_ids :
+            partner = self.env["res.partner"].browse ( partner_ids[0] )
+            partner.name = "Gestor avales renombrado"
+            _ids, mentions_html = Bonds._get_bonds_manager_mentions ()
+            self.assertIn ( "@%s" % partner.display_name, mentions_html )
+
+        old_map = {bond.id : 1.0 for bond in bonds}
+        self.invalidate ()
+        with self.measure ( "variation_notes", len ( bonds ) ) :
+            bonds._post_base_pedidos_variation_note ( old_map )
+
+    def test_mass_state_transitions(self) :
+        bonds = self.data.bonds
+        Bonds = self.env["sid_bonds_orders"]
+        self.invalidate ()
+        with self.measure ( "transition_request", len ( bonds ) ) :
+            result = Bonds.bulk_state_transition ( bonds.ids, "action_request" )
+            self.env["base"].flush ()
+        self.assertEqual ( len ( result["done"] ), len ( bonds ) )
+
+        self.invalidate ()
+        with self.measure ( "transition_activate", len ( bonds ) ) :
+            Bonds.bulk_state_transition ( bonds.ids, "action_activate", partial=True )
+            self.env["base"].flush ()
+        self.assertEqual ( set ( bonds.mapped ( "state" ) ), {"active"} )
+
+    def test_import_throughput(self) :
+        data = self.data
+        rows = []
+        for i in range ( min ( len ( data.bonds ), 1000 ) ) :
+            partner = data.partners[i % len ( data.partners )]
+            rows.append ( (i + 2, {
+                "reference" : "AV-IMPORT-%06d" % i,
+                "partner" : partner.vat,
+                "journal" : data.journal.code,
+                "aval_type" : "fiel",
+                "amount" : "1500,00",
+                "currency" : data.currency.name,
+                "issue_date" : "2024-01-15",
+                "due_date" : "15/01/2026",
+                "contracts" : data.quotations[i % len ( data.quotations )].name,
+            }) )
+        self.invalidate ()
+        with self.measure ( "import_rows", len ( rows ) ) as result :
+            bonds, errors = self.env["sid_bonds_orders"]._import_bonds_rows ( rows )
+            self.env["base"].flush ()
+        result["rows_per_second"] = round ( len ( rows ) / max ( result["ms"], 1.0 ) * 1000.0, 1 )
+        self.assertFalse ( errors )
+        self.assertEqual ( len ( bonds ), len ( rows ) )
+
+    def test_import_amount_formats(self) :
+        """Importes con separador de miles; un importe no válido solo rechaza su fila."""
+        data = self.data
+        amounts = ["1.500,00", "1,500.00", "1500,5", 1500, "1.250.000", "no es un importe"]
+        rows = [(i + 2, {
+            "reference" : "AV-IMPORT-AMOUNT-%s" % i,
+            "partner" : data.partners[0].vat,
+            "journal" : data.journal.code,
+            "aval_type" : "fiel",
+            "amount" : amount,
+            "currency" : data.currency.name,
+        }) for i, amount in enumerate ( amounts )]
+        bonds, errors = self.env["sid_bonds_orders"]._import_bonds_rows ( rows )
+        self.assertEqual ( bonds.mapped ( "amount" ), [1500.0, 1500.0, 1500.5, 1500.0, 1250000.0] )
+        self.assertEqual ( [line for line, _message in errors], [7] )
+
+    def test_currency_cache(self) :
+        """50k conversiones con la caché de tipos de un lote, frente a res.currency._convert."""
+        data = self.data
+        currencies = [data.currency.id, data.other_currency.id]
+        today = fields.Date.today ()
+        dates = [today - datetime.timedelta ( days=d ) for d in range ( 365 )]
+        self.invalidate ()
+        with self.measure ( "currency_cache_50k", 50000 ) as cached :
+            cache = CurrencyRateCache ( self.env, self.env.company, currencies )
+            for i in range ( 50000 ) :
+                cache.convert ( 1000.0 + i, currencies[i % 2], dates[i % len ( dates )] )
+
+        # sin caché: res.currency._convert (una consulta de tipos por llamada);
+        # se mide un subconjunto y se compara por conversión
+        Currency = self.env["res.currency"]
+        company = self.env.company
+        self.invalidate ()
+        with self.measure ( "currency_convert_1k", 1000, check=False ) as plain :
+            for i in range ( 1000 ) :
+                Currency.browse ( currencies[i % 2] )._convert (
+                    1000.0 + i, data.currency, company, dates[i % len ( dates )] )
+        self.assertLess ( cached["queries"], plain["queries"] )
+        self.assertLess ( cached["ms_per_record"], plain["ms_per_record"] )
+
+        # la caché convierte igual que res.currency._convert
+        for date in dates[:5] :
+            expected = data.other_currency._convert (
+                1000.0, data.currency, self.env.company, date, round=True )
+            self.assertAlmostEqual ( cache.convert ( 1000.0, data.other_currency.id, date ),
+                                     expected, places=2 )
+
+    def test_exposure_consistency(self) :
+        """La tabla incremental coincide con un recálculo completo."""
+        Exposure = self.env["sid_bonds_exposure"]
+        bonds = self.data.bonds
+        bonds[:50]._apply_state_transition ( "action_activate" )
+        bonds[50 :80].write ( {"amount" : 1234.0} )
+        bonds[80 :90].write ( {"partner_id" : self.data.partners[-1].id} )
+        bonds[90 :100].unlink ()
+
+        query = """
+            SELECT journal_id, partner_id, aval_type, state, currency_id, company_id,
+                   amount_total, base_total, amount_company_total, base_company_total,
+                   bond_count
+              FROM sid_bonds_exposure
+             ORDER BY 1, 2, 3, 4, 5, 6
+        """
+        with self.measure ( "exposure_precommit_refresh", 100 ) :
+            self.env.cr.flush ()
+        self.env.cr.execute ( query )
+        incremental = self.env.cr.fetchall ()
+
+        Exposure._refresh ()
+        self.env.cr.execute ( query )
+        self.assertEqual ( incremental, self.env.cr.fetchall () )
+
+    def test_credit_line_limit(self) :
+        """
+        El acumulado de la línea sigue a los avales vigentes y el límite se
+        respeta. La concurrencia real (dos transacciones) está en
+        test_credit_line_concurrency.
+        """
+        data = self.data
+        bonds = data.bonds.filtered ( lambda b : b.currency_id == data.currency )[:20]
+        with self.measure ( "credit_line_activate", len ( bonds[:10] ) ) :
+            bonds[:10]._apply_state_transition ( "action_activate" )
+
+        line = self.env["sid_bonds_credit_line"].search ( [
+            ("journal_id", "=", data.journal.id), ("currency_id", "=", data.currency.id)] )
+        self.env.cr.execute ( """
+            SELECT COALESCE(SUM(amount), 0) FROM sid_bonds_orders
+             WHERE state = 'active' AND journal_id = %s AND currency_id = %s
+        """, (data.journal.id, data.currency.id) )
+        self.assertAlmostEqual ( line.used_amount, self.env.cr.fetchone ()[0], places=2 )
+
+        line.limit_amount = line.used_amount + 1.0
+        with self.assertRaises ( UserError ) :
+            bonds[10 :]._apply_state_transition ( "action_activate" )
+
+    def test_pdf_documents_sync(self) :
+        bonds = self.data.bonds[:50]
+        bonds.write ( {"pdf_aval" : PDF_CONTENT} )
+        Document = self.env["documents.document"]
+        domain = [("res_model", "=", "sid_bonds_orders"), ("res_id", "in", bonds.ids)]
+
+        self.invalidate ()
+        with self.measure ( "pdf_sync_first", len ( bonds ) ) :
+            bonds._sync_pdf_documents ()
+        documents = Document.search_count ( domain )
+        self.assertEqual ( documents, len ( bonds ) )
+
+        # mismo contenido: no se crean documentos ni ficheros nuevos
+        self.invalidate ()
+        with self.measure ( "pdf_sync_unchanged", len ( bonds ) ) :
+            bonds._sync_pdf_documents ()
+        self.assertEqual ( Document.search_count ( domain ), documents )
+
+    def test_dashboard_payload(self) :
+        """Panel completo en pocas consultas; desde caché, solo la versión."""
+        Bonds = self.env["sid_bonds_orders"]
+        # la versión solo avanza tras commit: se parte de una caché vacía
+        bonds_order._DASHBOARD_CACHE.clear ()
+        self.invalidate ()
+        with self.measure ( "dashboard_cold", len ( self.data.bonds ) ) :
+            payload = Bonds.get_dashboard_data ()
+        with self.measure ( "dashboard_cached", len ( self.data.bonds ) ) :
+            cached = Bonds.get_dashboard_data ()
+        self.assertEqual ( cached, payload )
+
+        for info in payload["states"] :
+            self.assertEqual ( info["count"], Bonds.search_count ( [("state", "=", info["state"])] ) )
+        for info in payload["expiring"] :
+            self.assertEqual ( info["count"], Bonds.search_count ( json.loads ( info["domain"] ) ) )
+
+    def test_search_trigram_vs_ilike(self) :
+        """
+        Búsqueda por texto con el índice trigram frente a ilike sin índice:
+        con enable_bitmapscan desactivado PostgreSQL no puede usar los
+        índices GIN y recorre la tabla, como antes de tenerlos.
+        """
+        Bonds = self.env["sid_bonds_orders"]
+        cr = self.env.cr
+        cr.execute ( "SELECT indexname FROM pg_indexes WHERE indexname LIKE %s",
+                     ("%_trgm_index",) )
+        indexes = {row[0] for row in cr.fetchall ()}
+        cr.execute ( "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'" )
+        if cr.fetchone () :
+            self.assertIn ( "sid_bonds_orders_search_text_trgm_index", indexes )
+            self.assertIn ( "sale_quotations_name_trgm_index", indexes )
+
+        bonds = self.data.bonds[:20]
+        terms = [b.reference[-4 :] for b in bonds[:10]] + \
+                [b.contract_ids[:1].name[-6 :] for b in bonds[10 :]]
+        domains = [[("search_text", "ilike", term)] for term in terms] + \
+                  [[("contract_ids", "ilike", term)] for term in terms[10 :]]
+
+        self.invalidate ()
+        with self.measure ( "search_trigram", len ( domains ) ) :
+            indexed = [Bonds.search ( domain ).ids for domain in domains]
+
+        self.invalidate ()
+        cr.execute ( "SET enable_bitmapscan = off" )
+        try :
+            with self.measure ( "search_plain_ilike", len ( domains ), check=False ) :
+                plain = [Bonds.search ( domain ).ids for domain in domains]
+        finally :
+            cr.execute ( "RESET enable_bitmapscan" )
+        self.assertEqual ( indexed, plain )
+        for bond, ids in zip ( bonds[:10], indexed ) :
+            self.assertIn ( bond.id, ids )
+
+    def test_sale_order_links(self) :
+        """Relación aval-pedido: coincide con la regla y se mantiene al cambiar pedidos."""
+        Bonds = self.env["sid_bonds_orders"]
+        bonds = self.data.bonds[:50]
+        for bond in bonds :
+            expected = bond.contract_ids.sale_order_ids.filtered (
+                lambda so : so.state == "sale" and so.partner_id == bond.partner_id )
+            self.assertEqual ( set ( bond.sale_order_ids.ids ), set ( expected.ids ) )
+
+        bond = bonds.filtered ( "sale_order_ids" )[:1]
+        order = bond.sale_order_ids[:1]
+        self.invalidate ()
+        with self.measure ( "bonds_for_order", 1 ) :
+            found = Bonds.search ( [("sale_order_ids", "in", order.ids)] )
+            count = order.bond_count
+        self.assertIn ( bond, found )
+        self.assertEqual ( count, len ( found ) )
+
+        order.write ( {"state" : "cancel"} )
+        self.env["base"].flush ()
+        self.assertNotIn ( order, bond.sale_order_ids )
+        self.assertNotIn ( order.name, bond.origin_document or "" )
+
+        self.invalidate ()
+        self.env.add_to_compute ( Bonds._fields["sale_order_ids"], self.data.bonds )
+        with self.measure ( "sale_order_links_recompute", len ( self.data.bonds ) ) :
+            self.data.bonds.recompute ( ["sale_order_ids"] )
+
+    def test_pdf_bulk_import(self) :
+        """Carga masiva de PDF (ZIP + sueltos): casado por nombre y duplicados por checksum."""
+        bonds = self.data.bonds[:40]
+        archive = io.BytesIO ()
+        with zipfile.ZipFile ( archive, "w" ) as zf :
+            for bond in bonds[:30] :
+                content = base64.b64decode ( PDF_CONTENT ) + b"%% " + bond.reference.encode ()
+                zf.writestr ( "banco/%s.pdf" % bond.reference, content )
+        Attachment = self.env["ir.attachment"]
+        uploads = Attachment.create ( {"name" : "avales.zip", "raw" : archive.getvalue ()} )
+        for bond in bonds[30 :] :
+            uploads |= Attachment.create ( {
+                "name" : "Aval %s firmado.pdf" % bond.reference,
+                "raw" : base64.b64decode ( PDF_CONTENT ) + b"%% " + bond.reference.encode (),
+            } )
+        # mismo contenido que el primero del ZIP: duplicado dentro de la carga
+        uploads |= Attachment.create ( {
+            "name" : "copia.pdf",
+            "raw" : base64.b64decode ( PDF_CONTENT ) + b"%% " + bonds[0].reference.encode (),
+        } )
+
+        wizard = self.env["sid_bonds_pdf_import_wizard"].create ( {
+            "attachment_ids" : [(6, 0, uploads.ids)],
+            "chunk_size" : 10,
+            "use_text" : False,
+        } )
+        self.invalidate ()
+        wizard.action_import ()
+        self.assertEqual ( wizard.state, "queued" )
+        self.assertEqual ( wizard.files_done, 0 )
+        with self.measure ( "pdf_bulk_import", len ( bonds ) + 1 ) :
+            wizard._cron_process_imports ()
+        self.assertEqual ( wizard.state, "done" )
+        self.assertEqual ( wizard.linked_count, len ( bonds ) )
+        self.assertEqual ( wizard.duplicate_count, 1 )
+        self.assertEqual ( wizard.unmatched_count, 0 )
+        self.assertTrue ( all ( bonds.mapped ( "pdf_aval" ) ) )
+        self.assertTrue ( all ( bonds.mapped ( "document_sync_pending" ) ) )
+
+        # segunda carga del mismo contenido: todo duplicado
+        again = self.env["sid_bonds_pdf_import_wizard"].create ( {
+            "attachment_ids" : [(0, 0, {
+                "name" : "%s.pdf" % bonds[31].reference,
+                "raw" : base64.b64decode ( PDF_CONTENT ) + b"%% " + bonds[31].reference.encode (),
+            })],
+            "use_text" : False,
+        } )
+        again.action_import ()
+        again._cron_process_imports ()
+        self.assertEqual ( (again.linked_count, again.duplicate_count), (0, 1) )
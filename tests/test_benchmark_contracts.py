@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import BondsBenchmarkCase
+
+SMART_COUNT_FIELDS = ["child_count", "sale_order_count", "bond_count", "purchase_count"]
+
+
+@tagged ( "post_install", "-at_install", "perf" )
+class TestBenchmarkContracts ( BondsBenchmarkCase ) :
+
+    def test_smart_counts_constant_queries(self) :
+        counts = []
+        for label, quotations in (("10", self.data.quotations[:10]), ("all", self.data.quotations)) :
+            self.invalidate ()
+            with self.measure ( "smart_counts_%s" % label, len ( quotations ) ) as result :
+                quotations.read ( SMART_COUNT_FIELDS )
+            counts.append ( result["queries"] )
+        self.assertLessEqual ( counts[1], counts[0] + 3 )
+
+    def test_contract_form_smart_buttons(self) :
+        principal = self.data.principals[0]
+        self.invalidate ()
+        with self.measure ( "contract_form_read", 1 ) :
+            principal.read ( ["name", "parent_id", "partner_id"] + SMART_COUNT_FIELDS )
+            principal.action_view_purchases ()
+            principal.action_view_children ()
+
+    def test_family_tree_page(self) :
+        """Una página del árbol: consultas constantes sea cual sea el tamaño de página."""
+        Quotation = self.env["sale.quotations"]
+        principal = self.data.principals[0]
+        counts = []
+        for limit in (1, 40) :
+            self.invalidate ()
+            with self.measure ( "family_tree_page_%s" % limit, limit ) as result :
+                tree = Quotation.get_family_tree ( principal.id, limit=limit )
+            counts.append ( result["queries"] )
+        self.assertEqual ( tree["total"], len ( principal.child_ids ) )
+        self.assertLessEqual ( counts[1], counts[0] + 2 )
+
+    def test_family_tree_bonds_only_for_managers(self) :
+        """Las cifras de avales del árbol solo llegan al grupo de Gestión de Avales."""
+        Quotation = self.env["sale.quotations"]
+        principal = self.data.principals[0]
+        group = self.env.ref ( "sid_bankbonds_sales_module.group_bonds_manager" )
+        user = self.env.user
+
+        user.groups_id = [(3, group.id)]
+        tree = Quotation.get_family_tree ( principal.id )
+        self.assertFalse ( tree["show_bonds"] )
+        for node in [tree["node"]] + tree["children"] :
+            self.assertNotIn ( "bond_count", node )
+            self.assertNotIn ( "bond_amount", node )
+
+        user.groups_id = [(4, group.id)]
+        tree = Quotation.get_family_tree ( principal.id )
+        self.assertTrue ( tree["show_bonds"] )
+        self.assertIn ( "bond_count", tree["node"] )
+        self.assertIn ( "bond_amount", tree["node"] )
+
+    def test_partner_resolver_200_addenda(self) :
+        """Principal con 200 adendas: el cliente efectivo sale de una sola consulta."""
+        Quotation = self.env["sale.quotations"]
+        data = self.data
+        partner = data.partners[0]
+        principal = Quotation.create ( {"name" : "BENCH-RESOLVER"} )
+        addenda = Quotation.create ( [
+            {"name" : "BENCH-RESOLVER-A%03d" % i, "parent_id" : principal.id}
+            for i in range ( 200 )
+        ] )
+        orders = self.env["sale.order"].create ( [
+            {
+                "partner_id" : partner.id,
+                "quotations_id" : quotation.id,
+                "date_order" : fields.Datetime.now () - datetime.timedelta ( days=i ),
+                "order_line" : [(0, 0, {"product_id" : data.product.id,
+                                        "product_uom_qty" : 1, "price_unit" : 100.0})],
+            }
+            for i, quotation in enumerate ( principal | addenda )
+            for _n in range ( 2 )
+        ] )
+        orders.write ( {"state" : "sale"} )
+        self.env["base"].flush ()
+
+        family = principal | addenda
+        self.invalidate ()
+        with self.assertQueryCount ( 1 ) :
+            latest = family._get_latest_sale_orders ()
+        self.assertEqual ( len ( latest ), len ( family ) )
+
+        self.invalidate ()
+        with self.measure ( "partner_constraint_200_addenda", len ( family ) ) :
+            principal._check_parent_child_same_partner ()
+
+        self.invalidate ()
+        self.env.add_to_compute ( Quotation._fields["partner_id"], family )
+        with self.measure ( "partner_compute_200_addenda", len ( family ) ) :
+            family.recompute ( ["partner_id"] )
+        self.assertEqual ( family.mapped ( "partner_id" ), partner )
+
+    def test_purchase_links_refresh(self) :
+        principals = self.data.principals
+        self.invalidate ()
+        with self.measure ( "purchase_links_refresh", len ( self.data.quotations ) ) :
+            principals._refresh_purchase_links ()
+
+        # el contador guardado coincide con la búsqueda directa
+        for quotation in self.data.quotations[:20] :
+            groups = quotation.procurement_group_ids
+            expected = self.env["purchase.order"].search_count (
+                [("group_id", "in", groups.ids)] ) if groups else 0
+            self.assertEqual ( quotation.stored_purchase_count, expected )
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import psycopg2
+
+from odoo import SUPERUSER_ID, api, sql_db
+from odoo.exceptions import UserError
+from odoo.service.model import PG_CONCURRENCY_ERRORS_TO_RETRY
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+
+@tagged ( "post_install", "-at_install" )
+class TestCreditLineConcurrency ( TransactionCase ) :
+    """
+    Dos activaciones simultáneas contra la misma línea de avales, cada una
+    en su propia conexión. En modo test registry.cursor() devuelve un
+    TestCursor que comparte la conexión del test (serializado por un
+    bloqueo), por eso se usan conexiones reales de sql_db y los datos se
+    confirman de verdad; al terminar se borran.
+
+    Los cursores van en REPEATABLE READ: la activación que llega segunda
+    falla al bloquear la línea con un error de serialización. Como hace la
+    capa de servicio de Odoo, se reintenta en una transacción nueva, que ya
+    ve la línea actualizada y debe acabar en el UserError del límite.
+    """
+
+    MAX_TRIES = 5
+
+    def _cursor(self) :
+        return sql_db.db_connect ( self.env.cr.dbname ).cursor ()
+
+    def _setup_data(self) :
+        with self._cursor () as cr :
+            env = api.Environment ( cr, SUPERUSER_ID, {} )
+            journal = env["account.journal"].search ( [
+                ("type", "=", "bank"), ("company_id", "=", env.company.id)], limit=1 )
+            if not journal :
+                return None
+            currency = env.company.currency_id
+            partner = env["res.partner"].create ( {"name" : "Cliente concurrencia avales",
+                                                   "is_company" : True} )
+            bonds = env["sid_bonds_orders"].create ( [
+                {
+                    "reference" : "AV-CONCURRENCIA-%s" % i,
+                    "partner_id" : partner.id,
+                    "journal_id" : journal.id,
+                    "currency_id" : currency.id,
+                    "aval_type" : "fiel",
+                    "amount" : 600.0,
+                    "state" : "requested",
+                }
+                for i in range ( 2 )
+            ] )
+            line = env["sid_bonds_credit_line"].search ( [
+                ("journal_id", "=", journal.id), ("currency_id", "=", currency.id)] )
+            created_line = not line
+            if created_line :
+                line = env["sid_bonds_credit_line"].create ( {
+                    "journal_id" : journal.id, "currency_id" : currency.id} )
+            previous_limit = line.limit_amount
+            # hueco para una sola de las dos activaciones
+            line.limit_amount = line.used_amount + 1000.0
+            cr.commit ()
+            return {
+                "bond_ids" : bonds.ids,
+                "partner_id" : partner.id,
+                "line_id" : line.id,
+                "created_line" : created_line,
+                "previous_limit" : previous_limit,
+            }
+
+    def _cleanup(self, data) :
+        with self._cursor () as cr :
+            env = api.Environment ( cr, SUPERUSER_ID, {} )
+            bonds = env["sid_bonds_orders"].browse ( data["bond_ids"] )
+            line = env["sid_bonds_credit_line"].browse ( data["line_id"] )
+            # la activación que haya entrado se devuelve a la línea
+            used = sum ( bonds.filtered ( lambda b : b.state == "active" ).mapped ( "amount" ) )
+            cr.execute ( "DELETE FROM mail_message WHERE model = %s AND res_id IN %s",
+                         (bonds._name, tuple ( data["bond_ids"] )) )
+            cr.execute ( "DELETE FROM mail_followers WHERE res_model = %s AND res_id IN %s",
+                         (bonds._name, tuple ( data["bond_ids"] )) )
+            cr.execute ( "DELETE FROM sid_bonds_orders WHERE id IN %s",
+                         (tuple ( data["bond_ids"] ),) )
+            if data["created_line"] :
+                cr.execute ( "DELETE FROM sid_bonds_credit_line WHERE id = %s", (line.id,) )
+            else :
+                cr.execute ( """
+                    UPDATE sid_bonds_credit_line
+                       SET used_amount = used_amount - %s, limit_amount = %s
+                     WHERE id = %s
+                """, (used, data["previous_limit"], line.id) )
+            cr.execute ( "DELETE FROM sid_bonds_exposure WHERE partner_id = %s",
+                         (data["partner_id"],) )
+            env["res.partner"].browse ( data["partner_id"] ).unlink ()
+            cr.commit ()
+
+    def test_parallel_activations_respect_limit(self) :
+        data = self._setup_data ()
+        if not data :
+            self.skipTest ( "No hay diario de banco en la base de datos" )
+        try :
+            barrier = threading.Barrier ( 2 )
+            results = {}
+
+            def activate(bond_id) :
+                for attempt in range ( self.MAX_TRIES ) :
+                    with self._cursor () as cr :
+                        env = api.Environment ( cr, SUPERUSER_ID, {} )
+                        bond = env["sid_bonds_orders"].browse ( bond_id )
+                        if not attempt :
+                            barrier.wait ( timeout=30 )
+                        try :
+                            bond._apply_state_transition ( "action_activate" )
+                            cr.commit ()
+                            results[bond_id] = "ok"
+                        except UserError :
+                            cr.rollback ()
+                            results[bond_id] = "limit"
+                        except psycopg2.OperationalError as e :
+                            cr.rollback ()
+                            results[bond_id] = repr ( e )
+                            if e.pgcode in PG_CONCURRENCY_ERRORS_TO_RETRY :
+                                # reintento en una transacción nueva, como el servicio
+                                continue
+                        except Exception as e :
+                            cr.rollback ()
+                            results[bond_id] = repr ( e )
+                    return
+
+            threads = [threading.Thread ( target=activate, args=(bond_id,) )
+                       for bond_id in data["bond_ids"]]
+            for thread in threads :
+                thread.start ()
+            for thread in threads :
+                thread.join ( timeout=60 )
+
+            self.assertEqual ( sorted ( results.values () ), ["limit", "ok"] )
+            with self._cursor () as cr :
+                cr.execute ( "SELECT used_amount, limit_amount FROM sid_bonds_credit_line "
+                             "WHERE id = %s", (data["line_id"],) )
+                used, limit = cr.fetchone ()
+                cr.execute ( "SELECT COUNT(*) FROM sid_bonds_orders "
+                             "WHERE id IN %s AND state = 'active'", (tuple ( data["bond_ids"] ),) )
+                active = cr.fetchone ()[0]
+            self.assertLessEqual ( used, limit )
+            self.assertEqual ( active, 1 )
+        finally :
+            self._cleanup ( data )
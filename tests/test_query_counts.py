@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from .common import BondsDataGenerator
+
+# Volumen fijo y pequeño: aquí se comprueba nº de consultas, no tiempos
+VOLUMES = {"partners" : 5, "families" : 10, "addenda" : 3, "orders" : 80, "bonds" : 40}
+
+
+@tagged ( "post_install", "-at_install" )
+class TestQueryCounts ( TransactionCase ) :
+    """
+    Regresión de nº de consultas: el mismo camino sobre pocos y sobre
+    muchos registros debe costar las mismas consultas (sin contar el
+    volcado posterior a BD, que escribe por registro).
+    """
+
+    @classmethod
+    def setUpClass(cls) :
+        super ().setUpClass ()
+        cls.data = BondsDataGenerator ( cls.env ).generate ( **VOLUMES )
+
+    def invalidate(self) :
+        self.env["base"].flush ()
+        self.env["base"].invalidate_cache ()
+
+    def _count_queries(self, func) :
+        self.invalidate ()
+        queries = self.env.cr.sql_log_count
+        func ()
+        return self.env.cr.sql_log_count - queries
+
+    def _recompute(self, records, fnames) :
+        for fname in fnames :
+            self.env.add_to_compute ( records._fields[fname], records )
+        records.recompute ( fnames )
+
+    def test_origin_document_constant_queries(self) :
+        """Pedidos efectivos + documento de origen: consultas fijas sea cual sea el lote."""
+        fnames = ["sale_order_ids", "origin_document"]
+        small, large = self.data.bonds[:2], self.data.bonds
+        expected = self._count_queries ( lambda : self._recompute ( small, fnames ) )
+        self.invalidate ()
+        with self.assertQueryCount ( expected, flush=False ) :
+            self._recompute ( large, fnames )
+
+    def test_smart_counts_constant_queries(self) :
+        """Contadores de los botones del contrato: una consulta agrupada por contador."""
+        fnames = ["child_count", "sale_order_count", "bond_count", "purchase_count"]
+        small, large = self.data.quotations[:2], self.data.quotations
+        expected = self._count_queries ( lambda : small.read ( fnames ) )
+        self.invalidate ()
+        with self.assertQueryCount ( expected, flush=False ) :
+            large.read ( fnames )
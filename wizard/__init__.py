@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+from . import bonds_import_wizard
+from . import bonds_pdf_import_wizard
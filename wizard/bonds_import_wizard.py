@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import base64
+import csv
+import io
+import itertools
+import logging
+import time
+
+from odoo import _, fields, models
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger ( __name__ )
+
+try :
+    import openpyxl
+except ImportError :  # pragma: no cover
+    openpyxl = None
+
+
+class BondsImportWizard ( models.TransientModel ) :
+    """
+    Importación masiva de avales desde CSV/XLSX.
+
+    Las filas se leen en streaming y se crean en bloques de `chunk_size`
+    (ver BondsOrder._import_bonds_rows), confirmando cada bloque. El progreso
+    queda en el propio asistente: si el proceso se interrumpe, volver a
+    lanzarlo continúa a partir de la última fila confirmada.
+    """
+    _name = "sid_bonds_import_wizard"
+    _description = "Importar avales"
+
+    file = fields.Binary ( string="Fichero", required=True )
+    filename = fields.Char ( string="Nombre de fichero" )
+    chunk_size = fields.Integer ( string="Filas por bloque", default=500 )
+
+    state = fields.Selection (
+        [("draft", "Pendiente"), ("done", "Terminado")],
+        default="draft",
+    )
+    rows_done = fields.Integer ( string="Filas procesadas", readonly=True )
+    created_count = fields.Integer ( string="Avales creados", readonly=True )
+    error_count = fields.Integer ( string="Filas con error", readonly=True )
+    error_log = fields.Text ( string="Errores", readonly=True )
+    rows_per_second = fields.Float ( string="Filas/segundo", readonly=True,
+                                     digits=(16, 1) )
+
+    def _iter_rows(self) :
+        """Genera (nº de fila, dict columna -> valor) sin cargar todo el fichero."""
+        self.ensure_one ()
+        raw = io.BytesIO ( base64.b64decode ( self.file ) )
+        name = (self.filename or "").lower ()
+
+        if name.endswith ( ".xlsx" ) :
+            if openpyxl is None :
+                raise UserError ( _ ( "Para importar XLSX es necesario instalar openpyxl." ) )
+            book = openpyxl.load_workbook ( raw, read_only=True, data_only=True )
+            rows = book.active.iter_rows ( values_only=True )
+            header = [str ( h or "" ).strip ().lower () for h in next ( rows, () )]
+            for line, values in enumerate ( rows, start=2 ) :
+                if any ( v not in (None, "") for v in values ) :
+                    yield line, dict ( zip ( header, values ) )
+            book.close ()
+            return
+
+        text = io.TextIOWrapper ( raw, encoding="utf-8-sig", newline="" )
+        sample = text.read ( 4096 )
+        text.seek ( 0 )
+        try :
+            dialect = csv.Sniffer ().sniff ( sample, delimiters=",;\t" )
+        except csv.Error :
+            dialect = csv.excel
+        reader = csv.DictReader ( text, dialect=dialect )
+        reader.fieldnames = [f.strip ().lower () for f in reader.fieldnames or []]
+        for line, row in enumerate ( reader, start=2 ) :
+            if any ( row.values () ) :
+                yield line, row
+
+    def action_import(self) :
+        self.ensure_one ()
+        Bonds = self.env["sid_bonds_orders"]
+        chunk_size = max ( self.chunk_size, 1 )
+        rows = itertools.islice ( self._iter_rows (), self.rows_done, None )
+
+        started = time.monotonic ()
+        processed = 0
+        while True :
+            chunk = list ( itertools.islice ( rows, chunk_size ) )
+            if not chunk :
+                break
+            bonds, errors = Bonds._import_bonds_rows ( chunk )
+            processed += len ( chunk )
+
+            log = "\n".join ( _ ( "Fila %(line)s: %(msg)s" ) % {"line" : line, "msg" : msg}
+                              for line, msg in errors )
+            self.write ( {
+                "rows_done" : self.rows_done + len ( chunk ),
+                "created_count" : self.created_count + len ( bonds ),
+                "error_count" : self.error_count + len ( errors ),
+                "error_log" : "\n".join ( filter ( None, [self.error_log, log] ) ),
+            } )
+            # bloque confirmado: una relanzada continúa desde aquí
+            if not self.env.registry.in_test_mode () :
+                self.env.cr.commit ()
+
+        elapsed = time.monotonic () - started
+        self.write ( {
+            "state" : "done",
+            "rows_per_second" : processed / elapsed if elapsed else 0.0,
+        } )
+        _logger.info ( "Importación de avales: %s filas en %.2fs (%.1f filas/s)",
+                       processed, elapsed, self.rows_per_second )
+
+        return {
+            "type" : "ir.actions.act_window",
+            "res_model" : self._name,
+            "res_id" : self.id,
+            "view_mode" : "form",
+            "target" : "new",
+        }
+
+    def action_open_imported(self) :
+        action = self.env.ref ( "sid_bankbonds_sales_module.action_bonds_orders" ).read ()[0]
+        action["context"] = {}
+        return action
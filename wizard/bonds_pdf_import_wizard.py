@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger ( __name__ )
+
+try :
+    import pdfminer
+except ImportError :  # pragma: no cover
+    pdfminer = None
+
+# Candidatos a referencia: palabras con al menos un dígito (AV-2024-001, 123456...)
+_TOKEN_RE = re.compile ( r"[\w./-]*\d[\w./-]*" )
+_MAX_FILE_SIZE = 50 * 1024 * 1024
+_MAX_TEXT_TOKENS = 5000
+_EXTRACTOR = os.path.join ( os.path.dirname ( __file__ ), "pdf_text_extractor.py" )
+_EXTRACTOR_TIMEOUT = 600
+
+
+def _reference_tokens(text) :
+    """Posibles referencias de aval en un texto (nombre de fichero o contenido)."""
+    tokens = set ()
+    for match in _TOKEN_RE.findall ( text or "" ) :
+        token = match.strip ( "._-/" )
+        if len ( token ) >= 3 :
+            tokens.update ( (token, token.upper ()) )
+        if len ( tokens ) >= _MAX_TEXT_TOKENS :
+            break
+    return tokens
+
+
+def _extract_pdf_texts(contents, workers) :
+    """
+    Texto de las primeras páginas de cada PDF de `contents`, en el mismo
+    orden. Los ficheros se reparten entre `workers` procesos nuevos de
+    pdf_text_extractor.py (pdfminer es Python puro: con hilos el GIL no deja
+    extraer en paralelo, y un fork del servidor arrastraría sus hilos,
+    bloqueos y conexiones a la BD). Los procesos no heredan nada de Odoo.
+    """
+    texts = [""] * len ( contents )
+    if not contents :
+        return texts
+    with tempfile.TemporaryDirectory ( prefix="sid_bonds_pdf_" ) as tmpdir :
+        paths = []
+        for index, content in enumerate ( contents ) :
+            path = os.path.join ( tmpdir, "%s.pdf" % index )
+            with open ( path, "wb" ) as f :
+                f.write ( content )
+            paths.append ( path )
+
+        groups = [list ( range ( len ( paths ) ) )[i : :workers] for i in range ( workers )]
+        running = [
+            (group, subprocess.Popen (
+                [sys.executable, _EXTRACTOR] + [paths[i] for i in group],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, close_fds=True ))
+            for group in groups if group
+        ]
+        for group, process in running :
+            try :
+                output, _err = process.communicate ( timeout=_EXTRACTOR_TIMEOUT )
+                results = json.loads ( output or b"[]" )
+            except (subprocess.TimeoutExpired, ValueError) :
+                process.kill ()
+                process.communicate ()
+                _logger.warning ( "No se pudo extraer el texto de %s PDF", len ( group ) )
+                continue
+            for index, text in zip ( group, results ) :
+                texts[index] = text or ""
+    return texts
+
+
+class BondsPdfImportWizard ( models.TransientModel ) :
+    """
+    Carga masiva de PDF de avales (varios ficheros y/o ZIP).
+
+    El asistente solo deja la carga en cola; la procesa en segundo plano
+    el cron ir_cron_sid_bonds_pdf_import, que se lanza al instante.
+    Los ficheros se recorren uno a uno (los ZIP se leen por miembros desde
+    el filestore) en bloques de `chunk_size`: se descartan los que ya están
+    como pdf_aval de algún aval (mismo checksum SHA1), se casan con un aval
+    por la referencia del nombre de fichero o, si no, del texto extraído en
+    procesos aparte (ver _extract_pdf_texts), y se escriben en pdf_aval,
+    confirmando cada bloque. La sincronización con Documents sigue siendo
+    la diferida del aval. Como en la importación de avales, si la carga se
+    interrumpe, relanzarla continúa donde se quedó.
+    """
+    _name = "sid_bonds_pdf_import_wizard"
+    _description = "Cargar PDF de avales"
+
+    attachment_ids = fields.Many2many (
+        "ir.attachment",
+        relation="sid_bonds_pdf_import_attachment_rel",
+        column1="wizard_id",
+        column2="attachment_id",
+        string="Ficheros (PDF o ZIP)",
+    )
+    chunk_size = fields.Integer ( string="Ficheros por bloque", default=50 )
+    use_text = fields.Boolean (
+        string="Buscar la referencia en el contenido",
+        default=True,
+        help="Si el nombre del fichero no identifica el aval, se busca su "
+             "referencia en el texto del PDF (requiere pdfminer.six).",
+    )
+    overwrite = fields.Boolean (
+        string="Sustituir PDF existentes",
+        help="Si no se marca, los avales que ya tienen PDF se dejan como están.",
+    )
+    workers = fields.Integer ( string="Procesos de extracción", default=4 )
+
+    state = fields.Selection (
+        [("draft", "Pendiente"), ("queued", "En cola"), ("done", "Terminado")],
+        default="draft",
+    )
+    files_done = fields.Integer ( string="Ficheros procesados", readonly=True )
+    linked_count = fields.Integer ( string="PDF vinculados", readonly=True )
+    duplicate_count = fields.Integer ( string="Duplicados", readonly=True )
+    unmatched_count = fields.Integer ( string="Sin aval", readonly=True )
+    skipped_count = fields.Integer ( string="Omitidos", readonly=True )
+    mb_done = fields.Float ( string="MB procesados", readonly=True, digits=(16, 1) )
+    files_per_second = fields.Float ( string="Ficheros/segundo", readonly=True,
+                                      digits=(16, 1) )
+    mb_per_second = fields.Float ( string="MB/segundo", readonly=True, digits=(16, 2) )
+    log = fields.Text ( string="Detalle", readonly=True )
+
+    def _iter_files(self) :
+        """
+        Genera (nombre, contenido) de cada PDF, uno a uno y en orden estable.
+        Los ZIP se abren sobre el fichero del filestore cuando lo hay, así
+        solo se descomprime en memoria el miembro en curso.
+        """
+        self.ensure_one ()
+        Attachment = self.env["ir.attachment"].sudo ()
+        for attachment in self.attachment_ids.sudo ().sorted ( "id" ) :
+            name = attachment.name or ""
+            if not name.lower ().endswith ( ".zip" ) :
+                yield name, attachment.raw or b""
+                continue
+
+            if attachment.store_fname :
+                source = Attachment._full_path ( attachment.store_fname )
+            else :
+                source = io.BytesIO ( attachment.raw or b"" )
+            try :
+                archive = zipfile.ZipFile ( source )
+            except zipfile.BadZipFile :
+                yield name, b""
+                continue
+            with archive :
+                for info in archive.infolist () :
+                    member = os.path.basename ( info.filename )
+                    if info.is_dir () or not member or info.filename.startswith ( "__MACOSX/" ) :
+                        continue
+                    if info.file_size > _MAX_FILE_SIZE :
+                        yield member, None
+                        continue
+                    yield member, archive.read ( info )
+
+    def action_import(self) :
+        """Deja la carga en cola para el cron; el asistente no espera a la extracción."""
+        self.ensure_one ()
+        if not self.attachment_ids :
+            raise UserError ( _ ( "Adjunta al menos un PDF o un ZIP." ) )
+        self.state = "queued"
+        cron = self.env.ref ( "sid_bankbonds_sales_module.ir_cron_sid_bonds_pdf_import",
+                              raise_if_not_found=False )
+        if cron :
+            cron.sudo ()._trigger ()
+        return self._action_reopen ()
+
+    def action_refresh(self) :
+        return self._action_reopen ()
+
+    def _action_reopen(self) :
+        return {
+            "type" : "ir.actions.act_window",
+            "res_model" : self._name,
+            "res_id" : self.id,
+            "view_mode" : "form",
+            "target" : "new",
+        }
+
+    @api.model
+    def _cron_process_imports(self) :
+        """Procesa las cargas en cola, una a una."""
+        for wizard in self.search ( [("state", "=", "queued")], order="id" ) :
+            try :
+                wizard._run_import ()
+            except Exception :
+                if self.env.registry.in_test_mode () :
+                    raise
+                # lo confirmado se conserva: relanzar continúa desde ahí
+                _logger.exception ( "Carga de PDF de avales %s interrumpida", wizard.id )
+                self.env.cr.rollback ()
+                wizard.write ( {
+                    "state" : "draft",
+                    "log" : "\n".join ( filter ( None, [
+                        wizard.log, _ ( "Carga interrumpida; vuelve a lanzarla para continuar." )] ) ),
+                } )
+            if not self.env.registry.in_test_mode () :
+                self.env.cr.commit ()
+
+    def _run_import(self) :
+        self.ensure_one ()
+        chunk_size = max ( self.chunk_size, 1 )
+        files = itertools.islice ( self._iter_files (), self.files_done, None )
+
+        started = time.monotonic ()
+        processed = size = 0
+        while True :
+            chunk = list ( itertools.islice ( files, chunk_size ) )
+            if not chunk :
+                break
+            stats, lines = self._process_chunk ( chunk )
+            chunk_bytes = sum ( len ( content or b"" ) for _name, content in chunk )
+            processed += len ( chunk )
+            size += chunk_bytes
+
+            self.write ( {
+                "files_done" : self.files_done + len ( chunk ),
+                "linked_count" : self.linked_count + stats["linked"],
+                "duplicate_count" : self.duplicate_count + stats["duplicate"],
+                "unmatched_count" : self.unmatched_count + stats["unmatched"],
+                "skipped_count" : self.skipped_count + stats["skipped"],
+                "mb_done" : self.mb_done + chunk_bytes / 1048576.0,
+                "log" : "\n".join ( filter ( None, [self.log] + lines ) ),
+            } )
+            # bloque confirmado: una relanzada continúa desde aquí
+            if not self.env.registry.in_test_mode () :
+                self.env.cr.commit ()
+
+        elapsed = time.monotonic () - started
+        self.write ( {
+            "state" : "done",
+            "files_per_second" : processed / elapsed if elapsed else 0.0,
+            "mb_per_second" : size / 1048576.0 / elapsed if elapsed else 0.0,
+        } )
+        _logger.info ( "Carga de PDF de avales: %s ficheros (%.1f MB) en %.2fs "
+                       "(%.1f ficheros/s)", processed, size / 1048576.0, elapsed,
+                       self.files_per_second )
+        # los ficheros subidos ya están en los avales (o descartados)
+        self.attachment_ids.sudo ().unlink ()
+
+    def _process_chunk(self, chunk) :
+        """
+        Trata un bloque [(nombre, contenido)]. Devuelve (contadores, líneas
+        de detalle). Tres consultas por bloque: checksums ya cargados,
+        referencias y PDF existentes de los avales casados.
+        """
+        Bonds = self.env["sid_bonds_orders"]
+        Attachment = self.env["ir.attachment"].sudo ()
+        stats = dict.fromkeys ( ("linked", "duplicate", "unmatched", "skipped"), 0 )
+        lines = []
+
+        # 1) checksum (mismo SHA1 que ir.attachment) y duplicados
+        pending = {}
+        for index, (name, content) in enumerate ( chunk ) :
+            if content is None :
+                stats["skipped"] += 1
+                lines.append ( _ ( "%s: fichero demasiado grande." ) % name )
+            elif not content.startswith ( b"%PDF" ) :
+                stats["skipped"] += 1
+                lines.append ( _ ( "%s: no es un PDF." ) % name )
+            else :
+                pending[index] = hashlib.sha1 ( content ).hexdigest ()
+
+        existing = {
+            att["checksum"] : att["res_id"]
+            for att in Attachment.search_read ( [
+                ("res_model", "=", Bonds._name),
+                ("res_field", "=", "pdf_aval"),
+                ("checksum", "in", list ( set ( pending.values () ) )),
+            ], ["checksum", "res_id"] )
+        } if pending else {}
+        seen = set ()
+        for index, checksum in list ( pending.items () ) :
+            if checksum in existing or checksum in seen :
+                del pending[index]
+                stats["duplicate"] += 1
+                bond = Bonds.browse ( existing.get ( checksum ) ).exists ()
+                lines.append ( _ ( "%(file)s: duplicado (%(bond)s)." ) % {
+                    "file" : chunk[index][0],
+                    "bond" : bond.display_name if bond else _ ( "repetido en la carga" ),
+                } )
+            seen.add ( checksum )
+
+        # 2) referencia en el nombre; si no, en el texto (procesos aparte)
+        matches = Bonds._match_pdf_references ( {
+            index : _reference_tokens ( os.path.splitext ( chunk[index][0] )[0] )
+            for index in pending
+        } )
+        unmatched = [index for index in pending if len ( matches.get ( index, () ) ) != 1]
+        if unmatched and self.use_text and pdfminer is not None :
+            texts = _extract_pdf_texts ( [chunk[index][1] for index in unmatched],
+                                         max ( self.workers, 1 ) )
+            by_text = Bonds._match_pdf_references ( {
+                index : _reference_tokens ( text ) for index, text in zip ( unmatched, texts )
+            } )
+            matches.update ( (index, bonds) for index, bonds in by_text.items () if bonds )
+
+        # 3) vinculación: un write por aval, en el bloque
+        matched = {index : matches.get ( index ) for index in pending}
+        bond_ids = [bonds.id for bonds in matched.values () if bonds and len ( bonds ) == 1]
+        with_pdf = set ( Attachment.search ( [
+            ("res_model", "=", Bonds._name),
+            ("res_field", "=", "pdf_aval"),
+            ("res_id", "in", bond_ids),
+        ] ).mapped ( "res_id" ) ) if bond_ids and not self.overwrite else set ()
+
+        for index, bonds in matched.items () :
+            name, content = chunk[index]
+            if not bonds :
+                stats["unmatched"] += 1
+                lines.append ( _ ( "%s: no se encontró el aval." ) % name )
+            elif len ( bonds ) > 1 :
+                stats["unmatched"] += 1
+                lines.append ( _ ( "%(file)s: varias referencias posibles (%(bonds)s)." ) % {
+                    "file" : name, "bonds" : ", ".join ( bonds.mapped ( "display_name" ) )} )
+            elif bonds.id in with_pdf :
+                stats["skipped"] += 1
+                lines.append ( _ ( "%(file)s: %(bond)s ya tiene PDF." ) % {
+                    "file" : name, "bond" : bonds.display_name} )
+            else :
+                bonds.write ( {"pdf_aval" : base64.b64encode ( content )} )
+                with_pdf.add ( bonds.id )
+                stats["linked"] += 1
+        return stats, lines
+
+    def action_open_bonds(self) :
+        action = self.env.ref ( "sid_bankbonds_sales_module.action_bonds_orders" ).read ()[0]
+        action["context"] = {}
+        return action
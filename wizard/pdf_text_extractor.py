@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Extracción de texto de PDF en un proceso aparte, sin Odoo ni base de datos.
+
+El asistente de carga de PDF lo lanza con subprocess (un proceso nuevo por
+grupo de ficheros, nada heredado del servidor):
+
+    python pdf_text_extractor.py fichero1.pdf [fichero2.pdf ...]
+
+Escribe en stdout una lista JSON con el texto de las primeras páginas de
+cada fichero, en el mismo orden; "" si no se puede leer o si no está
+instalado pdfminer.six.
+"""
+import json
+import sys
+
+MAX_PAGES = 3
+
+
+def extract(path) :
+    try :
+        from pdfminer.high_level import extract_text
+    except ImportError :
+        return ""
+    try :
+        return extract_text ( path, maxpages=MAX_PAGES )
+    except Exception :  # PDF dañado o no soportado: se queda sin casar
+        return ""
+
+
+def main(paths) :
+    json.dump ( [extract ( path ) for path in paths], sys.stdout )
+
+
+if __name__ == "__main__" :
+    main ( sys.argv[1 :] )